@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from esquema import colunas_status, rotulos_status
+
+# ==============================================================================
+# CUBO DE AGREGADOS (ano, rio, mês)
+# ==============================================================================
+# Cada célula guarda contagens e somas que podem ser somadas entre células;
+# assim os indicadores do painel saem do cubo, sem voltar às amostras.
+CAMINHO_CUBO = "data/processed/cubo_agregado.parquet"
+
+CHAVES_CUBO = ['ano', 'rio', 'mes']
+
+PARAMETROS_CUBO = [
+    "ph", "od", "turbidez", "temperatura", "condutividade", "std", "nitrogenio", "salinidade", "fosforo"
+]
+
+# Separador entre a coluna de status e o rótulo: "status_ph=OK"
+SEP_STATUS = "="
+
+
+def construir_cubo(df):
+    """Agrega as amostras tratadas por (ano, rio, mês)."""
+    base = df.dropna(subset=['data']).copy()
+    base['ano'] = base['data'].dt.year.astype('int32')
+    base['mes'] = base['data'].dt.month.astype('int8')
+    base['conforme'] = base['indice_problemas'] == 0
+    base['com_problema'] = base['indice_problemas'] > 0
+    grupos = base.groupby(CHAVES_CUBO, observed=True)
+
+    cubo = grupos.size().rename('n_amostras').to_frame()
+    cubo['n_conformes'] = grupos['conforme'].sum()
+    cubo['n_problemas'] = grupos['com_problema'].sum()
+
+    # Por parâmetro: soma, contagem (não nulos), mínimo e máximo
+    params = [p for p in PARAMETROS_CUBO if p in base.columns]
+    estat = grupos[params].agg(['sum', 'count', 'min', 'max'])
+    estat.columns = [f"{p}_{nome}" for p, nome in estat.columns]
+    estat = estat.rename(columns=lambda c: c.replace('_sum', '_soma').replace('_count', '_n'))
+    cubo = cubo.join(estat)
+
+    # Contagem de cada rótulo das colunas de status
+    for col in colunas_status(base):
+        base[col] = rotulos_status(base[col])
+        contagem = base.groupby(CHAVES_CUBO + [col], observed=True).size().unstack(col, fill_value=0)
+        contagem.columns = [f"{col}{SEP_STATUS}{rotulo}" for rotulo in contagem.columns]
+        cubo = cubo.join(contagem).fillna({c: 0 for c in contagem.columns})
+
+    cubo = cubo.reset_index()
+    cubo['rio'] = cubo['rio'].astype(str).astype('category')
+    return cubo
+
+
+def salvar_cubo(df, caminho=CAMINHO_CUBO):
+    cubo = construir_cubo(df)
+    tmp = caminho + ".tmp"
+    cubo.to_parquet(tmp, index=False)
+    os.replace(tmp, caminho)
+    return cubo
+
+
+def carregar_cubo(caminho=CAMINHO_CUBO):
+    if not os.path.exists(caminho):
+        return None
+    return pd.read_parquet(caminho)
+
+
+def filtrar_cubo(cubo, anos, rios):
+    return cubo[cubo['ano'].isin(list(anos)) & cubo['rio'].isin(list(rios))]
+
+
+def indicadores(cubo_sel):
+    """Total de amostras, % de conformidade e rio com mais amostras com problema."""
+    total = int(cubo_sel['n_amostras'].sum())
+    if total == 0:
+        return {'total': 0, 'percentual_aprovados': 0, 'rio_critico': "-"}
+
+    percentual = cubo_sel['n_conformes'].sum() / total * 100
+    problemas = cubo_sel.groupby('rio', observed=True)['n_problemas'].sum()
+    problemas = problemas[problemas > 0]
+    if problemas.empty:
+        rio_critico = "Nenhum"
+    else:
+        # Mesmo critério do mode(): maior contagem, empate pelo nome
+        problemas.index = problemas.index.astype(str)
+        rio_critico = problemas.sort_index().idxmax()
+    return {'total': total, 'percentual_aprovados': percentual, 'rio_critico': rio_critico}
+
+
+def contagem_status(cubo_sel, coluna_status):
+    """Equivalente ao value_counts() da coluna de status. None se a coluna não existir."""
+    prefixo = coluna_status + SEP_STATUS
+    cols = [c for c in cubo_sel.columns if c.startswith(prefixo)]
+    if not cols:
+        return None
+    contagem = cubo_sel[cols].sum()
+    contagem.index = [c[len(prefixo):] for c in cols]
+    contagem = contagem[contagem > 0].astype(int)
+    return contagem.sort_values(ascending=False, kind='stable')
+
+
+def serie_mensal(cubo_sel, coluna):
+    """
+    Média mensal do parâmetro (mesmo resultado do resample('ME').mean() das
+    amostras): soma e contagem de cada mês, somadas entre rios.
+    Retorna DataFrame com as colunas 'data' (fim do mês) e `coluna`.
+    """
+    if cubo_sel.empty or f"{coluna}_soma" not in cubo_sel.columns:
+        return pd.DataFrame({'data': pd.DatetimeIndex([]), coluna: np.array([], dtype=float)})
+
+    mensal = cubo_sel.groupby(['ano', 'mes'])[[f"{coluna}_soma", f"{coluna}_n"]].sum()
+    datas = pd.to_datetime(pd.DataFrame({
+        'year': mensal.index.get_level_values('ano'),
+        'month': mensal.index.get_level_values('mes'),
+        'day': 1
+    })) + pd.offsets.MonthEnd(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        medias = mensal[f"{coluna}_soma"].to_numpy() / mensal[f"{coluna}_n"].to_numpy()
+    serie = pd.Series(np.where(mensal[f"{coluna}_n"].to_numpy() > 0, medias, np.nan), index=datas)
+
+    # O resample também cria os meses vazios entre o primeiro e o último
+    meses = pd.date_range(serie.index.min(), serie.index.max(), freq='ME')
+    serie = serie.reindex(meses)
+    return pd.DataFrame({'data': serie.index, coluna: serie.to_numpy()})
+
+
+# ==============================================================================
+# ESTATÍSTICAS SUFICIENTES DA CORRELAÇÃO (ano, rio)
+# ==============================================================================
+# Para cada partição e cada par de parâmetros (x, y), somas sobre as amostras
+# em que os dois existem: n, Σx, Σy, Σx², Σy², Σxy. Somando as partições
+# selecionadas sai a matriz de Pearson exata (pares completos, como o
+# DataFrame.corr()) e o preenchimento de cada parâmetro (diagonal: n de x).
+# Vazio é NaN; 0 é uma medição.
+CAMINHO_MOMENTOS = "data/processed/momentos_correlacao.parquet"
+
+CHAVES_MOMENTOS = ['ano', 'rio']
+
+
+def construir_momentos(df, parametros=None):
+    """
+    Somas por (ano, rio, x, y). Os valores entram deslocados pela mediana do
+    parâmetro (colunas ref_x/ref_y): a correlação não muda e as somas de
+    quadrados não perdem precisão com parâmetros grandes (condutividade).
+    """
+    parametros = [p for p in (parametros or PARAMETROS_CUBO) if p in df.columns]
+    base = df.dropna(subset=['data'])
+    valores = base[parametros].to_numpy(dtype='float64', na_value=np.nan)
+    with np.errstate(all='ignore'):
+        referencia = np.nan_to_num(np.nanmedian(valores, axis=0)) if len(valores) else np.zeros(len(parametros))
+    validos = ~np.isnan(valores)
+    z = np.where(validos, valores - referencia, 0.0)
+    v = validos.astype('float64')
+
+    chaves = pd.DataFrame({'ano': base['data'].dt.year.astype('int32').to_numpy(),
+                           'rio': base['rio'].astype(str).to_numpy()})
+    x_idx, y_idx = np.meshgrid(np.arange(len(parametros)), np.arange(len(parametros)), indexing='ij')
+    x_idx, y_idx = x_idx.ravel(), y_idx.ravel()
+    partes = []
+    for (ano, rio), linhas in chaves.groupby(CHAVES_MOMENTOS, sort=True).indices.items():
+        zg, vg = z[linhas], v[linhas]
+        soma_x = zg.T @ vg  # [i, j] = Σ x_i nas linhas em que x_j também existe
+        soma_x2 = (zg * zg).T @ vg
+        partes.append(pd.DataFrame({
+            'ano': ano, 'rio': rio,
+            'x': np.array(parametros)[x_idx], 'y': np.array(parametros)[y_idx],
+            'n': (vg.T @ vg).ravel().astype('int64'),
+            'soma_x': soma_x.ravel(), 'soma_y': soma_x.T.ravel(),
+            'soma_x2': soma_x2.ravel(), 'soma_y2': soma_x2.T.ravel(),
+            'soma_xy': (zg.T @ zg).ravel(),
+            'n_linhas': len(linhas),
+        }))
+    colunas = ['ano', 'rio', 'x', 'y', 'n', 'soma_x', 'soma_y', 'soma_x2', 'soma_y2', 'soma_xy', 'n_linhas']
+    momentos = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=colunas)
+    momentos['ref_x'] = momentos['x'].map(dict(zip(parametros, referencia))).astype('float64')
+    momentos['ref_y'] = momentos['y'].map(dict(zip(parametros, referencia))).astype('float64')
+    momentos['ano'] = momentos['ano'].astype('int32')
+    momentos['rio'] = momentos['rio'].astype('category')
+    return momentos
+
+
+def salvar_momentos(df, caminho=CAMINHO_MOMENTOS):
+    momentos = construir_momentos(df)
+    tmp = caminho + ".tmp"
+    momentos.to_parquet(tmp, index=False)
+    os.replace(tmp, caminho)
+    return momentos
+
+
+def carregar_momentos(caminho=CAMINHO_MOMENTOS):
+    if not os.path.exists(caminho):
+        return None
+    return pd.read_parquet(caminho)
+
+
+def correlacao(momentos_sel, parametros=None):
+    """Matriz de Pearson (pares completos) das partições selecionadas."""
+    parametros = parametros or list(dict.fromkeys(momentos_sel['x']))
+    somas = momentos_sel.groupby(['x', 'y'], observed=True)[
+        ['n', 'soma_x', 'soma_y', 'soma_x2', 'soma_y2', 'soma_xy']].sum()
+    somas = somas.reindex(pd.MultiIndex.from_product([parametros, parametros], names=['x', 'y']), fill_value=0)
+
+    n = somas['n'].to_numpy(dtype='float64')
+    with np.errstate(all='ignore'):
+        cov = n * somas['soma_xy'].to_numpy() - somas['soma_x'].to_numpy() * somas['soma_y'].to_numpy()
+        var_x = n * somas['soma_x2'].to_numpy() - somas['soma_x'].to_numpy() ** 2
+        var_y = n * somas['soma_y2'].to_numpy() - somas['soma_y'].to_numpy() ** 2
+        r = cov / np.sqrt(var_x * var_y)
+    r = np.where((n >= 2) & (var_x > 0) & (var_y > 0), np.clip(r, -1.0, 1.0), np.nan)
+    r = r.reshape(len(parametros), len(parametros))
+    # Diagonal exata (o corr() do pandas também dá 1.0 para quem tem variância)
+    np.fill_diagonal(r, np.where(np.isnan(np.diag(r)), np.nan, 1.0))
+    return pd.DataFrame(r, index=parametros, columns=parametros)
+
+
+def preenchimento(momentos_sel, parametros=None):
+    """Percentual de amostras com valor (não nulo) de cada parâmetro."""
+    parametros = parametros or list(dict.fromkeys(momentos_sel['x']))
+    total = momentos_sel.groupby(CHAVES_MOMENTOS, observed=True)['n_linhas'].first().sum()
+    diagonal = momentos_sel[momentos_sel['x'] == momentos_sel['y']]
+    contagem = diagonal.groupby('x', observed=True)['n'].sum().reindex(parametros, fill_value=0)
+    # Mesmo formato do count() do pandas: sem nome e sem nome de índice
+    contagem = contagem.rename(None).rename_axis(None)
+    if total == 0:
+        return contagem.astype('float64') * np.nan
+    return contagem / total * 100
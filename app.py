@@ -1,12 +1,26 @@
+import hashlib
+import time
+
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_folium import st_folium
 import folium
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster
+from branca.colormap import LinearColormap
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 
+import agregados
+import atualizacao_dados
+import cache_figuras
+import armazenamento
+import esquema
+import indice_filtros
+import interpolacao
+import tendencias
+
 st.set_page_config(
     page_title="Monitoramento Hídrico - São Luís-MA",
     page_icon="💧",
@@ -23,64 +37,205 @@ st.markdown(
 
 st.markdown("----")
 
-@st.cache_data
-def carregar_dados():
-    try: 
-        df= pd.read_csv("data/processed/dados_tratados_tcc.csv")
-        df['data']=pd.to_datetime(df['data'], format="mixed", errors='coerce', dayfirst=True)
-        return df   
-    except FileNotFoundError:
-        return None
-df_raw = carregar_dados()
-
-if df_raw is None:  
+# Colunas que o painel realmente usa (o resto nem é lido da base colunar)
+COLUNAS_PAINEL = [
+    "data", "rio", "latitude", "longitude", "indice_problemas",
+    "ph", "od", "turbidez", "temperatura", "condutividade", "std", "nitrogenio", "salinidade", "fosforo",
+    "status_ph", "status_od", "status_turbidez"
+]
+
+# Cada carga é chaveada pela versão (hash do conteúdo, manifesto.py) do que lê:
+# quando o processamento grava dados novos só o que mudou é recarregado.
+# max_entries=2 mantém a versão anterior enquanto a nova é publicada.
+
+def _no_esquema(df):
+    return esquema.aplicar_esquema(df.reindex(columns=[c for c in COLUNAS_PAINEL if c in df.columns]))
+
+@st.cache_resource(max_entries=2)
+def carregar_particoes(versao_base):
+    # Só lista as pastas ano=/rio= da base Parquet gerada pelo processamento
+    return armazenamento.listar_particoes()
+
+@st.cache_resource(max_entries=32)
+def carregar_selecao(versao_base, anos, rios):
+    # Base particionada: lê só as partições (ano, rio) selecionadas, no esquema
+    # compacto. Uma cópia por seleção e processo, compartilhada por todas as
+    # sessões (cache_resource não copia a cada rerun); ninguém altera o frame.
+    return _no_esquema(armazenamento.ler_particoes(anos, rios, COLUNAS_PAINEL))
+
+@st.cache_resource(max_entries=2)
+def carregar_dados(versao_base):
+    # Base inteira: o CSV quando não há partições (filtrado pelo índice com
+    # .iloc, que com o copy-on-write do pandas não mexe na base) ou, com
+    # partições, só para montar um agregado que não veio gravado em arquivo
+    particoes = carregar_particoes(versao_base)
+    if particoes is not None and not particoes.empty:
+        df = armazenamento.ler_particoes(particoes['ano'].unique(), particoes['rio'].dropna().unique(), COLUNAS_PAINEL)
+    else:
+        try:
+            df = esquema.zeros_legados_como_vazio(pd.read_csv("data/processed/dados_tratados_tcc.csv"))
+        except FileNotFoundError:
+            return None
+    return _no_esquema(df)
+
+@st.cache_resource(max_entries=2)
+def carregar_indice(versao_base, _df):
+    # Montado uma vez por carga e compartilhado entre as sessões
+    dimensoes = {'ano': _df['data'].dt.year, 'rio': _df['rio']}
+    if 'municipio' in _df.columns:
+        dimensoes['municipio'] = _df['municipio']
+    return indice_filtros.construir_indice(dimensoes)
+
+@st.cache_resource(max_entries=2)
+def carregar_cubo(versao_cubo, versao_base):
+    # Cubo (ano, rio, mês) gravado pelo processamento; sem ele, monta uma vez aqui
+    cubo = agregados.carregar_cubo()
+    return cubo if cubo is not None else agregados.construir_cubo(carregar_dados(versao_base))
+
+@st.cache_resource(max_entries=2)
+def carregar_momentos(versao_momentos, versao_base):
+    # Somas por (ano, rio) para correlação e preenchimento; sem o arquivo, monta aqui
+    momentos = agregados.carregar_momentos()
+    return momentos if momentos is not None else agregados.construir_momentos(carregar_dados(versao_base))
+
+@st.cache_resource(max_entries=2)
+def carregar_tendencias(versao_tendencias, versao_base):
+    # Mann-Kendall/Sen e anomalias por rio e estação; sem o arquivo, monta aqui (só por rio)
+    tabela = tendencias.carregar_tendencias()
+    return tabela if tabela is not None else tendencias.construir_tendencias(carregar_dados(versao_base))[0]
+
+def chaves_versao(versoes):
+    # Base: partições ou CSV. Agregado sem arquivo é montado da base, então usa a versão dela
+    artefatos = versoes['artefatos']
+    base = f"{artefatos['particoes']}|{artefatos['csv']}"
+    chaves = {'base': base}
+    for nome in ('cubo', 'momentos', 'tendencias'):
+        chaves[nome] = artefatos[nome] or base
+    return chaves
+
+def opcoes_particoes(particoes):
+    # Anos (mais recente primeiro) e rios na ordem dos filtros; a seleção padrão é tudo
+    anos = tuple(sorted((int(a) for a in particoes['ano'].unique()), reverse=True))
+    return anos, tuple(sorted(particoes['rio'].dropna().unique()))
+
+def aquecer_caches(versoes):
+    # As mesmas cargas do script, para a versão nova já estar em cache ao ser publicada
+    chaves = chaves_versao(versoes)
+    particoes = carregar_particoes(chaves['base'])
+    if particoes is not None and not particoes.empty:
+        # Com partições, a seleção padrão (todos os anos e rios)
+        carregar_selecao(chaves['base'], *opcoes_particoes(particoes))
+    else:
+        df = carregar_dados(chaves['base'])
+        if df is None:
+            return
+        carregar_indice(chaves['base'], df)
+    carregar_cubo(chaves['cubo'], chaves['base'])
+    carregar_momentos(chaves['momentos'], chaves['base'])
+    carregar_tendencias(chaves['tendencias'], chaves['base'])
+
+def preparar_thread(thread):
+    # Threads que chamam funções em cache precisam do contexto do script
+    add_script_run_ctx(thread, get_script_run_ctx())
+
+versoes = atualizacao_dados.versoes_publicadas(aquecer_caches, preparar_thread)
+chaves = chaves_versao(versoes)
+df_particoes = carregar_particoes(chaves['base'])
+usa_particoes = df_particoes is not None and not df_particoes.empty
+df_raw = None if usa_particoes else carregar_dados(chaves['base'])
+
+if not usa_particoes and df_raw is None:  
     st.error("Erro: O arquivo de dados não foi encontrado. Por favor, verifique o caminho do arquivo e tente novamente.")
     st.info("Por favor, exporte o dataframe final do seu código Python e coloque na mesma pasta deste arquivo app.py.")
     st.stop()
 
 # Filtros
 
-df_raw['ano_filtro'] = df_raw['data'].dt.year.astype(int)
+if usa_particoes:
+    anos_opcoes, rios_opcoes = opcoes_particoes(df_particoes)
+else:
+    indice = carregar_indice(chaves['base'], df_raw)
+    anos_opcoes = indice_filtros.valores_disponiveis(indice, 'ano')
+    rios_opcoes = indice_filtros.valores_disponiveis(indice, 'rio')
 
 
 st.sidebar.header("Filtros de Análise")
 
 # Filtro do ano
-anos_disponiveis= sorted(df_raw['ano_filtro'].unique(), reverse = True)
+anos_disponiveis= sorted(anos_opcoes, reverse = True)
 anos_selecionados= st.sidebar.multiselect("Selecione os anos:", anos_disponiveis, default= anos_disponiveis)
 
 # Filtro de rio
-rios_disponiveis = sorted(df_raw['rio'].unique())
+rios_disponiveis = sorted(rios_opcoes)
 rios_selecionados = st.sidebar.multiselect("Selecione os rios:", rios_disponiveis, default= rios_disponiveis)
 
-# Aplicação de filtros
-df_filtrado = df_raw[
-    (df_raw['ano_filtro'].isin(anos_selecionados)) &
-    (df_raw['rio'].isin(rios_selecionados))
-]
+# Atualização dos dados (processamento em segundo plano)
+
+# Com processamento rodando ou versão nova carregando, o painel confere mais vezes
+INTERVALO_VERIFICACAO_S = 30
+INTERVALO_ATUALIZACAO_S = 3
+
+estado_etl = atualizacao_dados.estado_etl()
+em_andamento = (estado_etl is not None and estado_etl['rodando']) or atualizacao_dados.aquecendo() is not None
+
+@st.fragment(run_every=INTERVALO_ATUALIZACAO_S if em_andamento else INTERVALO_VERIFICACAO_S)
+def painel_atualizacao():
+    estado = atualizacao_dados.estado_etl()
+    publicadas = atualizacao_dados.versoes_publicadas(aquecer_caches, preparar_thread)
+    if publicadas['versao'] != versoes['versao']:
+        # Versão nova já em cache: refaz a página com ela
+        st.rerun()
+
+    gerado_em = versoes['gerado_em']
+    quando = time.strftime('%d/%m/%Y %H:%M', time.localtime(gerado_em)) if gerado_em else "-"
+    st.caption(f"Versão dos dados: {versoes['versao']} ({quando})")
+    if atualizacao_dados.aquecendo() is not None:
+        st.info("🔄 Carregando a versão nova dos dados...")
+    rodando = estado is not None and estado['rodando']
+    if rodando:
+        st.info("⚙️ Processamento em andamento...")
+    elif estado is not None and estado['codigo'] != 0:
+        st.error(f"O último processamento falhou (código {estado['codigo']}).")
+        st.code(estado['log'])
+
+    incremental = st.checkbox("Só linhas novas ou alteradas", value=True)
+    if st.button("Reprocessar planilha", disabled=rodando):
+        atualizacao_dados.iniciar_etl(incremental, aquecer_caches, preparar_thread)
+        st.rerun()
+
+with st.sidebar:
+    st.header("Dados")
+    painel_atualizacao()
 
+# Aplicação de filtros
+if usa_particoes:
+    # Base particionada: lê só as partições (ano, rio) selecionadas
+    df_filtrado = carregar_selecao(chaves['base'], tuple(anos_selecionados), tuple(rios_selecionados))
+else:
+    # Interseção dos bitmaps do índice, sem varrer as colunas de texto
+    posicoes = indice_filtros.filtrar_posicoes(indice, ano=anos_selecionados, rio=rios_selecionados)
+    df_filtrado = df_raw.iloc[posicoes]
 
-# Indicadores principais
 
-col1, col2, col3, col4 = st.columns(4)
+# Chave dos gráficos renderizados: mesma seleção + mesma versão = mesma figura
+chave_selecao = hashlib.sha1(repr((
+    sorted(int(a) for a in anos_selecionados), sorted(str(r) for r in rios_selecionados)
+)).encode()).hexdigest()[:16]
+versao = versoes['versao']
 
-total_amostras = len(df_filtrado)
 
+# Indicadores principais (somando as células do cubo dos anos/rios selecionados)
 
-if total_amostras > 0:
-    # Cálculo de aprovação: Se indice_problemas == 0, então aprovado
-    qtd_aprovados = len(df_filtrado[df_filtrado['indice_problemas'] == 0])
-    percentual_aprovados = (qtd_aprovados/total_amostras) * 100
+cubo = carregar_cubo(chaves['cubo'], chaves['base'])
+cubo_sel = agregados.filtrar_cubo(cubo, anos_selecionados, rios_selecionados)
 
-    df_problemas = df_filtrado[df_filtrado['indice_problemas'] > 0]
-    if not df_problemas.empty:
-        rio_critico_nome = df_problemas['rio'].mode()[0]
-    else:
-        rio_critico_nome= "Nenhum"
+col1, col2, col3, col4 = st.columns(4)
 
-else:
-    percentual_aprovados = 0
-    rio_critico_nome = "-"
+# Cálculo de aprovação: Se indice_problemas == 0, então aprovado
+kpis = agregados.indicadores(cubo_sel)
+total_amostras = kpis['total']
+percentual_aprovados = kpis['percentual_aprovados']
+rio_critico_nome = kpis['rio_critico']
 
 col1.metric("Amostras analisadas", total_amostras)
 col2.metric("Índice de conformidade", f"{percentual_aprovados:.2f} %")
@@ -90,42 +245,100 @@ col4.metric("Parâmetros vilão", "Oxigênio Dissolvido", delta="Alerta Ambienta
 
 st.subheader("Mapa de Vulnerabilidade Hídrica")
 
-if not df_filtrado.empty:
-    centro = [df_filtrado['latitude'].mean(), df_filtrado['longitude'].mean()]
-    m = folium.Map(location=centro, zoom_start=11, tiles='CartoDB positron')
-    marker_cluster = MarkerCluster().add_to(m)
+# Colunas enviadas ao navegador, na ordem em que o callback JS as lê (row[0], row[1], ...)
+COLUNAS_MAPA = [
+    "latitude", "longitude", "rio", "data_txt", "indice_problemas",
+    "ph", "od", "turbidez", "status_ph", "status_od", "status_turbidez"
+]
 
-    def cor_status(n_problemas):
-        if n_problemas == 0: return 'green'   # Tudo certo
-        if n_problemas == 1: return 'orange'  # Atenção
-        return 'red'                          # Crítico (2 ou mais problemas)
+# Cada ponto vira marcador no navegador; o HTML do popup só é montado no clique.
+CALLBACK_MARCADOR = """
+function (row) {
+    // Verde: tudo certo | Laranja: atenção | Vermelho: crítico (2 ou mais problemas)
+    var cor = row[4] == 0 ? 'green' : (row[4] == 1 ? 'orange' : 'red');
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({icon: 'info-sign', markerColor: cor, prefix: 'glyphicon'})
+    });
+    marker.bindPopup(function () {
+        var conforme = row[4] == 0;
+        return '<div style="font-family: sans-serif; font-size: 12px; width:220px">' +
+            '<b>Rio:</b> ' + row[2] + '<br>' +
+            '<b>Data:</b> ' + row[3] + '<br><hr>' +
+            '<b>Status Geral:</b> <span style="color:' + (conforme ? 'green' : 'red') + '; font-weight:bold;">' +
+            (conforme ? 'CONFORME' : 'NÃO CONFORME') + '</span><br>' +
+            '(Problemas identificados: ' + row[4] + ')<br><br>' +
+            '<b>pH:</b> ' + row[5] + ' <span style="color:gray; font-size:10px">(' + row[8] + ')</span><br>' +
+            '<b>OD:</b> ' + row[6] + ' mg/L <span style="color:gray; font-size:10px">(' + row[9] + ')</span><br>' +
+            '<b>Turbidez:</b> ' + row[7] + ' NTU <span style="color:gray; font-size:10px">(' + row[10] + ')</span>' +
+            '</div>';
+    }, {maxWidth: 250});
+    return marker;
+}
+"""
+
+@st.cache_resource(max_entries=32)
+def pontos_mapa(chave_filtro, _df):
+    """
+    Linhas dos marcadores montadas de uma vez a partir das colunas (sem laço
+    por linha). Fica em cache por seleção de filtros: trocar só a camada
+    interpolada não refaz os marcadores.
+    """
+    pontos = esquema.para_exibicao(_df.assign(data_txt=_df['data'].dt.strftime('%d/%m/%Y')))
+    pontos = pontos.reindex(columns=COLUNAS_MAPA)
+    pontos = pontos.astype(object).where(pontos.notna(), None)
+    centro = [_df['latitude'].mean(), _df['longitude'].mean()]
+    return centro, pontos.values.tolist()
 
-    for _, row in df_filtrado.iterrows():
-        # Lógica do Status Texto
-        status_texto = "CONFORME" if row['indice_problemas'] == 0 else "NÃO CONFORME"
-        cor_texto = "green" if row['indice_problemas'] == 0 else "red"
-        
-        # HTML do Popup
-        html = f"""
-        <div style="font-family: sans-serif; font-size: 12px; width:220px">
-            <b>Rio:</b> {row['rio']}<br>
-            <b>Data:</b> {row['data'].strftime('%d/%m/%Y')}<br>
-            <hr>
-            <b>Status Geral:</b> <span style="color:{cor_texto}; font-weight:bold;">{status_texto}</span><br>
-            (Problemas identificados: {row['indice_problemas']})<br>
-            <br>
-            <b>pH:</b> {row['ph']} <span style="color:gray; font-size:10px">({row['status_ph']})</span><br>
-            <b>OD:</b> {row['od']} mg/L <span style="color:gray; font-size:10px">({row['status_od']})</span><br>
-            <b>Turbidez:</b> {row['turbidez']} NTU <span style="color:gray; font-size:10px">({row['status_turbidez']})</span>
-        </div>
-        """
-        folium.Marker(
-            location=[row['latitude'], row['longitude']],
-            popup=folium.Popup(html, max_width=250),
-            icon=folium.Icon(color=cor_status(row['indice_problemas']), icon='info-sign')
-        ).add_to(marker_cluster)
-
-    st_folium(m, width=None, height=500)
+
+@st.cache_resource(max_entries=32)
+def montar_mapa(chave_filtro, chave_camada, _df, _camada):
+    """Mapa com os marcadores e, por baixo, a superfície interpolada (se houver)."""
+    centro, linhas = pontos_mapa(chave_filtro, _df)
+    m = folium.Map(location=centro, zoom_start=11, tiles='CartoDB positron')
+    if _camada is not None:
+        folium.raster_layers.ImageOverlay(
+            image=interpolacao.url_png(_camada['png']), bounds=interpolacao.limites_folium(),
+            name=_camada['nome'], interactive=False, zindex=1
+        ).add_to(m)
+        LinearColormap(interpolacao.cores_legenda(_camada['coluna']), vmin=_camada['vmin'],
+                       vmax=_camada['vmax'], caption=f"{_camada['nome']} (IDW)").add_to(m)
+    FastMarkerCluster(linhas, callback=CALLBACK_MARCADOR).add_to(m)
+    return m
+
+# Parâmetros que podem virar superfície interpolada (IDW) sob os marcadores
+CAMADAS_INTERPOLACAO = {
+    "Nenhuma": None,
+    "Oxigênio Dissolvido (mg/L)": "od",
+    "pH": "ph",
+    "Turbidez (NTU)": "turbidez",
+    "Temperatura (°C)": "temperatura",
+    "Condutividade (µS/cm)": "condutividade",
+    "Salinidade (‰)": "salinidade",
+    "Fósforo Total (mg/L)": "fosforo",
+    "Nitrogênio Amoniacal (mg/L)": "nitrogenio",
+}
+
+if not df_filtrado.empty:
+    nome_camada = st.selectbox("Superfície interpolada (IDW):", list(CAMADAS_INTERPOLACAO.keys()))
+    coluna_camada = CAMADAS_INTERPOLACAO[nome_camada]
+    camada = None
+    if coluna_camada is not None:
+        estacoes_camada = interpolacao.pontos_por_estacao(df_filtrado, coluna_camada)
+        if len(estacoes_camada) >= interpolacao.MIN_ESTACOES:
+            vmin, vmax = interpolacao.escala(estacoes_camada['valor'])
+            # PNG da superfície no cache de figuras: voltar a um parâmetro já visto é imediato
+            png = cache_figuras.obter_bytes(
+                ('idw', coluna_camada, chave_selecao, versao),
+                lambda: interpolacao.camada_png(estacoes_camada, coluna_camada, vmin, vmax)
+            )
+            camada = {'png': png, 'coluna': coluna_camada, 'nome': nome_camada, 'vmin': vmin, 'vmax': vmax}
+        else:
+            st.caption(f"Menos de {interpolacao.MIN_ESTACOES} estações com {nome_camada} na seleção: sem superfície.")
+
+    chave_filtro = (chaves['base'], tuple(anos_selecionados), tuple(rios_selecionados))
+    m = montar_mapa(chave_filtro, (coluna_camada, versao) if camada else None, df_filtrado, camada)
+    # returned_objects=[]: mover/zoom no mapa não dispara rerun do script
+    st_folium(m, width=None, height=500, returned_objects=[])
 else:
     st.warning("Nenhum dado encontrado para os filtros selecionados.")
 
@@ -138,41 +351,49 @@ tab1, tab2, tab3 = st.tabs([
     ])
 
 with tab1:
-    if not df_filtrado.empty:
+    if total_amostras > 0:
         col_g1, col_g2, col_g3 = st.columns(3)
         
         # Função para plotar, usando as colunas 'status_ph', 'status_od', etc.
+        def desenhar_barra(contagem, titulo):
+            fig, ax = plt.subplots(figsize=(5,4))
+            
+            # Define cores (ajuste as chaves conforme o texto exato do seu CSV)
+            # Exemplo: Se no CSV estiver "Dentro do Padrão" e "Fora do Padrão"
+            paleta_cores = {
+                'Dentro do Padrão': '#2ecc71', # Verde
+                'Fora do Padrão': '#e74c3c',   # Vermelho
+                'Sem Dado': '#95a5a6',          # Cinza
+                # Adicione variações se necessário, ex: "Conforme", "Não Conforme"
+                'Conforme': '#2ecc71',
+                'Não Conforme': '#e74c3c',
+                # Rótulos gerados pelo processamento_dados.py
+                'OK': '#2ecc71',
+                'Fora': '#e74c3c'
+            }
+            
+            sns.barplot(x=contagem.index, y=contagem.values, ax=ax, palette=paleta_cores, hue = contagem.index)
+            ax.set_title(titulo)
+            ax.set_ylabel("Qtd. Amostras")
+            ax.set_xlabel("")
+            
+            # Rótulos nas barras
+            for p in ax.patches:
+                if p.get_height() > 0:
+                    ax.annotate(f'{int(p.get_height())}', 
+                                (p.get_x() + p.get_width() / 2., p.get_height()), 
+                                ha='center', va='bottom')
+            return fig
+
         def plotar_barra(coluna_status, titulo, local_plot):
-            if coluna_status in df_filtrado.columns:
-                fig, ax = plt.subplots(figsize=(5,4))
-                
-                # Conta os valores
-                contagem = df_filtrado[coluna_status].value_counts()
-                
-                # Define cores (ajuste as chaves conforme o texto exato do seu CSV)
-                # Exemplo: Se no CSV estiver "Dentro do Padrão" e "Fora do Padrão"
-                paleta_cores = {
-                    'Dentro do Padrão': '#2ecc71', # Verde
-                    'Fora do Padrão': '#e74c3c',   # Vermelho
-                    'Sem Dado': '#95a5a6',          # Cinza
-                    # Adicione variações se necessário, ex: "Conforme", "Não Conforme"
-                    'Conforme': '#2ecc71',
-                    'Não Conforme': '#e74c3c'
-                }
-                
-                sns.barplot(x=contagem.index, y=contagem.values, ax=ax, palette=paleta_cores, hue = contagem.index)
-                ax.set_title(titulo)
-                ax.set_ylabel("Qtd. Amostras")
-                ax.set_xlabel("")
-                
-                # Rótulos nas barras
-                for p in ax.patches:
-                    if p.get_height() > 0:
-                        ax.annotate(f'{int(p.get_height())}', 
-                                    (p.get_x() + p.get_width() / 2., p.get_height()), 
-                                    ha='center', va='bottom')
-                                    
-                local_plot.pyplot(fig)
+            # Conta os valores (contagens já prontas no cubo)
+            contagem = agregados.contagem_status(cubo_sel, coluna_status)
+            if contagem is not None:
+                png = cache_figuras.obter_png(
+                    ('barra', coluna_status, chave_selecao, versao),
+                    lambda: desenhar_barra(contagem, titulo)
+                )
+                local_plot.image(png, width="stretch")
             else:
                 local_plot.warning(f"Coluna {coluna_status} não encontrada.")
         
@@ -225,72 +446,92 @@ with tab2:
     coluna = cfg['col']
     
     # 3. Verificação e Plotagem
-    if not df_filtrado.empty and coluna in df_filtrado.columns:
+    if total_amostras > 0 and f"{coluna}_soma" in cubo_sel.columns:
         
-        # Agrupa por mês para suavizar (Média Mensal)
-        # 'ME' é o alias novo do pandas para Month End (antigo 'M')
-        df_temp = df_filtrado.set_index('data').resample('ME')[coluna].mean().reset_index()
+        # Agrupa por mês para suavizar (Média Mensal, a partir das somas do cubo)
+        df_temp = agregados.serie_mensal(cubo_sel, coluna)
 
         # Verifica se há dados válidos após o resample
         if df_temp[coluna].notna().sum() > 0:
             
-            fig2, ax = plt.subplots(figsize=(12, 5))
+            def desenhar_tendencia():
+                fig2, ax = plt.subplots(figsize=(12, 5))
             
-            # Plota a linha de tendência
-            sns.lineplot(
-                data=df_temp, x='data', y=coluna, 
-                marker='o', color=cfg['cor'], linewidth=2, label='Média Mensal'
-            )
-
-            # --- Lógica das Linhas de Limite (CONAMA) ---
-            if cfg['tipo_lim'] == 'min':
-                lim = cfg['limite']
-                plt.axhline(lim, color='red', linestyle='--', label=f'Mínimo ({lim})')
-                plt.fill_between(df_temp['data'], 0, lim, color='red', alpha=0.1)
-
-            elif cfg['tipo_lim'] == 'max':
-                lim = cfg['limite']
-                plt.axhline(lim, color='red', linestyle='--', label=f'Máximo ({lim})')
-                # Teto visual dinâmico
-                max_y = df_temp[coluna].max()
-                teto = max(max_y, lim) * 1.2 if pd.notna(max_y) else lim * 1.2
-                plt.fill_between(df_temp['data'], lim, teto, color='red', alpha=0.1)
-
-            elif cfg['tipo_lim'] == 'range':
-                lim_min, lim_max = cfg['limite']
-                plt.axhline(lim_min, color='red', linestyle='--', label=f'Min ({lim_min})')
-                plt.axhline(lim_max, color='red', linestyle='--', label=f'Max ({lim_max})')
-                plt.fill_between(df_temp['data'], 0, lim_min, color='red', alpha=0.1)
+                # Plota a linha de tendência
+                sns.lineplot(
+                    data=df_temp, x='data', y=coluna, 
+                    marker='o', color=cfg['cor'], linewidth=2, label='Média Mensal'
+                )
+
+                # --- Lógica das Linhas de Limite (CONAMA) ---
+                if cfg['tipo_lim'] == 'min':
+                    lim = cfg['limite']
+                    plt.axhline(lim, color='red', linestyle='--', label=f'Mínimo ({lim})')
+                    plt.fill_between(df_temp['data'], 0, lim, color='red', alpha=0.1)
+
+                elif cfg['tipo_lim'] == 'max':
+                    lim = cfg['limite']
+                    plt.axhline(lim, color='red', linestyle='--', label=f'Máximo ({lim})')
+                    # Teto visual dinâmico
+                    max_y = df_temp[coluna].max()
+                    teto = max(max_y, lim) * 1.2 if pd.notna(max_y) else lim * 1.2
+                    plt.fill_between(df_temp['data'], lim, teto, color='red', alpha=0.1)
+
+                elif cfg['tipo_lim'] == 'range':
+                    lim_min, lim_max = cfg['limite']
+                    plt.axhline(lim_min, color='red', linestyle='--', label=f'Min ({lim_min})')
+                    plt.axhline(lim_max, color='red', linestyle='--', label=f'Max ({lim_max})')
+                    plt.fill_between(df_temp['data'], 0, lim_min, color='red', alpha=0.1)
                 
-                # Definindo teto para o gráfico de pH
-                plt.fill_between(df_temp['data'], lim_max, 14, color='red', alpha=0.1)
-                plt.ylim(4, 10) 
-
-            # Configurações Finais do Gráfico
-            plt.title(f"Evolução Temporal: {parametro_selecionado}")
-            plt.ylabel(cfg['ylabel'])
-            plt.xlabel("Data")
-            plt.legend()
-            plt.grid(True, linestyle=':', alpha=0.6)
+                    # Definindo teto para o gráfico de pH
+                    plt.fill_between(df_temp['data'], lim_max, 14, color='red', alpha=0.1)
+                    plt.ylim(4, 10) 
+
+                # Configurações Finais do Gráfico
+                plt.title(f"Evolução Temporal: {parametro_selecionado}")
+                plt.ylabel(cfg['ylabel'])
+                plt.xlabel("Data")
+                plt.legend()
+                plt.grid(True, linestyle=':', alpha=0.6)
+                return fig2
             
-            st.pyplot(fig2)
+            st.image(cache_figuras.obter_png(('tendencia', coluna, chave_selecao, versao), desenhar_tendencia), width="stretch")
     else:
         st.warning("Sem dados suficientes para gerar o gráfico temporal com os filtros atuais.")
 
+    # Ranking dos rios pela tendência do parâmetro (tabela pronta do processamento)
+    ranking = tendencias.ranking(carregar_tendencias(chaves['tendencias'], chaves['base']), coluna, 'rio', rios_selecionados)
+    if not ranking.empty:
+        st.markdown(f"**Tendência por rio: {parametro_selecionado}**")
+        st.caption(
+            "Teste de Mann-Kendall e inclinação de Sen sobre as médias mensais de todo o período monitorado. "
+            f"Anomalias: meses fora da faixa robusta (mediana e MAD) dos {tendencias.JANELA_ANOMALIA} meses com dado anteriores."
+        )
+        tabela_ranking = pd.DataFrame({
+            "Rio": ranking['rio'].astype(str),
+            "Tendência": ranking['tendencia'].astype(str),
+            f"Sen ({cfg['ylabel']}/ano)": ranking['sen_por_ano'].round(3),
+            "p-valor": ranking['p_valor'].round(4),
+            "Meses com dado": ranking['n_meses'],
+            "Anomalias": ranking['n_anomalias'],
+            "Período": ranking['inicio'].dt.strftime('%m/%Y') + " a " + ranking['fim'].dt.strftime('%m/%Y'),
+        })
+        st.dataframe(tabela_ranking, hide_index=True, width="stretch")
+
 with tab3:
     st.markdown("### Análise de Correlação e Disponibilidade de Dados")
     st.markdown("""
                 *Esta seção visa atender ao rigor científico, analisando a matriz de correção físico-químicos e identificando a consistência do monitoramento
                 """)
     
-    if not df_filtrado.empty:
+    if total_amostras > 0:
         cols_analise = [
             "ph", "od", "turbidez", "temperatura", "condutividade", "std","nitrogenio","salinidade","fosforo"
         ]
         
-        df_cientifico = df_filtrado[cols_analise].copy()
-        
-        df_cientifico = df_cientifico.replace(0.0, float('nan'))
+        # Soma as estatísticas das partições (ano, rio) selecionadas, sem voltar às amostras
+        momentos = carregar_momentos(chaves['momentos'], chaves['base'])
+        momentos_sel = agregados.filtrar_cubo(momentos, anos_selecionados, rios_selecionados)
         
         col_c1, col_c2 = st.columns([1,1])
         
@@ -300,36 +541,40 @@ with tab3:
             st.caption("Percentual de amostras com dados válidos (não nulos) no período selecionado")
             
             # Cálculo de porcentagem de preenchimento
-            total = len(df_cientifico)
-            preenchimento = (df_cientifico.count() / total) * 100
+            preenchimento = agregados.preenchimento(momentos_sel, cols_analise)
             df_missing = pd.DataFrame(preenchimento, columns=['% Preenchimento']).sort_values('% Preenchimento', ascending=True)
             
-            fig_miss, ax_miss = plt.subplots(figsize=(6,6))
-            sns.barplot(x=df_missing['% Preenchimento'], y= df_missing.index, ax= ax_miss, palette="viridis", hue=df_missing.index)
-            ax_miss.set_xlabel("% de Dados Disponíveis")
-            ax_miss.set_xlim(0,100)
-            ax_miss.grid(axis="x", linestyle="--", alpha=0.5)
-            
-            for i, v in enumerate(df_missing["% Preenchimento"]):
-                ax_miss.text(v + 1, i, f"{v:.1f}", va="center", fontsize=9)
+            def desenhar_preenchimento():
+                fig_miss, ax_miss = plt.subplots(figsize=(6,6))
+                sns.barplot(x=df_missing['% Preenchimento'], y= df_missing.index, ax= ax_miss, palette="viridis", hue=df_missing.index)
+                ax_miss.set_xlabel("% de Dados Disponíveis")
+                ax_miss.set_xlim(0,100)
+                ax_miss.grid(axis="x", linestyle="--", alpha=0.5)
+                
+                for i, v in enumerate(df_missing["% Preenchimento"]):
+                    ax_miss.text(v + 1, i, f"{v:.1f}", va="center", fontsize=9)
+                return fig_miss
             
-            st.pyplot(fig_miss)
+            st.image(cache_figuras.obter_png(('preenchimento', None, chave_selecao, versao), desenhar_preenchimento), width="stretch")
             
         # Matriz de Correlação (Pearson)            
         with col_c2:
             st.markdown("Matriz de Correlação (Pearson)")
             st.caption("Indica como as variáevis interagem. (1= Correlação Positiva Perfeita, -1 = Negativa Perfeita)")
             
-            corr = df_cientifico.corr()
-            
-            fig_corr, ax_corr = plt.subplots(figsize=(8,8))
-            mask = np.triu(np.ones_like(corr, dtype=bool))
+            corr = agregados.correlacao(momentos_sel, cols_analise)
             
-            sns.heatmap(corr, mask=mask, cmap="coolwarm", vmin=1, vmax=1, center=0,
-                        annot=True, fmt=".2f", square=True, linewidths=.5, cbar_kws={"shrink": .5})
+            def desenhar_correlacao():
+                fig_corr, ax_corr = plt.subplots(figsize=(8,8))
+                mask = np.triu(np.ones_like(corr, dtype=bool))
+                
+                sns.heatmap(corr, mask=mask, cmap="coolwarm", vmin=1, vmax=1, center=0,
+                            annot=True, fmt=".2f", square=True, linewidths=.5, cbar_kws={"shrink": .5})
+                
+                plt.xticks(rotation=45, ha="right")
+                return fig_corr
             
-            plt.xticks(rotation=45, ha="right")
-            st.pyplot(fig_corr)
+            st.image(cache_figuras.obter_png(('correlacao', None, chave_selecao, versao), desenhar_correlacao), width="stretch")
             
         
         # Insights
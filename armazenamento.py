@@ -0,0 +1,184 @@
+import os
+import shutil
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from esquema import aplicar_esquema
+
+# ==============================================================================
+# BASE COLUNAR PARTICIONADA (Parquet, partições ano=/rio=)
+# ==============================================================================
+CAMINHO_PARTICOES = "data/processed/particoes"
+# Modo por município: uma partição municipio=<nome>/ por município
+CAMINHO_MUNICIPIOS = "data/processed/municipios"
+
+# Mesmo marcador que o pyarrow usa para chave de partição vazia
+PARTICAO_NULA = "__HIVE_DEFAULT_PARTITION__"
+
+
+
+def _preparar_tipos(df):
+    """Base no esquema compacto (esquema.py) mais a coluna 'ano' das partições."""
+    df = aplicar_esquema(df)
+    df['ano'] = df['data'].dt.year.astype('int32')
+    return df
+
+
+def _chave_particao(ano, rio):
+    """(ano, rio) comparável em conjuntos: rio vazio vira None (NaN != NaN)."""
+    return int(ano), None if pd.isna(rio) else str(rio)
+
+
+def _caminho_particao(raiz, ano, rio):
+    rio = PARTICAO_NULA if pd.isna(rio) else quote(str(rio), safe='')
+    return os.path.join(raiz, f"ano={int(ano)}", f"rio={rio}")
+
+
+def _gravar_parquet(tabela, pasta):
+    """
+    Grava parte-0.parquet com troca atômica do arquivo: quem lê a base ao mesmo
+    tempo vê o arquivo antigo ou o novo, nunca um pela metade. O temporário
+    começa com '.', que o pyarrow ignora ao listar a base.
+    """
+    arquivo = os.path.join(pasta, "parte-0.parquet")
+    temporario = os.path.join(pasta, ".parte-0.parquet.tmp")
+    pq.write_table(tabela, temporario)
+    os.replace(temporario, arquivo)
+
+
+def salvar_particionado(df, raiz=CAMINHO_PARTICOES, particoes=None):
+    """
+    Grava o DataFrame tratado particionado por ano e rio.
+    particoes=None reescreve a base inteira (troca atômica do diretório);
+    um conjunto de pares (ano, rio) reescreve só essas partições (troca
+    atômica de cada arquivo), e df precisa ser a base inteira: se a base
+    ainda não existe, ela é gravada completa.
+    """
+    df = _preparar_tipos(df)
+    if particoes is not None and not os.path.isdir(raiz):
+        particoes = None
+    if particoes is not None:
+        particoes = {_chave_particao(ano, rio) for ano, rio in particoes}
+    destino = raiz + ".tmp" if particoes is None else raiz
+    if particoes is None and os.path.exists(destino):
+        shutil.rmtree(destino)
+
+    grupos = df.groupby(['ano', 'rio'], dropna=False, observed=True)
+    escritas = set()
+    for (ano, rio), grupo in grupos:
+        if particoes is not None and _chave_particao(ano, rio) not in particoes:
+            continue
+        pasta = _caminho_particao(destino, ano, rio)
+        os.makedirs(pasta, exist_ok=True)
+        # As chaves de partição ficam no caminho, não no arquivo
+        tabela = pa.Table.from_pandas(grupo.drop(columns=['ano', 'rio']), preserve_index=False)
+        _gravar_parquet(tabela, pasta)
+        escritas.add(_chave_particao(ano, rio))
+
+    if particoes is None:
+        antigo = raiz + ".old"
+        if os.path.exists(raiz):
+            os.replace(raiz, antigo)
+        os.replace(destino, raiz)
+        if os.path.exists(antigo):
+            shutil.rmtree(antigo)
+    else:
+        # Partições que ficaram vazias (linhas apagadas) somem da base
+        for ano, rio in set(particoes) - escritas:
+            pasta = _caminho_particao(raiz, ano, rio)
+            if os.path.exists(pasta):
+                shutil.rmtree(pasta)
+
+
+def particoes_diferentes(anterior, atual):
+    """
+    Pares (ano, rio) cujo conteúdo gravado muda de `anterior` para `atual`:
+    linhas novas, removidas ou com algum valor diferente (a ordem das linhas
+    não conta). Compara uma impressão de cada linha no esquema das partições.
+    """
+    anterior, atual = _preparar_tipos(anterior), _preparar_tipos(atual)
+    if set(anterior.columns) != set(atual.columns):
+        # Outro esquema: todas as partições mudam
+        return {_chave_particao(a, r) for df in (anterior, atual) for a, r in zip(df['ano'], df['rio'])}
+    atual = atual[anterior.columns]
+
+    # +1 por linha de antes, -1 por linha de depois: sobra saldo onde a
+    # mesma impressão não aparece o mesmo número de vezes nos dois lados
+    lados = [pd.DataFrame({'ano': df['ano'].to_numpy(), 'rio': df['rio'].astype(object).to_numpy(),
+                           'impressao': pd.util.hash_pandas_object(df.drop(columns=['ano', 'rio']),
+                                                                   index=False).to_numpy(),
+                           'saldo': sinal})
+             for df, sinal in ((anterior, 1), (atual, -1))]
+    saldo = pd.concat(lados).groupby(['ano', 'rio', 'impressao'], dropna=False)['saldo'].sum()
+    mudou = saldo[saldo != 0].index
+    return {_chave_particao(ano, rio) for ano, rio, _ in mudou}
+
+
+def _caminho_municipio(raiz, municipio):
+    return os.path.join(raiz, f"municipio={quote(str(municipio), safe='')}")
+
+
+def salvar_municipio(df, municipio, raiz=CAMINHO_MUNICIPIOS):
+    """
+    Grava (troca atômica do arquivo) a partição de um município. Cada processo
+    do ETL por município escreve só a sua, então não há disputa entre eles.
+    """
+    df = _preparar_tipos(df)
+    pasta = _caminho_municipio(raiz, municipio)
+    os.makedirs(pasta, exist_ok=True)
+    tabela = pa.Table.from_pandas(df.drop(columns=['municipio'], errors='ignore'), preserve_index=False)
+    _gravar_parquet(tabela, pasta)
+
+
+def remover_municipio(municipio, raiz=CAMINHO_MUNICIPIOS):
+    pasta = _caminho_municipio(raiz, municipio)
+    if os.path.exists(pasta):
+        shutil.rmtree(pasta)
+
+
+def listar_municipios(raiz=CAMINHO_MUNICIPIOS):
+    """Municípios com partição gravada (lidos dos nomes das pastas)."""
+    if not os.path.isdir(raiz):
+        return []
+    return sorted(unquote(nome.split("=", 1)[1]) for nome in os.listdir(raiz) if nome.startswith("municipio="))
+
+
+def ler_municipios(raiz=CAMINHO_MUNICIPIOS, colunas=None):
+    """Base do estado inteiro: todas as partições por município (None se não houver)."""
+    if not listar_municipios(raiz):
+        return None
+    dataset = _abrir(raiz)
+    if colunas is not None:
+        colunas = [c for c in colunas if c in dataset.schema.names]
+    return dataset.to_table(columns=colunas).to_pandas()
+
+
+def _abrir(raiz):
+    particionamento = ds.HivePartitioning.discover(infer_dictionary=True)
+    return ds.dataset(raiz, format='parquet', partitioning=particionamento)
+
+
+def listar_particoes(raiz=CAMINHO_PARTICOES):
+    """Pares (ano, rio) disponíveis, lidos só dos nomes das pastas."""
+    if not os.path.isdir(raiz):
+        return None
+    pares = [ds.get_partition_keys(f.partition_expression) for f in _abrir(raiz).get_fragments()]
+    return pd.DataFrame(pares, columns=['ano', 'rio'])
+
+
+def ler_particoes(anos, rios, colunas=None, raiz=CAMINHO_PARTICOES):
+    """
+    Lê apenas as partições dos anos/rios pedidos e apenas as colunas pedidas
+    (o filtro é resolvido pelo caminho das pastas, sem abrir os outros arquivos).
+    """
+    dataset = _abrir(raiz)
+    if colunas is not None:
+        colunas = [c for c in colunas if c in dataset.schema.names]
+    filtro = (ds.field('ano').isin(pa.array([int(a) for a in anos], type=pa.int32())) &
+              ds.field('rio').isin(pa.array([str(r) for r in rios], type=pa.string())))
+    tabela = dataset.to_table(columns=colunas, filter=filtro)
+    return tabela.to_pandas()
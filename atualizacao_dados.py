@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import manifesto
+
+# ==============================================================================
+# ATUALIZAÇÃO DOS DADOS COM O PAINEL NO AR
+# ==============================================================================
+# O processamento roda num subprocesso em segundo plano e termina gravando o
+# manifesto (manifesto.py). O painel continua servindo a versão "publicada"
+# enquanto uma thread aquece os caches com a versão nova; só depois disso a
+# versão publicada troca (uma atribuição), então nenhuma sessão espera a
+# carga fria. Artefatos cujo hash não mudou nem são recarregados.
+# O estado vive no módulo: é um só para todas as sessões do processo.
+CAMINHO_LOG_ETL = "data/processed/etl_segundo_plano.log"
+SCRIPT_ETL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "processamento_dados.py")
+LINHAS_LOG = 15
+
+_trava = threading.Lock()
+_publicadas = None
+_aquecendo = None
+_execucao = None
+
+
+def _publicar(aquecer, novas):
+    """Carrega a versão nova nos caches e só então a publica."""
+    global _publicadas, _aquecendo
+    try:
+        aquecer(novas)
+        with _trava:
+            _publicadas = novas
+    finally:
+        with _trava:
+            _aquecendo = None
+
+
+def versoes_publicadas(aquecer, preparar_thread=None):
+    """
+    Versões que as sessões devem usar neste rerun. Na primeira chamada aquece
+    e publica a versão do disco na hora (não há o que servir antes). Depois,
+    se o manifesto mudou, aquece a nova numa thread e segue devolvendo a
+    anterior até terminar. preparar_thread(thread) roda antes do start (o
+    Streamlit precisa anexar o contexto do script à thread).
+    """
+    global _aquecendo
+    atuais = manifesto.versoes()
+    with _trava:
+        publicadas, aquecendo = _publicadas, _aquecendo
+    if publicadas is None:
+        _publicar(aquecer, atuais)
+        return atuais
+    if atuais['versao'] != publicadas['versao'] and aquecendo is None:
+        with _trava:
+            _aquecendo = atuais
+        thread = threading.Thread(target=_publicar, args=(aquecer, atuais), daemon=True)
+        if preparar_thread is not None:
+            preparar_thread(thread)
+        thread.start()
+    return publicadas
+
+
+def aquecendo():
+    """Versão nova sendo carregada nos caches (None se nenhuma)."""
+    with _trava:
+        return _aquecendo
+
+
+def _acompanhar(processo, aquecer, preparar_thread):
+    codigo = processo.wait()
+    with _trava:
+        _execucao.update(fim=time.time(), codigo=codigo)
+    # Terminou bem: já aquece a versão nova, sem esperar o próximo rerun
+    if codigo == 0 and aquecer is not None:
+        versoes_publicadas(aquecer, preparar_thread)
+
+
+def iniciar_etl(incremental=True, aquecer=None, preparar_thread=None):
+    """
+    Dispara o processamento_dados.py em segundo plano (saída em CAMINHO_LOG_ETL).
+    Devolve False se já houver um rodando.
+    """
+    global _execucao
+    with _trava:
+        if _execucao is not None and _execucao['codigo'] is None:
+            return False
+        comando = [sys.executable, SCRIPT_ETL] + (["--incremental"] if incremental else [])
+        with open(CAMINHO_LOG_ETL, 'w', encoding='utf-8') as log:
+            processo = subprocess.Popen(comando, stdout=log, stderr=subprocess.STDOUT)
+        _execucao = {'inicio': time.time(), 'fim': None, 'codigo': None, 'incremental': incremental}
+    thread = threading.Thread(target=_acompanhar, args=(processo, aquecer, preparar_thread), daemon=True)
+    if preparar_thread is not None:
+        preparar_thread(thread)
+    thread.start()
+    return True
+
+
+def estado_etl():
+    """Última execução em segundo plano (None se nenhuma) com o fim do log."""
+    with _trava:
+        if _execucao is None:
+            return None
+        estado = dict(_execucao)
+    try:
+        with open(CAMINHO_LOG_ETL, encoding='utf-8', errors='replace') as f:
+            estado['log'] = "".join(f.readlines()[-LINHAS_LOG:])
+    except FileNotFoundError:
+        estado['log'] = ""
+    estado['rodando'] = estado['codigo'] is None
+    return estado
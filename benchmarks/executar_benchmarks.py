@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import agregados
+import esquema
+import indice_filtros
+import nomes
+import qualidade
+import tendencias
+from benchmarks.gerar_dados import TAMANHOS, caminho_bruto, caminho_tratado, gerar
+from estacoes import novo_registro
+from processamento_dados import (FINAL_LAT_MAX, FINAL_LAT_MIN, FINAL_LON_MAX, FINAL_LON_MIN,
+                                 classificar_conama, converter_datas, corrigir_coordenadas_vetorizado,
+                                 imputar_rios, selecionar_colunas)
+
+# ==============================================================================
+# BENCHMARKS POR ETAPA (ETL E CAMINHOS DE DADOS DO PAINEL)
+# ==============================================================================
+# Cada etapa roda sobre os dados sintéticos de benchmarks/gerar_dados.py e o
+# tempo vai para um JSON em benchmarks/resultados/. Com --comparar, as etapas
+# que ficaram mais lentas que a execução de referência são apontadas.
+PASTA_RESULTADOS = "benchmarks/resultados"
+REPETICOES = 3
+# Razão de tempo (atual / referência) a partir da qual a etapa é regressão
+LIMIAR_REGRESSAO = 1.25
+
+PARAMETROS = ["ph", "od", "turbidez", "temperatura", "condutividade", "std", "nitrogenio", "salinidade", "fosforo"]
+
+
+def medir(funcao, repeticoes):
+    """Roda `funcao` algumas vezes; devolve (último resultado, tempos em segundos)."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, {
+        "min": min(tempos),
+        "mediana": statistics.median(tempos),
+        "repeticoes": repeticoes,
+    }
+
+
+def benchmark_etl(n, repeticoes):
+    """Etapas do executar_etl, uma a uma, sobre a planilha bruta sintética."""
+    etapas = {}
+    # Ler o Excel domina o tempo e não varia entre repetições: roda uma vez
+    df, etapas["carregar"] = medir(lambda: selecionar_colunas(pd.read_excel(caminho_bruto(n))), 1)
+    linhas = {"bruto": len(df)}
+
+    datas, etapas["datas"] = medir(lambda: converter_datas(df["data"]), repeticoes)
+    df["data"] = datas
+    df = df.dropna(subset=["data"])
+
+    def normalizar():
+        return nomes.padronizar_coluna(df["municipio"], "municipio"), nomes.padronizar_coluna(df["rio"], "rio")
+
+    def normalizar_sem_memo():
+        nomes.reiniciar_memo()
+        return normalizar()
+
+    (municipio, rio), etapas["normalizacao"] = medir(normalizar_sem_memo, repeticoes)
+    _, etapas["normalizacao_memo"] = medir(normalizar, repeticoes)
+    df["municipio"], df["rio"] = municipio, rio
+    df = df[df["municipio"] == "SAO LUIS"].copy()
+    linhas["sao_luis"] = len(df)
+
+    def corrigir():
+        return (corrigir_coordenadas_vetorizado(df["latitude"], "lat")[0],
+                corrigir_coordenadas_vetorizado(df["longitude"], "lon")[0])
+
+    (df["latitude"], df["longitude"]), etapas["coordenadas"] = medir(corrigir, repeticoes)
+    df = df.dropna(subset=["latitude", "longitude"])
+
+    def geofencing():
+        mask = (df["latitude"].between(FINAL_LAT_MIN, FINAL_LAT_MAX) &
+                df["longitude"].between(FINAL_LON_MIN, FINAL_LON_MAX))
+        return df[mask].copy()
+
+    df, etapas["geofencing"] = medir(geofencing, repeticoes)
+    linhas["geo"] = len(df)
+
+    # Registro de estações do zero (substituiu o KNN de imputação de rios)
+    (df, _), etapas["estacoes"] = medir(lambda: imputar_rios(df.copy(), novo_registro()), repeticoes)
+
+    for col in PARAMETROS:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    (df, _), etapas["qualidade"] = medir(lambda: qualidade.marcar_qualidade(df.copy()), repeticoes)
+    df, etapas["classificacao"] = medir(lambda: classificar_conama(df.copy()), repeticoes)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        destino = os.path.join(pasta, "saida.csv")
+        _, etapas["csv"] = medir(lambda: df.to_csv(destino, index=False), repeticoes)
+    return etapas, linhas
+
+
+def benchmark_painel(n, repeticoes):
+    """Caminhos de dados do app.py (filtros, séries e correlação) sobre a base tratada."""
+    etapas = {}
+
+    def carregar():
+        df = pd.read_csv(caminho_tratado(n))
+        df["data"] = pd.to_datetime(df["data"], format="mixed", errors="coerce", dayfirst=True)
+        return df
+
+    df, etapas["carregar"] = medir(carregar, 1)
+    linhas = {"tratado": len(df)}
+    # O painel trabalha sobre a base no esquema compacto
+    df, etapas["esquema"] = medir(lambda: esquema.aplicar_esquema(df), repeticoes)
+
+    # Seleção típica: metade dos anos e metade dos rios
+    anos = sorted(df["data"].dt.year.dropna().unique())
+    rios = sorted(df["rio"].dropna().unique())
+    anos_sel, rios_sel = anos[::2], rios[::2]
+
+    indice, etapas["indice"] = medir(
+        lambda: indice_filtros.construir_indice({"ano": df["data"].dt.year, "rio": df["rio"]}), repeticoes)
+    filtrado, etapas["filtragem_indice"] = medir(
+        lambda: df.iloc[indice_filtros.filtrar_posicoes(indice, ano=anos_sel, rio=rios_sel)], repeticoes)
+    _, etapas["filtragem_isin"] = medir(
+        lambda: df[df["data"].dt.year.isin(anos_sel) & df["rio"].isin(rios_sel)], repeticoes)
+    linhas["filtrado"] = len(filtrado)
+
+    cubo, etapas["cubo"] = medir(lambda: agregados.construir_cubo(df), repeticoes)
+    cubo_sel = agregados.filtrar_cubo(cubo, anos_sel, rios_sel)
+    _, etapas["resample"] = medir(
+        lambda: filtrado.set_index("data")["od"].resample("ME").mean(), repeticoes)
+    _, etapas["serie_mensal_cubo"] = medir(lambda: agregados.serie_mensal(cubo_sel, "od"), repeticoes)
+
+    cientifico = filtrado[PARAMETROS]
+    _, etapas["preenchimento"] = medir(lambda: cientifico.count() / len(cientifico) * 100, repeticoes)
+    _, etapas["correlacao"] = medir(lambda: cientifico.corr(), repeticoes)
+
+    momentos, etapas["momentos"] = medir(lambda: agregados.construir_momentos(df), repeticoes)
+    momentos_sel = agregados.filtrar_cubo(momentos, anos_sel, rios_sel)
+    _, etapas["preenchimento_momentos"] = medir(
+        lambda: agregados.preenchimento(momentos_sel, PARAMETROS), repeticoes)
+    _, etapas["correlacao_momentos"] = medir(lambda: agregados.correlacao(momentos_sel, PARAMETROS), repeticoes)
+
+    # Mann-Kendall/Sen e anomalias de todas as séries (rio e estação) de uma vez
+    _, etapas["tendencias"] = medir(lambda: tendencias.construir_tendencias(df), repeticoes)
+    return etapas, linhas
+
+
+def metadados():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "data": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "maquina": platform.platform(),
+        "nucleos": os.cpu_count(),
+    }
+
+
+def executar(tamanhos=TAMANHOS, repeticoes=REPETICOES):
+    gerar(tamanhos)
+    resultado = {"metadados": metadados(), "tamanhos": {}}
+    for n in tamanhos:
+        print(f"\n--- {n} linhas ---")
+        # Com 1M de linhas uma passada já é estável (e as repetições custam caro)
+        rep = 1 if n >= 1_000_000 else repeticoes
+        etl, linhas_etl = benchmark_etl(n, rep)
+        painel, linhas_painel = benchmark_painel(n, rep)
+        resultado["tamanhos"][str(n)] = {
+            "etl": etl, "painel": painel, "linhas": {**linhas_etl, **linhas_painel}
+        }
+        for grupo, etapas in (("etl", etl), ("painel", painel)):
+            for etapa, tempo in etapas.items():
+                print(f"{grupo:<7} {etapa:<20} {tempo['min'] * 1000:>10.1f} ms")
+    return resultado
+
+
+def salvar_resultado(resultado, pasta=PASTA_RESULTADOS):
+    os.makedirs(pasta, exist_ok=True)
+    meta = resultado["metadados"]
+    nome = f"{meta['data'].replace(':', '')}_{meta['commit'] or 'sem-commit'}.json"
+    caminho = os.path.join(pasta, nome)
+    with open(caminho, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Resultados salvos em: {caminho}")
+    return caminho
+
+
+def comparar(atual, referencia, limiar=LIMIAR_REGRESSAO):
+    """Imprime a razão de tempo (mínimo) de cada etapa; devolve as regressões."""
+    regressoes = []
+    print(f"\nComparação com {referencia['metadados'].get('commit')} ({referencia['metadados'].get('data')}):")
+    for n, dados in atual["tamanhos"].items():
+        base = referencia["tamanhos"].get(n)
+        if base is None:
+            continue
+        for grupo in ("etl", "painel"):
+            for etapa, tempo in dados[grupo].items():
+                antes = base.get(grupo, {}).get(etapa)
+                if antes is None or antes["min"] == 0:
+                    continue
+                razao = tempo["min"] / antes["min"]
+                marca = "⚠️" if razao >= limiar else "  "
+                print(f"{marca} {n:>8} {grupo:<7} {etapa:<20} {razao:>6.2f}x")
+                if razao >= limiar:
+                    regressoes.append((n, grupo, etapa, razao))
+    return regressoes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks por etapa do ETL e do painel")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS, metavar="N",
+                        help="tamanhos dos conjuntos sintéticos (padrão: 1000 100000 1000000)")
+    parser.add_argument("--repeticoes", type=int, default=REPETICOES)
+    parser.add_argument("--comparar", metavar="JSON", help="resultado anterior para apontar regressões")
+    args = parser.parse_args()
+
+    resultado = executar(args.tamanhos, args.repeticoes)
+    salvar_resultado(resultado)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
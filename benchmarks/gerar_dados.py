@@ -0,0 +1,232 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from processamento_dados import MAPA_COLUNAS, classificar_conama
+
+# ==============================================================================
+# GERADOR DE DADOS SINTÉTICOS PARA OS BENCHMARKS
+# ==============================================================================
+# Planilhas brutas com as mesmas colunas do Excel real (MAPA_COLUNAS) e os
+# mesmos defeitos: coordenadas sem vírgula (-25000), texto com vírgula, sinal
+# trocado, datas em formatos misturados, rios vazios e nomes com variações.
+# Também gera bases já tratadas (como o dados_tratados_tcc.csv) para os
+# caminhos de dados do painel.
+PASTA_DADOS = "benchmarks/dados"
+TAMANHOS = [1_000, 100_000, 1_000_000]
+
+# Nome original do Excel de cada coluna curta
+COLUNA_EXCEL = {curta: excel for excel, curta in MAPA_COLUNAS.items()}
+
+# Rios da ilha com variações de grafia como aparecem na planilha
+RIOS_SAO_LUIS = {
+    "RIO ANIL": ["Rio Anil", "rio anil", "R. Anil", "Rio  Anil "],
+    "RIO BACANGA": ["Rio Bacanga", "RIO BACANGA", "R. Bacanga"],
+    "RIO CALHAU": ["Rio Calhau", "rio calhau"],
+    "RIO TIBIRI": ["Rio Tibiri", "Rio Tibirí"],
+    "RIO ITAPIRACO": ["Rio Itapiracó", "Rio Itapiraco"],
+    "RIO JAGUAREMA": ["Rio Jaguarema"],
+    "RIO DOS CACHORROS": ["Rio dos Cachorros", "Rio Cachorros"],
+    "RIO PACIENCIA": ["Rio Paciência", "Rio Paciencia"],
+}
+MUNICIPIOS_SAO_LUIS = ["São Luís", "SAO LUIS", "Sao Luis ", "são luís"]
+
+# Outros municípios (caem no filtro) com um retângulo aproximado cada
+OUTROS_MUNICIPIOS = {
+    "Barreirinhas": (-2.85, -2.65, -42.95, -42.70),
+    "Codó": (-4.55, -4.35, -43.95, -43.80),
+    "Caxias": (-4.95, -4.80, -43.40, -43.30),
+    "Bacabal": (-4.30, -4.15, -44.85, -44.70),
+}
+RIOS_OUTROS = ["Rio Itapecuru", "Itapecuru", "Rio Munim", "Rio Munin", "Rio Mearim", "Rio Preguiça"]
+
+# Faixas plausíveis (média, desvio) de cada parâmetro
+PARAMETROS = {
+    "ph": (7.2, 0.8), "od": (5.5, 2.0), "turbidez": (40.0, 35.0), "temperatura": (29.0, 1.5),
+    "condutividade": (20000.0, 15000.0), "std": (300.0, 250.0), "fosforo": (0.12, 0.1),
+    "nitrogenio": (1.2, 1.0), "salinidade": (15.0, 10.0),
+}
+
+# Limites finos de São Luís, onde ficam as estações sintéticas
+LIMITES_ILHA = (-2.80, -2.30, -44.50, -44.00)
+ESTACOES_POR_RIO = 3
+
+
+def _estacoes(rng):
+    """Centros das estações de cada rio (sorteados dentro da ilha)."""
+    lat_min, lat_max, lon_min, lon_max = LIMITES_ILHA
+    centros = {}
+    for rio in RIOS_SAO_LUIS:
+        centros[rio] = np.column_stack([
+            rng.uniform(lat_min + 0.05, lat_max - 0.05, ESTACOES_POR_RIO),
+            rng.uniform(lon_min + 0.05, lon_max - 0.05, ESTACOES_POR_RIO),
+        ])
+    return centros
+
+
+def _corromper_coordenadas(rng, valores):
+    """
+    Mistura de formatos: float correto (60%), sem separador decimal (20%, ex.
+    -2.5 -> -25000), texto com vírgula (8%), sinal positivo (5%), vazio (4%)
+    e lixo (3%).
+    """
+    n = len(valores)
+    sorteio = rng.random(n)
+    saida = valores.astype(object)
+
+    sem_ponto = sorteio < 0.20
+    escala = 10.0 ** rng.integers(3, 8, n)
+    saida[sem_ponto] = np.round(valores[sem_ponto] * escala[sem_ponto]).astype('int64')
+
+    virgula = (sorteio >= 0.20) & (sorteio < 0.28)
+    saida[virgula] = [f"{v:.6f}".replace('.', ',') for v in valores[virgula]]
+
+    positivo = (sorteio >= 0.28) & (sorteio < 0.33)
+    saida[positivo] = -valores[positivo]
+
+    saida[(sorteio >= 0.33) & (sorteio < 0.37)] = None
+    saida[(sorteio >= 0.37) & (sorteio < 0.40)] = "S/N"
+    return saida
+
+
+def _datas_misturadas(rng, datas):
+    """Timestamp (60%), dd/mm/aaaa (25%), aaaa-mm-dd (10%) e datas impossíveis (5%)."""
+    sorteio = rng.random(len(datas))
+    saida = np.array(datas.to_pydatetime(), dtype=object)
+    br = (sorteio >= 0.60) & (sorteio < 0.85)
+    saida[br] = [f"{d.day}/{d.month}/{d.year}" for d in datas[br]]
+    iso = (sorteio >= 0.85) & (sorteio < 0.95)
+    saida[iso] = [d.strftime('%Y-%m-%d') for d in datas[iso]]
+    invalida = sorteio >= 0.95
+    saida[invalida] = [f"30/02/{d.year}" for d in datas[invalida]]
+    return saida
+
+
+def gerar_bruto(n, semente=42):
+    """DataFrame com as colunas do Excel bruto (nomes originais)."""
+    rng = np.random.default_rng(semente)
+    centros = _estacoes(rng)
+
+    # 60% São Luís (a parte que sobrevive ao filtro), o resto de outros municípios
+    da_ilha = rng.random(n) < 0.6
+    municipio = np.empty(n, dtype=object)
+    municipio[da_ilha] = rng.choice(MUNICIPIOS_SAO_LUIS, da_ilha.sum())
+    outros = list(OUTROS_MUNICIPIOS)
+    municipio[~da_ilha] = rng.choice(outros, (~da_ilha).sum())
+
+    lat = np.empty(n)
+    lon = np.empty(n)
+    rio = np.empty(n, dtype=object)
+
+    # Amostras da ilha: estação sorteada + variação de GPS (~50 m)
+    nomes = list(RIOS_SAO_LUIS)
+    idx_rio = rng.integers(0, len(nomes), n)
+    idx_estacao = rng.integers(0, ESTACOES_POR_RIO, n)
+    for i, nome in enumerate(nomes):
+        mask = da_ilha & (idx_rio == i)
+        lat[mask] = centros[nome][idx_estacao[mask], 0] + rng.normal(0, 0.0005, mask.sum())
+        lon[mask] = centros[nome][idx_estacao[mask], 1] + rng.normal(0, 0.0005, mask.sum())
+        variantes = RIOS_SAO_LUIS[nome]
+        rio[mask] = [variantes[k] for k in rng.integers(0, len(variantes), mask.sum())]
+
+    for nome, (lat_min, lat_max, lon_min, lon_max) in OUTROS_MUNICIPIOS.items():
+        mask = municipio == nome
+        lat[mask] = rng.uniform(lat_min, lat_max, mask.sum())
+        lon[mask] = rng.uniform(lon_min, lon_max, mask.sum())
+        rio[mask] = rng.choice(RIOS_OUTROS, mask.sum())
+
+    # 30% sem nome de rio (o ETL imputa pela estação)
+    rio[rng.random(n) < 0.3] = None
+
+    datas = pd.to_datetime("2017-01-01") + pd.to_timedelta(rng.integers(0, 7 * 365, n), unit='D')
+    df = pd.DataFrame({
+        COLUNA_EXCEL['municipio']: municipio,
+        COLUNA_EXCEL['rio']: rio,
+        COLUNA_EXCEL['data']: _datas_misturadas(rng, pd.DatetimeIndex(datas)),
+        COLUNA_EXCEL['latitude']: _corromper_coordenadas(rng, lat),
+        COLUNA_EXCEL['longitude']: _corromper_coordenadas(rng, lon),
+    })
+    for col, (media, desvio) in PARAMETROS.items():
+        valores = np.abs(rng.normal(media, desvio, n)).round(3)
+        valores[rng.random(n) < 0.15] = np.nan
+        df[COLUNA_EXCEL[col]] = valores
+    # Colunas que o ETL ignora, para o Excel ter a largura do real
+    df["Hora (hh:mm)"] = "09:30:00"
+    df["OBSERVAÇÕES"] = None
+    return df
+
+
+def gerar_tratado(n, semente=42):
+    """Base tratada (mesmas colunas do dados_tratados_tcc.csv), só São Luís."""
+    rng = np.random.default_rng(semente)
+    centros = _estacoes(rng)
+    nomes = list(RIOS_SAO_LUIS)
+    idx_rio = rng.integers(0, len(nomes), n)
+    idx_estacao = rng.integers(0, ESTACOES_POR_RIO, n)
+    lat = np.empty(n)
+    lon = np.empty(n)
+    for i, nome in enumerate(nomes):
+        mask = idx_rio == i
+        lat[mask] = centros[nome][idx_estacao[mask], 0] + rng.normal(0, 0.0005, mask.sum())
+        lon[mask] = centros[nome][idx_estacao[mask], 1] + rng.normal(0, 0.0005, mask.sum())
+
+    df = pd.DataFrame({
+        'municipio': 'SAO LUIS',
+        'rio': np.array(nomes, dtype=object)[idx_rio],
+        'data': pd.to_datetime("2017-01-01") + pd.to_timedelta(rng.integers(0, 7 * 365, n), unit='D'),
+        'latitude': lat,
+        'longitude': lon,
+    })
+    for col, (media, desvio) in PARAMETROS.items():
+        valores = np.abs(rng.normal(media, desvio, n)).round(3)
+        valores[rng.random(n) < 0.15] = np.nan  # o ETL grava vazio como NaN
+        df[col] = valores
+    df['id_estacao'] = idx_rio * ESTACOES_POR_RIO + idx_estacao + 1
+    df['rio_original'] = df['rio']
+    return classificar_conama(df)
+
+
+def salvar_excel(df, caminho):
+    """Excel em modo write_only (linha a linha; 1M linhas sem segurar as células na memória)."""
+    livro = Workbook(write_only=True)
+    planilha = livro.create_sheet()
+    planilha.append(list(df.columns))
+    for linha in df.itertuples(index=False, name=None):
+        planilha.append([None if (isinstance(v, float) and np.isnan(v)) else v for v in linha])
+    tmp = caminho + ".tmp.xlsx"
+    livro.save(tmp)
+    os.replace(tmp, caminho)
+
+
+def caminho_bruto(n, pasta=PASTA_DADOS):
+    return os.path.join(pasta, f"bruto_{n}.xlsx")
+
+
+def caminho_tratado(n, pasta=PASTA_DADOS):
+    return os.path.join(pasta, f"tratado_{n}.csv")
+
+
+def gerar(tamanhos=TAMANHOS, pasta=PASTA_DADOS, semente=42, refazer=False):
+    os.makedirs(pasta, exist_ok=True)
+    for n in tamanhos:
+        bruto, tratado = caminho_bruto(n, pasta), caminho_tratado(n, pasta)
+        if refazer or not os.path.exists(bruto):
+            print(f"Gerando {bruto}...")
+            salvar_excel(gerar_bruto(n, semente), bruto)
+        if refazer or not os.path.exists(tratado):
+            print(f"Gerando {tratado}...")
+            gerar_tratado(n, semente).to_csv(tratado, index=False)
+    print(f"✅ Dados sintéticos em: {pasta}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera planilhas brutas e bases tratadas sintéticas")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS, metavar="N",
+                        help="quantidade de linhas de cada conjunto (padrão: 1000 100000 1000000)")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--refazer", action="store_true", help="regrava mesmo se o arquivo já existir")
+    args = parser.parse_args()
+    gerar(args.tamanhos, semente=args.semente, refazer=args.refazer)
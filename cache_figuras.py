@@ -0,0 +1,78 @@
+import io
+import threading
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+
+# ==============================================================================
+# CACHE DE FIGURAS RENDERIZADAS (LRU limitado por tamanho)
+# ==============================================================================
+# Guarda o PNG de cada gráfico e de cada camada interpolada do mapa, chaveado
+# por (tipo, parâmetro, hash da seleção, versão dos dados). Vive no módulo,
+# então é o mesmo para todas as sessões do Streamlit; o mais antigo sai quando
+# o total passa do limite.
+LIMITE_CACHE_MB = 64
+
+# Mesmos padrões que o st.pyplot usa ao salvar a figura
+OPCOES_PNG = {"format": "png", "bbox_inches": "tight", "dpi": 200}
+
+_figuras = OrderedDict()
+_total_bytes = 0
+_trava = threading.Lock()
+# O pyplot não é thread-safe e cada sessão do Streamlit roda numa thread
+_trava_desenho = threading.Lock()
+
+
+def obter_bytes(chave, gerar, limite_mb=None):
+    """
+    Devolve os bytes (PNG) da chave. Se não estiver no cache, chama gerar()
+    fora da trava, guarda o resultado e descarta os mais antigos.
+    """
+    global _total_bytes
+    with _trava:
+        if chave in _figuras:
+            _figuras.move_to_end(chave)
+            return _figuras[chave]
+
+    png = gerar()
+
+    limite = (LIMITE_CACHE_MB if limite_mb is None else limite_mb) * 1024 * 1024
+    with _trava:
+        if chave not in _figuras:
+            _figuras[chave] = png
+            _total_bytes += len(png)
+        while _total_bytes > limite and len(_figuras) > 1:
+            _, antigo = _figuras.popitem(last=False)
+            _total_bytes -= len(antigo)
+    return png
+
+
+def obter_png(chave, desenhar, limite_mb=None):
+    """
+    Devolve o PNG da chave. Se não estiver no cache, chama desenhar()
+    (que deve retornar a Figure), salva como PNG e fecha a figura.
+    """
+    def gerar():
+        with _trava_desenho:
+            fig = desenhar()
+            buffer = io.BytesIO()
+            try:
+                fig.savefig(buffer, **OPCOES_PNG)
+            finally:
+                # Figura nunca fica aberta no pyplot (antes a memória só crescia)
+                plt.close(fig)
+        return buffer.getvalue()
+
+    return obter_bytes(chave, gerar, limite_mb)
+
+
+def limpar():
+    global _total_bytes
+    with _trava:
+        _figuras.clear()
+        _total_bytes = 0
+
+
+def estatisticas():
+    with _trava:
+        return {'figuras': len(_figuras), 'bytes': _total_bytes}
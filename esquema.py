@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from nomes import padronizar_texto
+
+# ==============================================================================
+# ESQUEMA COMPACTO DA BASE TRATADA
+# ==============================================================================
+# Tipos com que a base tratada é gravada (partições Parquet) e mantida na
+# memória pelo painel e pelo serviço de consultas. O CSV exportado continua
+# largo (texto), mas aqui cada coluna tem o menor tipo que guarda o valor:
+# medições em float32, nomes categóricos e status como categoria de dois
+# rótulos (código int8; vazio = sem dado). Colunas fora do esquema (hora,
+# status_*_graf do CSV antigo) não entram.
+COLUNAS_MEDIDAS = ["ph", "od", "turbidez", "temperatura", "condutividade", "std", "fosforo", "nitrogenio", "salinidade"]
+
+# Coordenadas ficam em float64: em float32 o ponto anda alguns metros
+COLUNAS_COORDENADAS = ["latitude", "longitude"]
+
+COLUNAS_CATEGORICAS = ["municipio", "rio", "rio_original", "lista_problemas", "resultado_final"]
+
+# Marcas do controle de qualidade (qualidade.py): uma por medição, bits em int8
+PREFIXO_QUALIDADE = "qc_"
+COLUNAS_QUALIDADE = [PREFIXO_QUALIDADE + c for c in COLUNAS_MEDIDAS]
+
+COLUNAS_INTEIRAS = {"id_estacao": "int32", "indice_problemas": "int8", "hash_linha": "int64",
+                    **{c: "int8" for c in COLUNAS_QUALIDADE}}
+
+# Rótulos de status na ordem dos códigos (0 = dentro do limite, 1 = fora)
+ROTULOS_STATUS = ["OK", "Fora"]
+ROTULO_SEM_DADO = "Sem Dado"
+
+# Rótulos das versões antigas do CSV (notebook) -> rótulo do esquema
+EQUIVALENCIAS_STATUS = {
+    "Conforme": "OK", "Dentro do Padrão": "OK",
+    "Não Conforme": "Fora", "Fora do Padrão": "Fora",
+    "Sem Dado": None,
+}
+
+# "Choveu?" da planilha (já sem acento e em maiúsculo)
+VALORES_CHOVEU = {"SIM": True, "NAO": False}
+
+TIPO_STATUS = pd.CategoricalDtype(ROTULOS_STATUS)
+
+
+def colunas_status(df):
+    """Colunas status_<parâmetro> (sem as cópias *_graf do CSV antigo)."""
+    return [c for c in df.columns if c.startswith("status_") and not c.endswith("_graf")]
+
+
+def _traduzir(serie, traducao, tipo):
+    """Traduz só os valores distintos e remonta a coluna pelos códigos."""
+    categorias = pd.Categorical(serie)
+    valores = [traducao(v) for v in categorias.categories] + [None]
+    return pd.Series(pd.array(valores, dtype=tipo)[categorias.codes], index=serie.index, name=serie.name)
+
+
+def _status(serie):
+    if isinstance(serie.dtype, pd.CategoricalDtype) and list(serie.cat.categories) == ROTULOS_STATUS:
+        return serie
+    return _traduzir(serie, lambda v: EQUIVALENCIAS_STATUS.get(v, v), TIPO_STATUS)
+
+
+def aplicar_esquema(df):
+    """
+    Nova base só com as colunas do esquema, nos tipos compactos, na ordem
+    original. Serve tanto para a saída do ETL quanto para o CSV já gravado.
+    """
+    saida = {}
+    for col in df.columns:
+        serie = df[col]
+        if col == "data":
+            saida[col] = pd.to_datetime(serie, format="mixed", errors="coerce", dayfirst=True)
+        elif col in COLUNAS_MEDIDAS:
+            saida[col] = pd.to_numeric(serie, errors="coerce").astype("float32")
+        elif col in COLUNAS_COORDENADAS:
+            saida[col] = pd.to_numeric(serie, errors="coerce").astype("float64")
+        elif col in COLUNAS_CATEGORICAS:
+            saida[col] = serie.astype("category").cat.remove_unused_categories()
+        elif col in COLUNAS_INTEIRAS:
+            saida[col] = serie.astype(COLUNAS_INTEIRAS[col])
+        elif col == "choveu":
+            saida[col] = _traduzir(serie, lambda v: VALORES_CHOVEU.get(padronizar_texto(v)), "boolean")
+        elif col in colunas_status(df):
+            saida[col] = _status(serie)
+    return pd.DataFrame(saida, index=df.index)
+
+
+def zeros_legados_como_vazio(df):
+    """
+    Bases gravadas antes do controle de qualidade (sem colunas qc_) usavam 0
+    como vazio nas medições; nelas o 0 vira NaN. Nas bases novas o 0 é uma
+    medição e nada muda. Recebe a base com todas as colunas (o CSV lido).
+    """
+    if any(c in df.columns for c in COLUNAS_QUALIDADE):
+        return df
+    medidas = [c for c in COLUNAS_MEDIDAS if c in df.columns]
+    return df.assign(**{c: pd.to_numeric(df[c], errors="coerce").replace(0, np.nan) for c in medidas})
+
+
+def rotulos_status(serie):
+    """Rótulos de exibição de uma coluna de status (vazio vira 'Sem Dado')."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        if not serie.isna().any():
+            return serie
+        serie = serie.cat.add_categories([ROTULO_SEM_DADO])
+    return serie.fillna(ROTULO_SEM_DADO)
+
+
+def para_exibicao(df):
+    """
+    Cópia das linhas exibidas (popups, JSON) com os rótulos de status e as
+    medições float32 de volta a float64 pelo texto mais curto que as
+    representa (7.93 e não 7.929999828...).
+    """
+    trocas = {c: rotulos_status(df[c]) for c in colunas_status(df)}
+    trocas.update({c: df[c].astype(str).astype("float64")
+                   for c in COLUNAS_MEDIDAS if c in df.columns and df[c].dtype == np.float32})
+    return df.assign(**trocas)
@@ -0,0 +1,156 @@
+import os
+import pickle
+import zlib
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+# ==============================================================================
+# REGISTRO DE ESTAÇÕES DE MONITORAMENTO
+# ==============================================================================
+# Amostras a menos de RAIO_ESTACAO_M umas das outras são a mesma estação
+# (a leitura do GPS varia um pouco a cada coleta). Cada estação tem um ID
+# estável, coordenada canônica e nome de rio canônico. O ETL refaz as
+# estações a cada execução a partir de todas as amostras da base, de forma
+# determinística (a mesma base dá sempre as mesmas estações, execução
+# completa ou incremental). O índice espacial (BallTree com distância
+# haversine) fica salvo em disco junto do registro para consulta.
+CAMINHO_ESTACOES = "data/processed/estacoes.pkl"
+RAIO_ESTACAO_M = 250
+RAIO_TERRA_M = 6371000.0
+
+# ID da estação: hash da coordenada do líder (CASAS_LIDER casas decimais)
+# entre 1 e LIMITE_ID (cabe em int32)
+CASAS_LIDER = 6
+LIMITE_ID = 2**31 - 2
+
+
+def _radianos(df):
+    return np.radians(df[['latitude', 'longitude']].to_numpy(dtype='float64'))
+
+
+def novo_registro(raio_m=RAIO_ESTACAO_M):
+    estacoes = pd.DataFrame({
+        'id_estacao': pd.Series(dtype='int32'),
+        'latitude': pd.Series(dtype='float64'),
+        'longitude': pd.Series(dtype='float64'),
+        'rio': pd.Series(dtype='object'),
+    })
+    return _reconstruir_indices({'raio_m': raio_m, 'estacoes': estacoes})
+
+
+def _reconstruir_indices(registro):
+    """Árvores sobre as estações (poucas), não sobre as amostras."""
+    estacoes = registro['estacoes']
+    registro['arvore'] = BallTree(_radianos(estacoes), metric='haversine') if len(estacoes) else None
+    com_rio = estacoes[estacoes['rio'].notna()]
+    registro['arvore_rios'] = BallTree(_radianos(com_rio), metric='haversine') if len(com_rio) else None
+    registro['posicoes_rios'] = np.flatnonzero(estacoes['rio'].notna().to_numpy())
+    return registro
+
+
+def _agrupar(coords, raio):
+    """
+    Agrupamento guloso: o primeiro ponto sem estação vira líder e leva todos os
+    pontos sem estação dentro do raio. Uma consulta ao índice por estação criada.
+    Retorna (rótulo de cada ponto, posição do líder de cada grupo).
+    """
+    rotulos = np.full(len(coords), -1)
+    arvore = BallTree(coords, metric='haversine')
+    lideres = []
+    for i in range(len(coords)):
+        if rotulos[i] != -1:
+            continue
+        vizinhos = arvore.query_radius(coords[i:i + 1], r=raio)[0]
+        vizinhos = vizinhos[rotulos[vizinhos] == -1]
+        rotulos[vizinhos] = len(lideres)
+        lideres.append(i)
+    return rotulos, np.array(lideres, dtype='int64')
+
+
+def _ids_estacoes(lideres):
+    """
+    ID de cada estação a partir da coordenada do seu líder (graus): não depende
+    da numeração das outras estações, então uma estação nova não renumera as
+    antigas. Colisão (rara) anda para o próximo ID livre, na ordem dos líderes.
+    """
+    usados = set()
+    ids = np.empty(len(lideres), dtype='int64')
+    for i, (lat, lon) in enumerate(lideres):
+        candidato = zlib.crc32(f"{lat:.{CASAS_LIDER}f},{lon:.{CASAS_LIDER}f}".encode()) % LIMITE_ID + 1
+        while candidato in usados:
+            candidato = candidato % LIMITE_ID + 1
+        usados.add(candidato)
+        ids[i] = candidato
+    return ids
+
+
+def registrar_amostras(registro, df):
+    """
+    Refaz as estações a partir de todas as amostras (df precisa ser a base
+    inteira, com latitude/longitude válidas): as coordenadas distintas são
+    agrupadas em ordem (latitude, longitude), então o resultado depende só
+    das coordenadas, não da ordem das linhas nem das execuções anteriores.
+    O nome do rio de cada estação é recalculado. Retorna (registro, ids).
+    """
+    raio = registro['raio_m'] / RAIO_TERRA_M
+    coords = _radianos(df)
+    estacoes = novo_registro(registro['raio_m'])['estacoes']
+    ids = np.full(len(df), -1, dtype='int64')
+
+    # 1. Coordenadas distintas, já ordenadas (repetidas contam uma vez só)
+    if len(df):
+        unicos, inverso = np.unique(np.round(coords, 9), axis=0, return_inverse=True)
+        rotulos, lideres = _agrupar(unicos, raio)
+        ids = _ids_estacoes(np.degrees(unicos[lideres]))[rotulos[inverso.ravel()]]
+        estacoes = (pd.DataFrame(np.degrees(coords), columns=['latitude', 'longitude'])
+                    .assign(id_estacao=ids)
+                    .groupby('id_estacao', as_index=False)[['latitude', 'longitude']].mean())
+        estacoes['id_estacao'] = estacoes['id_estacao'].astype('int32')
+        estacoes['rio'] = None
+
+    # 2. Nome canônico do rio: o mais frequente entre os nomes originais das
+    # amostras da estação (empate: ordem alfabética)
+    amostras = pd.DataFrame({'id_estacao': ids, 'rio': df['rio_original'].to_numpy()})
+    estacoes = estacoes.set_index('id_estacao')
+    com_nome = amostras.dropna(subset=['rio'])
+    com_nome = com_nome[com_nome['rio'] != '']
+    if not com_nome.empty:
+        frequentes = (com_nome.groupby(['id_estacao', 'rio']).size().rename('n').reset_index()
+                      .sort_values(['id_estacao', 'n', 'rio'], ascending=[True, False, True])
+                      .drop_duplicates('id_estacao').set_index('id_estacao')['rio'])
+        estacoes.loc[frequentes.index, 'rio'] = frequentes
+    registro['estacoes'] = estacoes.reset_index()
+    return _reconstruir_indices(registro), ids
+
+
+def rio_das_estacoes(registro, df, ids):
+    """
+    Nome canônico do rio para cada amostra: o da sua estação ou, se a estação
+    não tem nome, o da estação com nome mais próxima (consulta ao índice salvo).
+    """
+    estacoes = registro['estacoes'].set_index('id_estacao')
+    rios = np.array(estacoes['rio'].reindex(ids), dtype=object)
+    faltando = pd.isna(rios)
+    if faltando.any() and registro['arvore_rios'] is not None:
+        _, pos = registro['arvore_rios'].query(_radianos(df)[faltando], k=1)
+        rios[faltando] = registro['estacoes']['rio'].to_numpy()[registro['posicoes_rios'][pos[:, 0]]]
+    return rios
+
+
+def carregar_registro(raio_m=RAIO_ESTACAO_M, caminho=CAMINHO_ESTACOES):
+    """Registro salvo; um novo se não existir ou se o raio mudou."""
+    if os.path.exists(caminho):
+        with open(caminho, 'rb') as f:
+            registro = pickle.load(f)
+        if registro.get('raio_m') == raio_m:
+            return registro
+    return novo_registro(raio_m)
+
+
+def salvar_registro(registro, caminho=CAMINHO_ESTACOES):
+    tmp = caminho + ".tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(registro, f)
+    os.replace(tmp, caminho)
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# ÍNDICE DE FILTROS (códigos categóricos + bitmaps por valor)
+# ==============================================================================
+# Montado uma vez por carga de dados. Cada valor de cada dimensão (ano, rio,
+# município...) guarda o bitmap das linhas em que aparece; uma combinação de
+# filtros vira OR dentro da dimensão e AND entre dimensões, byte a byte.
+
+
+def construir_indice(dimensoes):
+    """
+    dimensoes: dict nome -> Series (todas com o mesmo tamanho e ordem do DataFrame).
+    Valores vazios não entram em nenhum bitmap (nunca passam no filtro).
+    """
+    n = len(next(iter(dimensoes.values()))) if dimensoes else 0
+    indice = {'n': n, 'dimensoes': {}}
+    for nome, serie in dimensoes.items():
+        categorias = pd.Categorical(serie)
+        codigos = categorias.codes
+        # Agrupa as posições por código com uma ordenação só
+        ordem = np.argsort(codigos, kind='stable')
+        limites = np.searchsorted(codigos[ordem], np.arange(len(categorias.categories) + 1))
+        bitmaps = {}
+        for i, valor in enumerate(categorias.categories):
+            mascara = np.zeros(n, dtype=bool)
+            mascara[ordem[limites[i]:limites[i + 1]]] = True
+            bitmaps[valor.item() if hasattr(valor, 'item') else valor] = np.packbits(mascara)
+        indice['dimensoes'][nome] = {
+            'categorias': list(bitmaps),
+            'codigos': codigos,
+            'bitmaps': bitmaps,
+        }
+    return indice
+
+
+def valores_disponiveis(indice, dimensao):
+    return indice['dimensoes'][dimensao]['categorias']
+
+
+def filtrar_posicoes(indice, **selecoes):
+    """
+    Posições (para .iloc) das linhas que atendem a todas as seleções, ex.:
+    filtrar_posicoes(indice, ano=[2023, 2024], rio=['RIO ANIL']).
+    """
+    n = indice['n']
+    resultado = np.full((n + 7) // 8, 0xFF, dtype=np.uint8)
+    for nome, valores in selecoes.items():
+        bitmaps = indice['dimensoes'][nome]['bitmaps']
+        bits = np.zeros_like(resultado)
+        for valor in valores:
+            if valor in bitmaps:
+                np.bitwise_or(bits, bitmaps[valor], out=bits)
+        np.bitwise_and(resultado, bits, out=resultado)
+    return np.flatnonzero(np.unpackbits(resultado, count=n))
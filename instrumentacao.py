@@ -0,0 +1,166 @@
+import cProfile
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# ==============================================================================
+# INSTRUMENTAÇÃO DAS ETAPAS DO ETL
+# ==============================================================================
+# Cada etapa (A a I e a gravação) roda dentro de `etapa(...)`, que mede tempo
+# de relógio, tempo de CPU, pico de memória e as linhas que entraram, saíram e
+# foram rejeitadas por motivo. No modo em lotes a mesma etapa roda várias
+# vezes e as medidas se somam. O relatório vai para um JSON ao lado da saída;
+# opcionalmente uma etapa roda sob o cProfile.
+CAMINHO_RELATORIO = "data/processed/relatorio_execucao.json"
+FUNCOES_PERFIL = 25
+
+# A memória é a RSS do processo, lida por uma thread a cada intervalo (o
+# tracemalloc deixava a leitura do Excel com openpyxl 5x mais lenta)
+INTERVALO_MEMORIA_S = 0.01
+
+
+def _rss_atual():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Fora do Linux: só o pico do processo (ru_maxrss em KiB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _amostrar_memoria(memoria, parar):
+    while not parar.wait(INTERVALO_MEMORIA_S):
+        memoria['pico'] = max(memoria['pico'], _rss_atual())
+
+
+def nova_execucao(perfilar=None, **parametros):
+    """Começa a medição de uma execução. perfilar=nome liga o cProfile nessa etapa."""
+    memoria = {'pico': _rss_atual()}
+    parar = threading.Event()
+    threading.Thread(target=_amostrar_memoria, args=(memoria, parar), daemon=True).start()
+    return {
+        'inicio': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'relogio': time.perf_counter(),
+        'cpu': time.process_time(),
+        'parametros': parametros,
+        'etapas': {},
+        'perfilar': perfilar,
+        'perfil': None,
+        'memoria': memoria,
+        'parar_amostragem': parar,
+    }
+
+
+@contextmanager
+def etapa(execucao, nome, linhas_entrada=None):
+    """
+    Mede o bloco como a etapa `nome`. O dict devolvido recebe 'linhas_saida' e
+    'rejeitadas' ({motivo: linhas}). Com execucao=None não mede nada.
+    """
+    medida = {'linhas_entrada': linhas_entrada, 'linhas_saida': None, 'rejeitadas': {}}
+    if execucao is None:
+        yield medida
+        return
+
+    memoria = execucao['memoria']
+    memoria_inicial = memoria['pico'] = _rss_atual()
+    perfil = None
+    if execucao['perfilar'] == nome:
+        perfil = execucao['perfil'] = execucao['perfil'] or cProfile.Profile()
+        perfil.enable()
+    relogio, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield medida
+    finally:
+        relogio, cpu = time.perf_counter() - relogio, time.process_time() - cpu
+        if perfil is not None:
+            perfil.disable()
+        # Acréscimo de memória do pico da etapa sobre o início dela
+        pico = max(memoria['pico'], _rss_atual()) - memoria_inicial
+        _acumular(execucao['etapas'].setdefault(nome, _medida_vazia()), medida, relogio, cpu, pico)
+
+
+def _medida_vazia():
+    return {'chamadas': 0, 'tempo_s': 0.0, 'cpu_s': 0.0, 'pico_memoria_mb': 0.0,
+            'linhas_entrada': None, 'linhas_saida': None, 'rejeitadas': {}}
+
+
+def _acumular(total, medida, relogio, cpu, pico):
+    total['chamadas'] += 1
+    total['tempo_s'] += relogio
+    total['cpu_s'] += cpu
+    total['pico_memoria_mb'] = max(total['pico_memoria_mb'], max(pico, 0) / 1024 ** 2)
+    for chave in ('linhas_entrada', 'linhas_saida'):
+        if medida[chave] is not None:
+            total[chave] = (total[chave] or 0) + int(medida[chave])
+    for motivo, linhas in medida['rejeitadas'].items():
+        total['rejeitadas'][motivo] = total['rejeitadas'].get(motivo, 0) + int(linhas)
+
+
+def iterar_medindo(execucao, nome, iteravel):
+    """Gerador que mede cada next() como a etapa `nome` (leitura em lotes)."""
+    iterador = iter(iteravel)
+    while True:
+        with etapa(execucao, nome) as medida:
+            try:
+                item = next(iterador)
+            except StopIteration:
+                return
+            medida['linhas_saida'] = len(item)
+        yield item
+
+
+def _resumo_perfil(perfil, arquivo):
+    """Grava o .prof completo e devolve as funções com maior tempo acumulado."""
+    perfil.dump_stats(arquivo)
+    estatisticas = pstats.Stats(perfil).sort_stats('cumulative')
+    principais = []
+    for funcao in estatisticas.fcn_list[:FUNCOES_PERFIL]:
+        _, chamadas, proprio, acumulado, _ = estatisticas.stats[funcao]
+        principais.append({
+            'funcao': pstats.func_std_string(funcao),
+            'chamadas': chamadas,
+            'tempo_proprio_s': round(proprio, 6),
+            'tempo_acumulado_s': round(acumulado, 6),
+        })
+    return {'arquivo': arquivo, 'principais': principais}
+
+
+def finalizar_execucao(execucao, caminho=CAMINHO_RELATORIO, **resultado):
+    """Grava o relatório JSON da execução, imprime a tabela das etapas e devolve o relatório."""
+    relatorio = {
+        'inicio': execucao['inicio'],
+        'fim': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'tempo_total_s': time.perf_counter() - execucao['relogio'],
+        'cpu_total_s': time.process_time() - execucao['cpu'],
+        # Pico do processo inteiro (ru_maxrss vem em KiB no Linux)
+        'pico_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'parametros': execucao['parametros'],
+        'resultado': resultado,
+        'etapas': execucao['etapas'],
+        'perfil': None,
+    }
+    if execucao['perfil'] is not None:
+        arquivo = f"{os.path.splitext(caminho)[0]}.{execucao['perfilar']}.prof"
+        relatorio['perfil'] = {'etapa': execucao['perfilar'], **_resumo_perfil(execucao['perfil'], arquivo)}
+    execucao['parar_amostragem'].set()
+
+    tmp = caminho + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, caminho)
+
+    print("\nEtapa                 tempo(s)   cpu(s)  memória(MB)   entrada     saída")
+    for nome, medida in relatorio['etapas'].items():
+        entrada = '-' if medida['linhas_entrada'] is None else medida['linhas_entrada']
+        saida = '-' if medida['linhas_saida'] is None else medida['linhas_saida']
+        print(f"{nome:<20} {medida['tempo_s']:>9.3f} {medida['cpu_s']:>8.3f} "
+              f"{medida['pico_memoria_mb']:>12.1f} {entrada:>9} {saida:>9}")
+    print(f"Relatório da execução: {caminho}")
+    return relatorio
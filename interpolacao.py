@@ -0,0 +1,169 @@
+import base64
+import io
+
+import matplotlib
+import matplotlib.colors
+import matplotlib.image
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from processamento_dados import FINAL_LAT_MAX, FINAL_LAT_MIN, FINAL_LON_MAX, FINAL_LON_MIN
+
+# ==============================================================================
+# SUPERFÍCIE INTERPOLADA (IDW) PARA O MAPA
+# ==============================================================================
+# Cada estação vira um ponto (média do parâmetro no período filtrado) e a
+# superfície é o inverso da distância ponderado (IDW) numa grade sobre o
+# geofencing final do processamento, sempre com as VIZINHOS_IDW estações mais
+# próximas de cada célula. As distâncias saem de uma vez em NumPy
+# (coordenadas projetadas em km, aproximação plana que basta na escala da
+# ilha); quando grade x estações passa de LIMITE_DISTANCIAS, os vizinhos
+# saem de uma KDTree. Os dois caminhos dão a mesma superfície.
+# Células a mais de DISTANCIA_MAXIMA_KM de qualquer estação ficam
+# transparentes (não se extrapola mar adentro). O PNG da camada fica no
+# cache_figuras, chaveado por parâmetro, seleção e versão dos dados.
+LIMITES_GRADE = (FINAL_LAT_MIN, FINAL_LAT_MAX, FINAL_LON_MIN, FINAL_LON_MAX)
+RESOLUCAO_GRADE = 300          # células no lado maior da grade
+POTENCIA_IDW = 2
+VIZINHOS_IDW = 12
+LIMITE_DISTANCIAS = 4_000_000  # pares célula x estação por bloco na conta direta
+DISTANCIA_MAXIMA_KM = 3.0
+MIN_ESTACOES = 3
+
+# Amostras com coordenadas iguais até a 4ª casa (~11 m) são a mesma estação
+CASAS_ESTACAO = 4
+
+KM_POR_GRAU_LAT = 110.57
+KM_POR_GRAU_LON = 111.32
+
+# Paleta por parâmetro (maior = melhor no OD; nos demais, maior = mais carga)
+PALETAS = {"od": "RdYlGn", "turbidez": "YlOrBr", "fosforo": "OrRd", "nitrogenio": "OrRd",
+           "salinidade": "Blues", "temperatura": "coolwarm"}
+PALETA_PADRAO = "viridis"
+OPACIDADE_CAMADA = 0.6
+
+
+def pontos_por_estacao(df, coluna):
+    """Média do parâmetro por estação (vazio = NaN). Colunas latitude, longitude, valor."""
+    valores = df[coluna].astype("float64")
+    pontos = pd.DataFrame({
+        "latitude": df["latitude"].round(CASAS_ESTACAO),
+        "longitude": df["longitude"].round(CASAS_ESTACAO),
+        "valor": valores,
+    }).dropna()
+    return pontos.groupby(["latitude", "longitude"], sort=False, as_index=False)["valor"].mean()
+
+
+def _projetar(lat, lon, lat_ref):
+    """Graus -> km num plano tangente (x leste, y norte)."""
+    cos_ref = np.cos(np.radians(lat_ref))
+    return np.column_stack([np.asarray(lon) * KM_POR_GRAU_LON * cos_ref, np.asarray(lat) * KM_POR_GRAU_LAT])
+
+
+def grade(limites=LIMITES_GRADE, resolucao=RESOLUCAO_GRADE):
+    """Centros das células: (latitudes crescentes, longitudes crescentes)."""
+    lat_min, lat_max, lon_min, lon_max = limites
+    passo = max(lat_max - lat_min, lon_max - lon_min) / resolucao
+    n_lat = max(int(round((lat_max - lat_min) / passo)), 1)
+    n_lon = max(int(round((lon_max - lon_min) / passo)), 1)
+    lats = lat_min + (np.arange(n_lat) + 0.5) * (lat_max - lat_min) / n_lat
+    lons = lon_min + (np.arange(n_lon) + 0.5) * (lon_max - lon_min) / n_lon
+    return lats, lons
+
+
+def _pesos_idw(distancias, valores, potencia):
+    """Média ponderada por 1/d^p em cada linha; célula em cima de uma estação recebe o valor dela."""
+    with np.errstate(divide="ignore"):
+        pesos = distancias ** -float(potencia)
+    exatas = np.isinf(pesos)
+    if exatas.any():
+        linhas = exatas.any(axis=1)
+        pesos[linhas] = exatas[linhas]
+    return (pesos * valores).sum(axis=1) / pesos.sum(axis=1)
+
+
+def superficie_idw(lat, lon, valores, limites=LIMITES_GRADE, resolucao=RESOLUCAO_GRADE,
+                   potencia=POTENCIA_IDW, vizinhos=VIZINHOS_IDW, distancia_maxima_km=DISTANCIA_MAXIMA_KM):
+    """
+    Matriz (n_lat, n_lon) com a superfície IDW das `vizinhos` estações mais
+    próximas de cada célula, linha 0 = latitude mínima.
+    NaN onde a estação mais próxima está além de distancia_maxima_km.
+    """
+    lats, lons = grade(limites, resolucao)
+    lat_ref = (limites[0] + limites[1]) / 2
+    estacoes = _projetar(lat, lon, lat_ref)
+    valores = np.asarray(valores, dtype="float64")
+    grade_lat, grade_lon = np.meshgrid(lats, lons, indexing="ij")
+    celulas = _projetar(grade_lat.ravel(), grade_lon.ravel(), lat_ref)
+    k = min(vizinhos, len(estacoes))
+
+    if len(celulas) * len(estacoes) <= LIMITE_DISTANCIAS or len(estacoes) <= vizinhos:
+        # Conta direta, em blocos de células para limitar a matriz de distâncias
+        resultado = np.empty(len(celulas))
+        mais_proxima = np.empty(len(celulas))
+        bloco = max(LIMITE_DISTANCIAS // max(len(estacoes), 1), 1)
+        for inicio in range(0, len(celulas), bloco):
+            trecho = celulas[inicio:inicio + bloco]
+            distancias = np.sqrt(((trecho[:, None, :] - estacoes[None, :, :]) ** 2).sum(axis=2))
+            mais_proxima[inicio:inicio + bloco] = distancias.min(axis=1)
+            if k < len(estacoes):
+                indices = np.argpartition(distancias, k - 1, axis=1)[:, :k]
+                distancias, proximos = np.take_along_axis(distancias, indices, axis=1), valores[indices]
+            else:
+                proximos = valores
+            resultado[inicio:inicio + bloco] = _pesos_idw(distancias, proximos, potencia)
+    else:
+        # Grade grande: só as k estações mais próximas de cada célula (índice
+        # espacial), e só nas células com alguma estação ao alcance
+        arvore = KDTree(estacoes)
+        mais_proxima = arvore.query(celulas, k=1)[0][:, 0]
+        alcance = mais_proxima <= distancia_maxima_km
+        resultado = np.full(len(celulas), np.nan)
+        if alcance.any():
+            distancias, indices = arvore.query(celulas[alcance], k=k)
+            resultado[alcance] = _pesos_idw(distancias, valores[indices], potencia)
+
+    resultado[mais_proxima > distancia_maxima_km] = np.nan
+    return resultado.reshape(len(lats), len(lons))
+
+
+def escala(valores):
+    """Limites de cor: percentis 2 e 98 das estações (um valor extremo não apaga o resto)."""
+    vmin, vmax = np.nanpercentile(np.asarray(valores, dtype="float64"), [2, 98])
+    if vmax <= vmin:
+        vmax = vmin + 1e-6
+    return float(vmin), float(vmax)
+
+
+def renderizar_png(superficie, vmin, vmax, paleta=PALETA_PADRAO, opacidade=OPACIDADE_CAMADA):
+    """PNG RGBA da superfície (norte para cima); NaN sai transparente."""
+    normalizada = np.clip((superficie - vmin) / (vmax - vmin), 0, 1)
+    rgba = matplotlib.colormaps[paleta](normalizada)
+    rgba[..., 3] = np.where(np.isnan(superficie), 0.0, opacidade)
+    buffer = io.BytesIO()
+    matplotlib.image.imsave(buffer, rgba[::-1], format="png")
+    return buffer.getvalue()
+
+
+def camada_png(pontos, coluna, vmin, vmax, limites=LIMITES_GRADE):
+    """Interpola os pontos de pontos_por_estacao e devolve o PNG da camada."""
+    superficie = superficie_idw(pontos["latitude"], pontos["longitude"], pontos["valor"], limites)
+    return renderizar_png(superficie, vmin, vmax, PALETAS.get(coluna, PALETA_PADRAO))
+
+
+def url_png(png):
+    """data: URL do PNG (o ImageOverlay do folium aceita direto)."""
+    return "data:image/png;base64," + base64.b64encode(png).decode("ascii")
+
+
+def cores_legenda(coluna, n=8):
+    """Cores em hex da paleta do parâmetro, para a legenda do mapa."""
+    mapa = matplotlib.colormaps[PALETAS.get(coluna, PALETA_PADRAO)]
+    return [matplotlib.colors.to_hex(mapa(x)) for x in np.linspace(0, 1, n)]
+
+
+def limites_folium(limites=LIMITES_GRADE):
+    """[[lat_min, lon_min], [lat_max, lon_max]] no formato do folium."""
+    lat_min, lat_max, lon_min, lon_max = limites
+    return [[lat_min, lon_min], [lat_max, lon_max]]
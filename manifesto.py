@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+import agregados
+import armazenamento
+import tendencias
+
+# ==============================================================================
+# MANIFESTO DA VERSÃO DOS DADOS
+# ==============================================================================
+# O processamento grava, por último e com troca atômica do arquivo, o hash do
+# conteúdo de cada artefato que o painel e o serviço leem. A versão de cada
+# artefato é esse hash: caches chaveados nele só são refeitos quando o
+# conteúdo daquele artefato muda, e reprocessar a mesma planilha não invalida
+# nada. Sem manifesto (dados de antes dele), a versão sai de data de
+# modificação e tamanho dos arquivos.
+CAMINHO_MANIFESTO = "data/processed/manifesto.json"
+
+ARTEFATOS = {
+    "csv": "data/processed/dados_tratados_tcc.csv",
+    "particoes": armazenamento.CAMINHO_PARTICOES,
+    "cubo": agregados.CAMINHO_CUBO,
+    "momentos": agregados.CAMINHO_MOMENTOS,
+    "tendencias": tendencias.CAMINHO_TENDENCIAS,
+    "series": tendencias.CAMINHO_SERIES,
+}
+
+TAMANHO_BLOCO_HASH = 1024 * 1024
+
+
+def _hash_arquivo(caminho, hash_=None):
+    hash_ = hash_ or hashlib.sha1()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO_HASH), b''):
+            hash_.update(bloco)
+    return hash_
+
+
+def _hash_conteudo(caminho):
+    """sha1 do arquivo; numa pasta, dos caminhos relativos e conteúdos de todos os arquivos."""
+    if os.path.isfile(caminho):
+        return _hash_arquivo(caminho).hexdigest()[:16]
+    if not os.path.isdir(caminho):
+        return None
+    hash_ = hashlib.sha1()
+    for raiz, pastas, arquivos in os.walk(caminho):
+        pastas.sort()
+        for nome in sorted(arquivos):
+            arquivo = os.path.join(raiz, nome)
+            hash_.update(os.path.relpath(arquivo, caminho).encode())
+            _hash_arquivo(arquivo, hash_)
+    return hash_.hexdigest()[:16]
+
+
+def _assinatura(caminho):
+    """Versão barata sem manifesto: data de modificação e tamanho (pasta: a dela)."""
+    if not os.path.exists(caminho):
+        return None, None
+    marca = os.stat(caminho)
+    return f"{marca.st_mtime_ns}:{marca.st_size}", marca.st_mtime
+
+
+def _versao_geral(artefatos):
+    return hashlib.sha1(json.dumps(artefatos, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def escrever_manifesto(caminho=CAMINHO_MANIFESTO, artefatos=None):
+    """Hash de cada artefato e versão geral; o arquivo é trocado de uma vez."""
+    artefatos = ARTEFATOS if artefatos is None else artefatos
+    hashes = {nome: _hash_conteudo(destino) for nome, destino in artefatos.items()}
+    manifesto = {
+        "versao": _versao_geral(hashes),
+        "gerado_em": pd.Timestamp.now().isoformat(timespec='seconds'),
+        "artefatos": hashes,
+    }
+    tmp = caminho + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2)
+    os.replace(tmp, caminho)
+    return manifesto
+
+
+def ler_manifesto(caminho=CAMINHO_MANIFESTO):
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def versoes(caminho=CAMINHO_MANIFESTO):
+    """
+    {'versao': geral, 'gerado_em': timestamp (s), 'artefatos': {nome: versão}}.
+    Lê só o manifesto (ou dá um stat por artefato): serve para cada rerun e
+    cada requisição.
+    """
+    manifesto = ler_manifesto(caminho)
+    if manifesto is not None:
+        return {
+            "versao": manifesto["versao"],
+            "gerado_em": os.stat(caminho).st_mtime,
+            "artefatos": manifesto["artefatos"],
+        }
+    assinaturas = {nome: _assinatura(destino) for nome, destino in ARTEFATOS.items()}
+    artefatos = {nome: assinatura for nome, (assinatura, _) in assinaturas.items()}
+    marcas = [marca for _, marca in assinaturas.values() if marca is not None]
+    if not marcas:
+        return {"versao": None, "gerado_em": None, "artefatos": artefatos}
+    return {"versao": _versao_geral(artefatos), "gerado_em": max(marcas), "artefatos": artefatos}
+
+
+if __name__ == "__main__":
+    manifesto = escrever_manifesto()
+    print(f"✅ Manifesto {manifesto['versao']} salvo em: {CAMINHO_MANIFESTO}")
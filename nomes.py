@@ -0,0 +1,157 @@
+import json
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# NORMALIZAÇÃO DE NOMES (município e rio) SOBRE VALORES DISTINTOS
+# ==============================================================================
+# A planilha repete poucas dezenas de nomes em milhares de linhas: cada nome
+# distinto é normalizado uma vez e o resultado fica num memo salvo em disco
+# (texto bruto -> nome final). A coluna sai categórica.
+CAMINHO_NOMES = "data/processed/nomes_canonicos.json"
+
+# Tipos de corpo d'água reconhecidos no início do nome ("RIO ANIL")
+TIPOS_CORPO_DAGUA = {"RIO", "RIACHO", "IGARAPE", "LAGO", "LAGOA", "BARRAGEM", "REPRESA", "ACUDE"}
+ABREVIACOES = {r"^R\b\.?": "RIO ", r"^RCH\b\.?": "RIACHO ", r"^IG\b\.?": "IGARAPE "}
+PALAVRAS_LIGACAO = {"DA", "DAS", "DE", "DO", "DOS"}
+
+# Textos que não são nome de rio (ficam vazios e vão para a imputação)
+NOMES_VAZIOS = {"NAO IDENTIFICADO", "SEM IDENTIFICACAO", "SEM NOME", "DESCONHECIDO"}
+
+# Grafias erradas com nome canônico fixo (texto padronizado -> nome canônico).
+# Não há junção por semelhança: nomes reais parecidos (PARNAIBA e PARAIBA) são
+# rios diferentes, então só une o que estiver listado aqui.
+ALIASES_RIOS = {
+    "RIO MUNIN": "RIO MUNIM",
+}
+
+_memo = None
+
+
+def padronizar_texto(texto):
+    """Remove acentos, espaços e joga pra maiúsculo."""
+    if pd.isna(texto): return texto
+    texto = str(texto).upper().strip()
+    return unicodedata.normalize('NFKD', texto).encode('ASCII', 'ignore').decode('ASCII')
+
+
+def versao_nomes():
+    """Muda quando uma regra de nome canônico muda (o memo salvo deixa de valer)."""
+    return json.dumps([sorted(TIPOS_CORPO_DAGUA), ABREVIACOES, sorted(PALAVRAS_LIGACAO),
+                       sorted(NOMES_VAZIOS), ALIASES_RIOS], sort_keys=True)
+
+
+def _obter_memo():
+    global _memo
+    if _memo is None:
+        _memo = carregar_nomes()
+    return _memo
+
+
+def reiniciar_memo():
+    """Esvazia o memo em memória (o arquivo salvo não muda)."""
+    global _memo
+    _memo = {"versao": versao_nomes(), "municipio": {}, "rio": {}}
+
+
+def carregar_nomes(caminho=CAMINHO_NOMES):
+    if os.path.exists(caminho):
+        with open(caminho, encoding='utf-8') as f:
+            memo = json.load(f)
+        if memo.get("versao") == versao_nomes():
+            return memo
+    return {"versao": versao_nomes(), "municipio": {}, "rio": {}}
+
+
+def salvar_nomes(caminho=CAMINHO_NOMES):
+    memo = _obter_memo()
+    tmp = caminho + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(memo, f, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, caminho)
+
+
+def _texto_rio(nome):
+    """Texto padronizado do rio: sem acento, abreviações expandidas, espaços simples."""
+    texto = padronizar_texto(nome)
+    for padrao, troca in ABREVIACOES.items():
+        texto = re.sub(padrao, troca, texto)
+    texto = re.sub(r"[^\w\s-]", " ", texto)
+    return " ".join(texto.split())
+
+
+def _chave_rio(texto):
+    """(tipo, núcleo): "RIO DAS FLORES" -> ("RIO", "FLORES"); "MUNIM" -> (None, "MUNIM")."""
+    palavras = texto.split()
+    tipo = palavras[0] if palavras and palavras[0] in TIPOS_CORPO_DAGUA and len(palavras) > 1 else None
+    nucleo = [p for p in palavras[1 if tipo else 0:] if p not in PALAVRAS_LIGACAO]
+    return tipo, " ".join(nucleo)
+
+
+def _canonizar_rios(textos, canonicos):
+    """
+    Nome canônico de cada texto novo. Um texto é o mesmo rio de um nome canônico
+    quando está em ALIASES_RIOS ou quando os tipos são compatíveis (iguais ou
+    um deles sem tipo) e os núcleos são iguais. Sem correspondência, o
+    próprio texto vira canônico. `canonicos` (nome -> chave) é atualizado.
+    """
+    resultado = {}
+    for texto in textos:
+        if texto in NOMES_VAZIOS or not texto:
+            resultado[texto] = None
+            continue
+        if texto in ALIASES_RIOS:
+            resultado[texto] = ALIASES_RIOS[texto]
+            continue
+        if texto in canonicos:
+            resultado[texto] = texto
+            continue
+
+        tipo, nucleo = _chave_rio(texto)
+        candidatos = {}
+        for nome, (tipo_c, nucleo_c) in canonicos.items():
+            if tipo is None or tipo_c is None or tipo == tipo_c:
+                candidatos.setdefault(nucleo_c, nome)
+        escolhido = candidatos.get(nucleo)
+        if escolhido is None:
+            canonicos[texto] = (tipo, nucleo)
+            escolhido = texto
+        resultado[texto] = escolhido
+    return resultado
+
+
+def padronizar_coluna(serie, tipo='municipio'):
+    """
+    Coluna normalizada e categórica. Só os valores distintos que ainda não estão
+    no memo passam pela normalização; o resto é uma tradução de códigos.
+    tipo='rio' também aplica os nomes canônicos (variantes viram um nome só).
+    """
+    memo = _obter_memo()[tipo]
+    categorias = pd.Categorical(serie)
+    valores = [str(v) for v in categorias.categories]
+    novos = [v for v in valores if v not in memo]
+
+    if novos:
+        if tipo == 'rio':
+            # Canônicos primeiro os nomes com tipo ("RIO X") e os mais frequentes
+            frequencia = dict(zip(valores, np.bincount(categorias.codes[categorias.codes >= 0],
+                                                       minlength=len(valores))))
+            textos = {v: _texto_rio(v) for v in novos}
+            contagem = {}
+            for v in novos:
+                contagem[textos[v]] = contagem.get(textos[v], 0) + frequencia[v]
+            ordem = sorted(contagem, key=lambda t: (_chave_rio(t)[0] is None, -contagem[t], t))
+            canonicos = {n: _chave_rio(n) for n in set(memo.values()) if n is not None}
+            finais = _canonizar_rios(ordem, canonicos)
+            for v in novos:
+                memo[v] = finais[textos[v]]
+        else:
+            for v in novos:
+                memo[v] = padronizar_texto(v)
+
+    traducao = np.array([memo[v] for v in valores] + [None], dtype=object)
+    return pd.Series(pd.Categorical(traducao[categorias.codes]), index=serie.index, name=serie.name)
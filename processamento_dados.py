@@ -2,14 +2,49 @@ import pandas as pd
 import numpy as np
 import re
 import os
-import unicodedata
-from sklearn.neighbors import KNeighborsClassifier
+import json
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from agregados import CAMINHO_CUBO, CAMINHO_MOMENTOS, salvar_cubo, salvar_momentos
+from armazenamento import (CAMINHO_MUNICIPIOS, CAMINHO_PARTICOES, ler_municipios, listar_municipios,
+                           particoes_diferentes, remover_municipio, salvar_municipio, salvar_particionado)
+from esquema import zeros_legados_como_vazio
+from instrumentacao import CAMINHO_RELATORIO, etapa, finalizar_execucao, iterar_medindo, nova_execucao
+from nomes import padronizar_coluna, padronizar_texto, salvar_nomes, versao_nomes
+from estacoes import (CAMINHO_ESTACOES, RAIO_ESTACAO_M, novo_registro, registrar_amostras,
+                      rio_das_estacoes, salvar_registro)
+from manifesto import CAMINHO_MANIFESTO, escrever_manifesto
+from qualidade import (FAIXAS_PLAUSIVEIS, FATOR_IQR, LIMIAR_PICO, LIMIAR_Z_ROBUSTO, MESES_CHUVOSOS,
+                       MIN_AMOSTRAS_GRUPO, MIN_HISTORICO_PICO, PARAMETROS_LOG, marcar_qualidade)
+from tendencias import (CAMINHO_SERIES, CAMINHO_SERIES_MUNICIPIOS, CAMINHO_TENDENCIAS,
+                        CAMINHO_TENDENCIAS_MUNICIPIOS, salvar_tendencias)
 
 # ==============================================================================
 # 1. CONFIGURAÇÕES
 # ==============================================================================
 CAMINHO_ENTRADA = "data/raw/dados_brutos.xlsx"
 CAMINHO_SAIDA = "data/processed/dados_tratados_tcc.csv"
+# Estado do modo incremental (impressões digitais + marca d'água de data)
+CAMINHO_ESTADO = "data/processed/estado_etl.json"
+
+# Mapeamento das colunas do Excel (VOLTAMOS AO MAPEAMENTO ORIGINAL DO COLAB)
+MAPA_COLUNAS = {
+    "Nome Municipio": "municipio",
+    "Nome do Corpo D'Água": "rio",
+    "Data da Coleta (dd/mm/aaaa)": "data",
+    "Posição horizontal da coleta (latitude)": "latitude",  # Voltei ao original
+    "Posição vertical da coleta (longitude)": "longitude", # Voltei ao original
+    # Variáveis
+    "pH": "ph", "Oxigênio dissolvido (mg/L 02)": "od", "Turbidez (NTU)": "turbidez",
+    "Temperatura da água (°C)": "temperatura",
+    "Condutividade Elétrica Específica (25°C) (µS/cm a 25°C)": "condutividade",
+    "Sólidos Dissolvidos (mg/L)": "std",
+    "Fósforo Total\n (mg/L de P)": "fosforo",
+    "Nitrogênio Amoniacal\n (mg/L de N)": "nitrogenio",
+    "Salinidade (‰)": "salinidade"
+}
 
 # Limites "Grosseiros" de São Luís (Para forçar a escala correta)
 # Se a coordenada não estiver aqui, vamos dividir por 10 até entrar.
@@ -20,15 +55,49 @@ CHECK_LON_MIN, CHECK_LON_MAX = -46.0, -42.0
 FINAL_LAT_MIN, FINAL_LAT_MAX = -2.80, -2.30
 FINAL_LON_MIN, FINAL_LON_MAX = -44.50, -44.00
 
+# Perfis por município: limites grosseiros (escala) e finos (geofencing) no
+# formato (lat_min, lat_max, lon_min, lon_max) e, opcionalmente, a lista de
+# rios monitorados (amostras de outros rios são descartadas; rio vazio fica
+# para a imputação). Para monitorar outro município com corte próprio basta
+# acrescentar uma linha; os demais usam PERFIL_PADRAO.
+PERFIS_MUNICIPIOS = [
+    {"nome": "SAO LUIS",
+     "check": (CHECK_LAT_MIN, CHECK_LAT_MAX, CHECK_LON_MIN, CHECK_LON_MAX),
+     "final": (FINAL_LAT_MIN, FINAL_LAT_MAX, FINAL_LON_MIN, FINAL_LON_MAX),
+     "rios": None},
+]
+MUNICIPIO_PADRAO = "SAO LUIS"
+
+# Município sem perfil próprio: só o retângulo do Maranhão (sem corte fino)
+LIMITES_MARANHAO = (-10.5, -1.0, -48.8, -41.8)
+PERFIL_PADRAO = {"nome": None, "check": LIMITES_MARANHAO, "final": LIMITES_MARANHAO, "rios": None}
+
+# Saída do modo por município (uma partição por município) e registros de
+# estações de cada um (os IDs de estação são únicos dentro do município)
+CAMINHO_ESTACOES_MUNICIPIOS = "data/processed/estacoes_municipios"
+
+# Regras da Resolução CONAMA 357/2005 (mesmos limites do painel).
+# Para incluir um parâmetro ou outra classe de água basta acrescentar linhas.
+CLASSE_CONAMA = 2
+REGRAS_CONAMA = [
+    {"col": "ph", "rotulo": "pH", "tipo_lim": "range", "limite": (6.0, 9.0), "classe": 2},
+    {"col": "od", "rotulo": "OD", "tipo_lim": "min", "limite": 5.0, "classe": 2},
+    {"col": "turbidez", "rotulo": "Turbidez", "tipo_lim": "max", "limite": 100.0, "classe": 2},
+    {"col": "std", "rotulo": "STD", "tipo_lim": "max", "limite": 500.0, "classe": 2},
+    {"col": "nitrogenio", "rotulo": "Nitrogênio", "tipo_lim": "max", "limite": 2.18, "classe": 2},
+    {"col": "fosforo", "rotulo": "Fósforo", "tipo_lim": "max", "limite": 0.1, "classe": 2},
+]
+
 # ==============================================================================
 # 2. FUNÇÕES INTELIGENTES
 # ==============================================================================
 
-def padronizar_texto(texto):
-    """Remove acentos, espaços e joga pra maiúsculo."""
-    if pd.isna(texto): return texto
-    texto = str(texto).upper().strip()
-    return unicodedata.normalize('NFKD', texto).encode('ASCII', 'ignore').decode('ASCII')
+def perfil_municipio(nome):
+    """Perfil do município (nome já padronizado) ou o padrão do estado."""
+    for perfil in PERFIS_MUNICIPIOS:
+        if perfil["nome"] == nome:
+            return perfil
+    return dict(PERFIL_PADRAO, nome=nome)
 
 def limpar_coordenada_inteligente(valor, tipo='lat'):
     """
@@ -69,114 +138,663 @@ def limpar_coordenada_inteligente(valor, tipo='lat'):
 
     return coord
 
-def classificar_conama(row):
-    problemas = []
-    # Usando 0 como placeholder de "Sem dado" (não reprova por falta de dado)
-    if row['ph'] != 0 and not (6.0 <= row['ph'] <= 9.0): problemas.append('pH')
-    if row['od'] != 0 and row['od'] < 5.0: problemas.append('OD')
-    if row['turbidez'] != 0 and row['turbidez'] > 100.0: problemas.append('Turbidez')
-    
-    return len(problemas), ", ".join(problemas)
+def corrigir_coordenadas_vetorizado(serie, tipo='lat', limites=None):
+    """
+    Versão vetorizada de `limpar_coordenada_inteligente`: trata a coluna inteira
+    de uma vez, com o mesmo resultado da função linha a linha.
+    limites=(min, max) troca os limites grosseiros (perfil de outro município).
+    Retorna (serie_corrigida, relatorio), onde o relatório conta quantas
+    coordenadas foram reescaladas e quantas foram rejeitadas (por motivo).
+    """
+    if limites is not None:
+        lim_min, lim_max = limites
+    elif tipo == 'lat':
+        lim_min, lim_max = CHECK_LAT_MIN, CHECK_LAT_MAX
+    else:
+        lim_min, lim_max = CHECK_LON_MIN, CHECK_LON_MAX
+    limite_escala = abs(lim_min)  # 4.0 para latitude, 46.0 para longitude
+
+    resultado = pd.Series(np.nan, index=serie.index, dtype='float64')
+    relatorio = {'reescaladas': 0, 'rejeitadas': {'vazio': 0, 'nao_numerico': 0, 'fora_do_limite': 0}}
+
+    mask_presente = serie.notna()
+    relatorio['rejeitadas']['vazio'] = int((~mask_presente).sum())
+    if not mask_presente.any():
+        return resultado, relatorio
+
+    valores = serie[mask_presente]
+    coord = np.full(len(valores), np.nan)
+
+    # 1a. Atalho: floats já numéricos cujo texto não tem notação científica
+    # (1e-4 <= |x| < 1e16) sobrevivem intactos à limpeza de caracteres.
+    if pd.api.types.is_float_dtype(valores.dtype):
+        mask_float = np.ones(len(valores), dtype=bool)
+    else:
+        mask_float = valores.map(type).isin([float, np.float64]).to_numpy()
+    floats = valores[mask_float].to_numpy(dtype=np.float64)
+    modulo = np.abs(floats)
+    sem_expoente = (floats == 0) | ((modulo >= 1e-4) & (modulo < 1e16))
+    idx_float = np.flatnonzero(mask_float)
+    coord[idx_float[sem_expoente]] = floats[sem_expoente]
+    mask_texto = np.ones(len(valores), dtype=bool)
+    mask_texto[idx_float[sem_expoente]] = False
+
+    # 1b. Limpeza de caracteres no restante (mesmas regras da versão linha a linha)
+    texto = valores[mask_texto].astype(str).str.strip().str.replace(',', '.', regex=False)
+    texto = texto.str.replace(r'[^0-9\.\-]', '', regex=True)
+
+    # Só aceita o que o float() do Python aceitaria com esses caracteres
+    mask_numero = texto.str.fullmatch(r'-?(?:\d+\.?\d*|\.\d+)').fillna(False).astype(bool).to_numpy()
+    idx_texto = np.flatnonzero(mask_texto)
+    coord[idx_texto[mask_numero]] = texto[mask_numero].to_numpy(dtype=object).astype(np.float64)
+
+    # Números gigantes viram infinito (o laço original nunca terminaria)
+    mask_finito = np.isfinite(coord)
+    relatorio['rejeitadas']['nao_numerico'] = int((~mask_finito).sum())
+
+    # 2. Garante sinal negativo (Hemisfério Sul / Oeste)
+    coord = np.where(coord > 0, -coord, coord)
+
+    # 3. Correção de Escala em forma fechada: estima pela ordem de grandeza
+    # quantas divisões por 10 são necessárias (sem passar do ponto) ...
+    modulo = np.abs(np.where(mask_finito, coord, 0.0))
+    with np.errstate(divide='ignore'):
+        n_div = np.ceil(np.log10(modulo / limite_escala)) - 1
+    n_div = np.where(modulo > limite_escala, np.maximum(n_div, 0), 0).astype(int)
+
+    # ... e aplica as divisões em sequência, como o laço original, para que o
+    # arredondamento de ponto flutuante seja idêntico.
+    for i in range(n_div.max(initial=0)):
+        coord = np.where(n_div > i, coord / 10.0, coord)
+
+    # Ajuste fino: o que a estimativa deixou acima do limite leva mais divisões
+    acima = mask_finito & (np.abs(coord) > limite_escala)
+    while acima.any():
+        coord = np.where(acima, coord / 10.0, coord)
+        n_div = n_div + acima
+        acima = mask_finito & (np.abs(coord) > limite_escala)
+
+    # Validação final: está no Maranhão?
+    mask_limite = (coord > lim_min) & (coord < lim_max)
+    relatorio['rejeitadas']['fora_do_limite'] = int((mask_finito & ~mask_limite).sum())
+    relatorio['reescaladas'] = int((mask_limite & (n_div > 0)).sum())
+
+    resultado[mask_presente] = np.where(mask_limite, coord, np.nan)
+    return resultado, relatorio
+
+def classificar_conama(df, regras=None, classe=None):
+    """
+    Classificação vetorizada segundo a tabela REGRAS_CONAMA: cada regra vira
+    uma máscara NumPy sobre todas as linhas de uma vez.
+    Gera 'indice_problemas', 'lista_problemas', 'resultado_final' e um
+    'status_<parametro>' para cada regra da classe escolhida.
+    """
+    regras = REGRAS_CONAMA if regras is None else regras
+    classe = CLASSE_CONAMA if classe is None else classe
+    regras = [r for r in regras if r['classe'] == classe and r['col'] in df.columns]
+
+    n = len(df)
+    matriz_fora = np.zeros((n, len(regras)), dtype=bool)
+    for j, regra in enumerate(regras):
+        valores = df[regra['col']].to_numpy(dtype='float64', na_value=np.nan)
+        # Vazio (NaN) é "Sem dado": não reprova por falta de dado
+        com_dado = ~np.isnan(valores)
+        if regra['tipo_lim'] == 'min':
+            viola = valores < regra['limite']
+        elif regra['tipo_lim'] == 'max':
+            viola = valores > regra['limite']
+        else:  # 'range'
+            lim_min, lim_max = regra['limite']
+            viola = (valores < lim_min) | (valores > lim_max)
+        matriz_fora[:, j] = com_dado & viola
+
+    df['indice_problemas'] = matriz_fora.sum(axis=1)
+
+    # Cada combinação de problemas vira um código binário; o texto é montado
+    # uma vez por combinação distinta, e não uma vez por linha.
+    codigos = matriz_fora.astype(np.int64) @ (1 << np.arange(len(regras), dtype=np.int64))
+    rotulos = [r['rotulo'] for r in regras]
+    textos = {c: ", ".join(rotulos[j] for j in range(len(regras)) if c >> j & 1) for c in np.unique(codigos)}
+    df['lista_problemas'] = pd.Series(codigos, index=df.index).map(textos).fillna('')
+    df['resultado_final'] = np.where(df['indice_problemas'] == 0, 'Aprovado', 'Reprovado')
+
+    # Status individuais
+    for j, regra in enumerate(regras):
+        df[f"status_{regra['col']}"] = np.where(matriz_fora[:, j], 'Fora', 'OK')
+
+    return df
 
 # ==============================================================================
-# 3. PIPELINE DE EXECUÇÃO
+# 3. MODO INCREMENTAL (ESTADO)
 # ==============================================================================
 
-def executar_etl():
-    print("--- INICIANDO PROCESSAMENTO (MODO CORREÇÃO) ---")
+def calcular_impressoes(df):
+    """
+    Impressão digital (hash de 64 bits) de cada linha, vetorizada.
+    O texto de cada célula é canonizado (5.0 e 5 dão o mesmo resultado, vazio
+    é vazio) para que a impressão não dependa do tipo que o pandas inferiu
+    para a coluna, nem de a planilha ter sido lida inteira ou em lotes.
+    """
+    texto = {}
+    for col in df.columns:
+        serie = df[col]
+        if pd.api.types.is_float_dtype(serie.dtype):
+            inteiro = serie.notna() & (serie % 1 == 0) & (serie.abs() < 1e18)
+            canon = serie.astype(str)
+            canon[inteiro] = serie[inteiro].astype('int64').astype(str)
+        elif pd.api.types.is_datetime64_any_dtype(serie.dtype):
+            canon = serie.dt.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            canon = serie.astype(str)
+        texto[col] = canon.where(serie.notna(), '')
+    return pd.util.hash_pandas_object(pd.DataFrame(texto), index=False).to_numpy().view('int64')
 
-    # A. Carregar
-    if not os.path.exists(CAMINHO_ENTRADA):
-        print(f"🚨 ERRO: Arquivo não encontrado: {CAMINHO_ENTRADA}")
-        return
-    df_bruto = pd.read_excel(CAMINHO_ENTRADA)
-
-    # B. Renomear (VOLTAMOS AO MAPEAMENTO ORIGINAL DO COLAB)
-    mapa_colunas = {
-        "Nome Municipio": "municipio",
-        "Nome do Corpo D'Água": "rio",
-        "Data da Coleta (dd/mm/aaaa)": "data",
-        "Posição horizontal da coleta (latitude)": "latitude",  # Voltei ao original
-        "Posição vertical da coleta (longitude)": "longitude", # Voltei ao original
-        # Variáveis
-        "pH": "ph", "Oxigênio dissolvido (mg/L 02)": "od", "Turbidez (NTU)": "turbidez",
-        "Temperatura da água (°C)": "temperatura",
-        "Condutividade Elétrica Específica (25°C) (µS/cm a 25°C)": "condutividade",
-        "Sólidos Dissolvidos (mg/L)": "std",
-        "Fósforo Total\n (mg/L de P)": "fosforo",
-        "Nitrogênio Amoniacal\n (mg/L de N)": "nitrogenio",
-        "Salinidade (‰)": "salinidade"
+def versao_configuracao():
+    """Muda sempre que uma regra que afeta a saída muda (força reprocessar tudo)."""
+    config = {
+        "check": [CHECK_LAT_MIN, CHECK_LAT_MAX, CHECK_LON_MIN, CHECK_LON_MAX],
+        "final": [FINAL_LAT_MIN, FINAL_LAT_MAX, FINAL_LON_MIN, FINAL_LON_MAX],
+        "perfis": [PERFIS_MUNICIPIOS, PERFIL_PADRAO],
+        "conama": [CLASSE_CONAMA, REGRAS_CONAMA],
+        "colunas": MAPA_COLUNAS,
+        "raio_estacao_m": RAIO_ESTACAO_M,
+        "qualidade": [FAIXAS_PLAUSIVEIS, PARAMETROS_LOG, MESES_CHUVOSOS, MIN_AMOSTRAS_GRUPO, LIMIAR_Z_ROBUSTO,
+                      FATOR_IQR, LIMIAR_PICO, MIN_HISTORICO_PICO],
+        "nomes": versao_nomes(),
     }
-    cols = [c for c in mapa_colunas.keys() if c in df_bruto.columns]
-    df = df_bruto[cols].rename(columns=mapa_colunas)
+    return str(pd.util.hash_pandas_object(pd.Series([json.dumps(config, sort_keys=True, default=str)])).iloc[0])
 
-    # C. Datas (Correção do 30/28/2018)
-    print("Tratando datas...")
-    df['data'] = pd.to_datetime(df['data'], errors='coerce')
-    df = df.dropna(subset=['data'])
+def carregar_estado():
+    if not os.path.exists(CAMINHO_ESTADO):
+        return None
+    with open(CAMINHO_ESTADO, encoding='utf-8') as f:
+        return json.load(f)
 
-    # D. Padronização
-    if 'municipio' in df.columns: df['municipio'] = df['municipio'].apply(padronizar_texto)
-    if 'rio' in df.columns: df['rio'] = df['rio'].apply(padronizar_texto)
-    
-    # Filtro Municipio
-    df = df[df['municipio'] == 'SAO LUIS'].copy()
+def salvar_estado(impressoes, marca_dagua):
+    estado = {
+        "versao_config": versao_configuracao(),
+        "marca_dagua": None if pd.isna(marca_dagua) else pd.Timestamp(marca_dagua).isoformat(),
+        "impressoes": [int(h) for h in impressoes],
+    }
+    # Escrita atômica: grava num temporário e troca
+    tmp = CAMINHO_ESTADO + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(estado, f)
+    os.replace(tmp, CAMINHO_ESTADO)
+
+# ==============================================================================
+# 4. LEITURA EM LOTES (MEMÓRIA LIMITADA)
+# ==============================================================================
+
+# Textos que o pd.read_excel já trata como vazio (mesma lista padrão do pandas)
+NA_TEXTOS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
+
+def _converter_celula(valor):
+    """Mesma conversão que o leitor openpyxl do pandas faz em cada célula."""
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if isinstance(valor, str) and valor in NA_TEXTOS:
+        return None
+    return valor
+
+def ler_excel_em_lotes(caminho, tamanho_lote):
+    """
+    Gerador: lê a primeira aba do Excel em blocos de `tamanho_lote` linhas,
+    já só com as colunas de MAPA_COLUNAS (renomeadas). A memória fica
+    limitada pelo tamanho do lote, e não pelo tamanho do arquivo.
+    """
+    from openpyxl import load_workbook
+
+    livro = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        linhas = livro.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        posicoes = {}
+        for i, nome in enumerate(cabecalho):
+            if nome in MAPA_COLUNAS and nome not in posicoes:
+                posicoes[nome] = i
+        # Mesma ordem de colunas da leitura completa (ordem do MAPA_COLUNAS)
+        nomes = [c for c in MAPA_COLUNAS if c in posicoes]
+        indices = [posicoes[c] for c in nomes]
+
+        lote = []
+        for linha in linhas:
+            valores = [_converter_celula(linha[i]) if i < len(linha) else None for i in indices]
+            if all(v is None for v in valores):
+                continue  # linha em branco (o openpyxl costuma trazer várias no fim)
+            lote.append(valores)
+            if len(lote) == tamanho_lote:
+                yield pd.DataFrame(lote, columns=nomes, dtype=object).rename(columns=MAPA_COLUNAS)
+                lote = []
+        if lote:
+            yield pd.DataFrame(lote, columns=nomes, dtype=object).rename(columns=MAPA_COLUNAS)
+    finally:
+        livro.close()
+
+# ==============================================================================
+# 5. PIPELINE DE EXECUÇÃO
+# ==============================================================================
+
+def selecionar_colunas(df_bruto):
+    """B. Renomear para os nomes curtos de MAPA_COLUNAS."""
+    cols = [c for c in MAPA_COLUNAS.keys() if c in df_bruto.columns]
+    return df_bruto[cols].rename(columns=MAPA_COLUNAS)
+
+def converter_datas(serie):
+    """C. Datas (Correção do 30/28/2018): cada célula é lida no seu próprio formato."""
+    return pd.to_datetime(serie, errors='coerce', format='mixed')
+
+def somar_relatorios(total, parcial):
+    """Soma (recursivamente) os contadores de dois relatórios de lote."""
+    for chave, valor in parcial.items():
+        if isinstance(valor, dict):
+            somar_relatorios(total.setdefault(chave, {}), valor)
+        else:
+            total[chave] = total.get(chave, 0) + valor
+    return total
+
+def limpar_lote(df, mostrar_amostra=False, perfil=None, execucao=None):
+    """
+    Etapas C a F (datas, padronização, filtro de município, coordenadas e
+    geofencing) sobre um lote, com os limites do perfil do município
+    (padrão: São Luís). Não depende das outras linhas, então roda lote a
+    lote. Cada etapa é medida em `execucao` (ver instrumentacao.py).
+    Retorna (df_geo, relatorio).
+    """
+    if perfil is None:
+        perfil = perfil_municipio(MUNICIPIO_PADRAO)
+    lat_min, lat_max, lon_min, lon_max = perfil['check']
+    final_lat_min, final_lat_max, final_lon_min, final_lon_max = perfil['final']
+
+    # C. Datas
+    with etapa(execucao, 'C_datas', len(df)) as medida:
+        df = df.dropna(subset=['data'])
+        medida['linhas_saida'] = len(df)
+        medida['rejeitadas']['data_invalida'] = medida['linhas_entrada'] - len(df)
+
+    # D. Padronização (uma vez por nome distinto, com nomes canônicos de rio)
+    with etapa(execucao, 'D_padronizacao', len(df)) as medida:
+        if 'municipio' in df.columns: df['municipio'] = padronizar_coluna(df['municipio'], 'municipio')
+        if 'rio' in df.columns: df['rio'] = padronizar_coluna(df['rio'], 'rio')
+
+        # Filtro Municipio
+        df = df[df['municipio'] == perfil['nome']].copy()
+        relatorio = {'municipio': len(df), 'fora_lista_rios': 0, 'coordenadas_validas': 0, 'fora_geofencing': 0}
+        medida['rejeitadas']['outro_municipio'] = medida['linhas_entrada'] - len(df)
+
+        # Rios monitorados do perfil (rio vazio fica para a imputação)
+        if perfil['rios'] is not None:
+            mask_rios = df['rio'].isna() | (df['rio'] == '') | df['rio'].isin(perfil['rios'])
+            relatorio['fora_lista_rios'] = int((~mask_rios).sum())
+            medida['rejeitadas']['fora_lista_rios'] = relatorio['fora_lista_rios']
+            df = df[mask_rios]
+        medida['linhas_saida'] = len(df)
     if df.empty:
-        print("🚨 ERRO CRÍTICO: Filtro 'SAO LUIS' removeu tudo. Verifique o nome no Excel.")
-        return
+        return df, relatorio
 
     # E. Limpeza de Coordenadas (COM DEBUG)
-    print("\n--- AMOSTRA DE COORDENADAS ANTES DA LIMPEZA ---")
-    print(df[['latitude', 'longitude']].head(3).to_string())
+    if mostrar_amostra:
+        print("\n--- AMOSTRA DE COORDENADAS ANTES DA LIMPEZA ---")
+        print(df[['latitude', 'longitude']].head(3).to_string())
 
-    df['latitude'] = df['latitude'].apply(lambda x: limpar_coordenada_inteligente(x, 'lat'))
-    df['longitude'] = df['longitude'].apply(lambda x: limpar_coordenada_inteligente(x, 'lon'))
-    
-    # Remove inválidos
-    df = df.dropna(subset=['latitude', 'longitude'])
+    with etapa(execucao, 'E_coordenadas', len(df)) as medida:
+        df['latitude'], relatorio['latitude'] = corrigir_coordenadas_vetorizado(
+            df['latitude'], 'lat', limites=(lat_min, lat_max))
+        df['longitude'], relatorio['longitude'] = corrigir_coordenadas_vetorizado(
+            df['longitude'], 'lon', limites=(lon_min, lon_max))
 
-    print("\n--- AMOSTRA DE COORDENADAS DEPOIS DA LIMPEZA ---")
-    print(df[['latitude', 'longitude']].head(3).to_string())
-    print("------------------------------------------------\n")
+        # Remove inválidos
+        df = df.dropna(subset=['latitude', 'longitude'])
+        relatorio['coordenadas_validas'] = len(df)
+        medida['linhas_saida'] = len(df)
+        # Contagem por coluna: uma linha pode falhar na latitude e na longitude
+        for coluna in ('latitude', 'longitude'):
+            for motivo, linhas in relatorio[coluna]['rejeitadas'].items():
+                medida['rejeitadas'][f"{coluna}_{motivo}"] = linhas
+
+    if mostrar_amostra:
+        print("\n--- AMOSTRA DE COORDENADAS DEPOIS DA LIMPEZA ---")
+        print(df[['latitude', 'longitude']].head(3).to_string())
+        print("------------------------------------------------\n")
 
     # F. Geofencing (Corte Fino)
-    df_geo = df[
-        (df['latitude'].between(FINAL_LAT_MIN, FINAL_LAT_MAX)) & 
-        (df['longitude'].between(FINAL_LON_MIN, FINAL_LON_MAX))
-    ].copy()
+    with etapa(execucao, 'F_geofencing', len(df)) as medida:
+        mask_geo = (
+            df['latitude'].between(final_lat_min, final_lat_max) &
+            df['longitude'].between(final_lon_min, final_lon_max)
+        )
+        relatorio['fora_geofencing'] = int((~mask_geo).sum())
+        df = df[mask_geo].copy()
+        medida['linhas_saida'] = len(df)
+        medida['rejeitadas']['fora_geofencing'] = relatorio['fora_geofencing']
+    return df, relatorio
+
+def imprimir_relatorio_coordenadas(relatorio, total_geo):
+    print(f"Registros válidos após Geofencing: {total_geo} (de {relatorio['coordenadas_validas']} originais)")
+    for nome, chave in (('Latitude', 'latitude'), ('Longitude', 'longitude')):
+        rel = relatorio.get(chave)
+        if rel is None:
+            continue
+        rej = rel['rejeitadas']
+        print(f"{nome}: {rel['reescaladas']} reescaladas | rejeitadas -> "
+              f"vazias: {rej['vazio']}, não numéricas: {rej['nao_numerico']}, "
+              f"fora do Maranhão: {rej['fora_do_limite']}")
+    print(f"Fora do Geofencing (corte fino): {relatorio['fora_geofencing']}")
+    if relatorio.get('fora_lista_rios'):
+        print(f"Fora da lista de rios do perfil: {relatorio['fora_lista_rios']}")
+
+def imputar_rios(df_geo, registro):
+    """
+    G. Rios por estação: cada amostra ganha o id da sua estação de monitoramento
+    (registro refeito sobre todas as amostras de df_geo, consulta haversine no
+    índice) e os rios vazios recebem o nome canônico da estação.
+    Retorna (df_geo, registro).
+    """
+    df_geo['rio_original'] = df_geo['rio']
+    registro, ids = registrar_amostras(registro, df_geo)
+    df_geo['id_estacao'] = ids
+    mask_nulos = (df_geo['rio'].isna() | (df_geo['rio'] == '')).to_numpy()
     
-    print(f"Registros válidos após Geofencing: {len(df_geo)} (de {len(df)} originais)")
+    if mask_nulos.any():
+        # Coluna categórica (ou toda vazia, float): passa a texto para receber os nomes
+        df_geo['rio'] = df_geo['rio'].astype(object)
+        df_geo.loc[mask_nulos, 'rio'] = rio_das_estacoes(registro, df_geo[mask_nulos], ids[mask_nulos])
+    return df_geo, registro
 
-    # G. KNN Rios (Mantido)
+def preparar_historico(df_historico):
+    """
+    Amostras já tratadas de volta ao ponto de entrada da etapa G: o rio
+    imputado volta ao original e as colunas das etapas G a I são refeitas
+    junto com as linhas novas. Base antiga (sem qc_) tem 0 como vazio.
+    """
+    df_historico = zeros_legados_como_vazio(df_historico)
+    derivadas = ['id_estacao', 'indice_problemas', 'lista_problemas', 'resultado_final']
+    derivadas += [c for c in df_historico.columns if c.startswith(('qc_', 'status_'))]
+    df_historico = df_historico.drop(columns=derivadas, errors='ignore')
+    if 'rio_original' in df_historico.columns:
+        df_historico['rio'] = df_historico.pop('rio_original')
+    return df_historico
+
+def finalizar_registros(df_geo, registro, execucao=None):
+    """
+    Etapas G a I, que precisam de todas as amostras válidas juntas (no modo
+    incremental, o histórico e as linhas novas). Retorna (df_geo, registro).
+    """
+    # G. Rios pelo registro de estações (substitui o KNN reajustado a cada execução)
     print("Processando nomes de rios...")
-    df_treino = df_geo.dropna(subset=['rio']).copy()
-    mask_nulos = df_geo['rio'].isna() | (df_geo['rio'] == '')
-    
-    if not df_treino.empty and mask_nulos.sum() > 0:
-        knn = KNeighborsClassifier(n_neighbors=1)
-        knn.fit(df_treino[['latitude', 'longitude']].values, df_treino['rio'].values)
-        df_geo.loc[mask_nulos, 'rio'] = knn.predict(df_geo.loc[mask_nulos, ['latitude', 'longitude']].values)
-
-    # H. Tratamento Numérico (Zerando vazios)
-    cols_num = ['ph', 'od', 'turbidez', 'temperatura', 'condutividade', 'fosforo']
-    for col in cols_num:
-        if col in df_geo.columns:
-            df_geo[col] = pd.to_numeric(df_geo[col], errors='coerce').fillna(0.0)
-
-    # I. Classificação
-    classificacao = df_geo.apply(classificar_conama, axis=1, result_type='expand')
-    df_geo['indice_problemas'] = classificacao[0]
-    df_geo['lista_problemas'] = classificacao[1]
-    df_geo['resultado_final'] = df_geo['indice_problemas'].apply(lambda x: 'Aprovado' if x == 0 else 'Reprovado')
+    with etapa(execucao, 'G_rios', len(df_geo)) as medida:
+        df_geo, registro = imputar_rios(df_geo, registro)
+        medida['linhas_saida'] = len(df_geo)
+
+    # H. Tratamento Numérico (vazio fica NaN: 0 é uma medição)
+    with etapa(execucao, 'H_numericos', len(df_geo)) as medida:
+        cols_num = ['ph', 'od', 'turbidez', 'temperatura', 'condutividade', 'std', 'fosforo', 'nitrogenio', 'salinidade']
+        for col in cols_num:
+            if col in df_geo.columns:
+                df_geo[col] = pd.to_numeric(df_geo[col], errors='coerce')
+        medida['linhas_saida'] = len(df_geo)
+
+    # H2. Controle de qualidade (faixa, outlier no grupo, pico na estação)
+    with etapa(execucao, 'H_qualidade', len(df_geo)) as medida:
+        df_geo, marcados = marcar_qualidade(df_geo)
+        medida['linhas_saida'] = len(df_geo)
+        # Aqui a conta é de valores marcados, não de linhas
+        medida['rejeitadas'].update({f"valores_{rotulo}": n for rotulo, n in marcados.items()})
+
+    # I. Classificação (tabela CONAMA, vetorizada)
+    with etapa(execucao, 'I_classificacao', len(df_geo)) as medida:
+        df_geo = classificar_conama(df_geo)
+        medida['linhas_saida'] = len(df_geo)
+    return df_geo, registro
+
+def executar_etl(incremental=False, tamanho_lote=None, perfilar=None):
+    """
+    Roda o ETL completo. incremental=True processa só as linhas novas ou
+    alteradas; tamanho_lote=N lê o Excel em lotes de N linhas (memória limitada).
+    Cada etapa é medida e o relatório vai para CAMINHO_RELATORIO;
+    perfilar='E_coordenadas' (por exemplo) roda essa etapa sob o cProfile.
+    O relatório é gravado mesmo quando a execução falha (com o erro).
+    Retorna o resultado do relatório ('erro' presente quando falhou).
+    """
+    print("--- INICIANDO PROCESSAMENTO (MODO CORREÇÃO) ---")
+    execucao = nova_execucao(perfilar, incremental=incremental, tamanho_lote=tamanho_lote or None,
+                             entrada=CAMINHO_ENTRADA)
+    resultado = {}
+    try:
+        resultado = _executar_etl(execucao, incremental, tamanho_lote)
+    except BaseException as erro:
+        resultado = {'erro': f"{type(erro).__name__}: {erro}"}
+        raise
+    finally:
+        finalizar_execucao(execucao, CAMINHO_RELATORIO, **resultado)
+    return resultado
+
+def _executar_etl(execucao, incremental, tamanho_lote):
+    """Corpo do executar_etl. Devolve o resultado que vai para o relatório."""
+    # A. Carregar
+    if not os.path.exists(CAMINHO_ENTRADA):
+        print(f"🚨 ERRO: Arquivo não encontrado: {CAMINHO_ENTRADA}")
+        return {'erro': f"arquivo não encontrado: {CAMINHO_ENTRADA}"}
+    if tamanho_lote:
+        # No modo em lotes a leitura já seleciona e renomeia as colunas (A e B juntas)
+        lotes = iterar_medindo(execucao, 'A_carregar', ler_excel_em_lotes(CAMINHO_ENTRADA, tamanho_lote))
+    else:
+        with etapa(execucao, 'A_carregar') as medida:
+            df_bruto = pd.read_excel(CAMINHO_ENTRADA)
+            medida['linhas_saida'] = len(df_bruto)
+        # B. Renomear
+        with etapa(execucao, 'B_renomear', len(df_bruto)) as medida:
+            lotes = [selecionar_colunas(df_bruto)]
+            medida['linhas_saida'] = len(lotes[0])
+        del df_bruto
+
+    # Modo incremental: só processa linhas novas ou alteradas
+    df_historico = None
+    estado = carregar_estado() if incremental else None
+    if incremental and estado is not None and estado.get("versao_config") != versao_configuracao():
+        print("Configuração mudou desde a última execução: reprocessando tudo.")
+        estado = None
+    if estado is not None and os.path.exists(CAMINHO_SAIDA):
+        conhecidas = np.array(estado["impressoes"], dtype='int64')
+        marca = pd.Timestamp(estado["marca_dagua"]) if estado["marca_dagua"] else pd.NaT
+        df_historico = pd.read_csv(CAMINHO_SAIDA, parse_dates=['data'], float_precision='round_trip')
+        df_historico['lista_problemas'] = df_historico['lista_problemas'].fillna('')  # CSV lê '' como vazio
+
+    registro = novo_registro(RAIO_ESTACAO_M)
+
+    todas_impressoes, partes, relatorio = [], [], {}
+    total_linhas, total_novas, marca_nova = 0, 0, pd.NaT
+    for i, df in enumerate(lotes):
+        with etapa(execucao, 'impressoes', len(df)) as medida:
+            impressoes = calcular_impressoes(df)
+            df['hash_linha'] = impressoes
+            medida['linhas_saida'] = len(df)
+        with etapa(execucao, 'C_conversao_datas', len(df)) as medida:
+            df['data'] = converter_datas(df['data'])
+            medida['linhas_saida'] = len(df)
+        todas_impressoes.append(impressoes)
+        total_linhas += len(df)
+        marca_nova = max(marca_nova, df['data'].max()) if pd.notna(marca_nova) else df['data'].max()
+
+        if df_historico is not None:
+            with etapa(execucao, 'incremental', len(df)) as medida:
+                # Marca d'água: datas posteriores à última carga são novas com certeza;
+                # só o resto precisa ser conferido contra as impressões já processadas.
+                mask_novos = (df['data'] > marca).to_numpy(copy=True) if pd.notna(marca) else np.zeros(len(df), dtype=bool)
+                mask_novos[~mask_novos] = ~np.isin(impressoes[~mask_novos], conhecidas)
+                df = df[mask_novos]
+                medida['linhas_saida'] = len(df)
+                medida['rejeitadas']['ja_processadas'] = medida['linhas_entrada'] - len(df)
+        total_novas += len(df)
+
+        parte, rel = limpar_lote(df, mostrar_amostra=(i == 0), execucao=execucao)
+        somar_relatorios(relatorio, rel)
+        partes.append(parte)
+
+    impressoes = np.concatenate(todas_impressoes) if todas_impressoes else np.array([], dtype='int64')
+    if df_historico is not None:
+        print(f"Modo incremental: {total_novas} linhas novas/alteradas "
+              f"(de {total_linhas}; marca d'água: {estado['marca_dagua']})")
+        # Linhas que sumiram do Excel (apagadas ou editadas) saem da base
+        df_anterior = df_historico
+        df_historico = preparar_historico(df_historico[df_historico['hash_linha'].isin(impressoes)])
+
+    df_geo = pd.concat(partes) if partes else pd.DataFrame()
+    if relatorio.get('municipio', 0) == 0:
+        if df_historico is None or df_historico.empty:
+            print(f"🚨 ERRO CRÍTICO: Filtro '{MUNICIPIO_PADRAO}' removeu tudo. Verifique o nome no Excel.")
+            return {'erro': f"filtro {MUNICIPIO_PADRAO} removeu tudo"}
+        print(f"Nenhum registro novo de {MUNICIPIO_PADRAO} neste lote.")
+        df_geo = df_historico
+    else:
+        imprimir_relatorio_coordenadas(relatorio, len(df_geo))
+        if df_historico is not None:
+            df_geo = pd.concat([df_historico, df_geo], ignore_index=True)
+
+    # G a I sobre o histórico e o lote novo juntos: as linhas novas mudam os
+    # grupos do controle de qualidade e as séries das estações das antigas
+    df_geo, registro = finalizar_registros(df_geo, registro, execucao)
+    particoes_alteradas = None
+    if df_historico is not None:
+        # Só as partições cujo conteúdo mudou (linhas novas, apagadas ou remarcadas)
+        particoes_alteradas = particoes_diferentes(df_anterior, df_geo)
+
 
-    # Status individuais
-    df_geo['status_ph'] = df_geo['ph'].apply(lambda x: 'Fora' if (x>0 and not 6<=x<=9) else 'OK')
-    df_geo['status_od'] = df_geo['od'].apply(lambda x: 'Fora' if (x!=0 and x<5) else 'OK')
-    
     # Salvar
-    os.makedirs(os.path.dirname(CAMINHO_SAIDA), exist_ok=True)
-    df_geo.to_csv(CAMINHO_SAIDA, index=False)
+    with etapa(execucao, 'salvar', len(df_geo)) as medida:
+        os.makedirs(os.path.dirname(CAMINHO_SAIDA), exist_ok=True)
+        # Troca atômica: o painel no ar nunca lê um CSV pela metade
+        df_geo.to_csv(CAMINHO_SAIDA + ".tmp", index=False)
+        os.replace(CAMINHO_SAIDA + ".tmp", CAMINHO_SAIDA)
+        # Base colunar por ano/rio para o painel (no incremental, só as partições tocadas)
+        salvar_particionado(df_geo, CAMINHO_PARTICOES, particoes=particoes_alteradas)
+        # Cubo (ano, rio, mês) para os indicadores e séries do painel
+        salvar_cubo(df_geo, CAMINHO_CUBO)
+        # Somas por (ano, rio) para a correlação e o preenchimento do painel
+        salvar_momentos(df_geo, CAMINHO_MOMENTOS)
+        # Tendências (Mann-Kendall/Sen) e anomalias por rio e por estação
+        salvar_tendencias(df_geo, CAMINHO_TENDENCIAS, CAMINHO_SERIES)
+        salvar_registro(registro, CAMINHO_ESTACOES)
+        salvar_nomes()
+        salvar_estado(impressoes, marca_nova)
+        # Por último: publica a versão nova para o painel e o serviço
+        escrever_manifesto(CAMINHO_MANIFESTO)
+        medida['linhas_saida'] = len(df_geo)
     print(f"✅ SUCESSO! Arquivo salvo: {CAMINHO_SAIDA}")
+    return {'linhas_lidas': total_linhas, 'linhas_novas': total_novas, 'linhas_saida': len(df_geo),
+            'saida': CAMINHO_SAIDA}
+
+def caminho_estacoes_municipio(nome):
+    return os.path.join(CAMINHO_ESTACOES_MUNICIPIOS, re.sub(r'[^A-Z0-9]+', '_', nome) + ".pkl")
+
+def processar_municipio(perfil, df):
+    """
+    Etapas C a I de um município, com o perfil e o registro de estações dele.
+    Roda num processo do pool e grava a própria partição. Retorna um resumo.
+    """
+    df_geo, relatorio = limpar_lote(df, perfil=perfil)
+    resumo = {'municipio': perfil['nome'], 'linhas': len(df), 'validas': len(df_geo), 'relatorio': relatorio}
+    if df_geo.empty:
+        remover_municipio(perfil['nome'], CAMINHO_MUNICIPIOS)
+        return resumo
+
+    caminho_registro = caminho_estacoes_municipio(perfil['nome'])
+    registro = novo_registro(RAIO_ESTACAO_M)
+    df_geo, registro = finalizar_registros(df_geo, registro)
+    salvar_municipio(df_geo, perfil['nome'], CAMINHO_MUNICIPIOS)
+    salvar_registro(registro, caminho_registro)
+    return resumo
+
+def executar_etl_municipios(municipios=None, processos=None):
+    """
+    ETL de todos os municípios da planilha (ou só dos listados em `municipios`),
+    cada um com o seu perfil, em paralelo num pool de processos. Gera uma
+    partição por município em CAMINHO_MUNICIPIOS. A planilha inteira fica na
+    memória (cada processo recebe o grupo do seu município), então este modo
+    não lê em lotes. Retorna {'erro': ...} quando falha.
+    """
+    print("--- INICIANDO PROCESSAMENTO POR MUNICÍPIO ---")
+
+    # A. Carregar
+    if not os.path.exists(CAMINHO_ENTRADA):
+        print(f"🚨 ERRO: Arquivo não encontrado: {CAMINHO_ENTRADA}")
+        return {'erro': f"arquivo não encontrado: {CAMINHO_ENTRADA}"}
+    df = selecionar_colunas(pd.read_excel(CAMINHO_ENTRADA))
+
+    # Normaliza o município antes de repartir a entrada entre os processos
+    df['hash_linha'] = calcular_impressoes(df)
+    df['data'] = converter_datas(df['data'])
+    df['municipio'] = padronizar_coluna(df['municipio'], 'municipio')
+    df['rio'] = padronizar_coluna(df['rio'], 'rio')
+    # Os processos já encontram todos os nomes no memo salvo
+    salvar_nomes()
+    grupos = dict(tuple(df.groupby('municipio', observed=True)))
+
+    if municipios is None:
+        nomes = list(grupos)
+    else:
+        nomes = [padronizar_texto(m) for m in municipios]
+        for nome in nomes:
+            if nome not in grupos:
+                print(f"⚠️ Município sem amostras na planilha: {nome}")
+    # Maiores primeiro: o último a terminar não é um município grande que
+    # ficou para o fim da fila
+    tarefas = sorted(((perfil_municipio(n), grupos[n]) for n in nomes if n in grupos), key=lambda t: -len(t[1]))
+
+    os.makedirs(CAMINHO_ESTACOES_MUNICIPIOS, exist_ok=True)
+    processos = processos or os.cpu_count() or 1
+    print(f"{len(tarefas)} municípios em {processos} processo(s)...")
+    if processos == 1:
+        resumos = [processar_municipio(perfil, grupo) for perfil, grupo in tarefas]
+    else:
+        with ProcessPoolExecutor(max_workers=processos) as pool:
+            futuros = [pool.submit(processar_municipio, perfil, grupo) for perfil, grupo in tarefas]
+            resumos = [f.result() for f in futuros]
+
+    # Execução completa: municípios que sumiram da planilha saem da base
+    if municipios is None:
+        for nome in set(listar_municipios(CAMINHO_MUNICIPIOS)) - set(nomes):
+            remover_municipio(nome, CAMINHO_MUNICIPIOS)
+
+    print("\nMunicípio                          lidas  válidas")
+    for resumo in sorted(resumos, key=lambda r: r['municipio']):
+        print(f"{resumo['municipio']:<32} {resumo['linhas']:>7} {resumo['validas']:>8}")
+    salvos = sum(1 for r in resumos if r['validas'])
+    print(f"✅ SUCESSO! {salvos} municípios salvos em: {CAMINHO_MUNICIPIOS}")
+
+    # Tendências do estado inteiro, sobre todas as partições por município
+    base = ler_municipios(CAMINHO_MUNICIPIOS)
+    if base is not None:
+        tendencias, _ = salvar_tendencias(base, CAMINHO_TENDENCIAS_MUNICIPIOS, CAMINHO_SERIES_MUNICIPIOS)
+        print(f"✅ Tendências de {len(tendencias)} séries salvas em: {CAMINHO_TENDENCIAS_MUNICIPIOS}")
 
 if __name__ == "__main__":
-    executar_etl()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ETL da qualidade da água - São Luís/MA")
+    parser.add_argument("--incremental", action="store_true",
+                        help="processa apenas linhas novas ou alteradas desde a última execução")
+    parser.add_argument("--lotes", type=int, default=0, metavar="N",
+                        help="lê o Excel em lotes de N linhas (memória limitada); 0 lê tudo de uma vez")
+    parser.add_argument("--municipios", nargs="*", metavar="NOME",
+                        help="processa cada município com o seu perfil, em paralelo (sem nomes: todos da planilha)")
+    parser.add_argument("--processos", type=int, default=0, metavar="N",
+                        help="processos do modo --municipios; 0 usa todos os núcleos")
+    parser.add_argument("--perfilar", metavar="ETAPA",
+                        help="roda a etapa (ex.: E_coordenadas) sob o cProfile e grava o .prof ao lado do relatório")
+    args = parser.parse_args()
+    if args.municipios is not None:
+        if args.incremental:
+            parser.error("--incremental não vale para o modo --municipios")
+        if args.lotes:
+            # Os grupos por município precisam da planilha inteira: não haveria limite de memória
+            parser.error("--lotes não vale para o modo --municipios")
+        resultado = executar_etl_municipios(municipios=args.municipios or None, processos=args.processos)
+    else:
+        resultado = executar_etl(incremental=args.incremental, tamanho_lote=args.lotes, perfilar=args.perfilar)
+    # O ETL em segundo plano (atualizacao_dados) decide pelo código de saída
+    if resultado and 'erro' in resultado:
+        sys.exit(1)
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+from esquema import COLUNAS_MEDIDAS, PREFIXO_QUALIDADE
+
+# ==============================================================================
+# CONTROLE DE QUALIDADE DAS MEDIÇÕES
+# ==============================================================================
+# Cada valor medido passa por três testes, todos vetorizados sobre a tabela
+# longa (linha, parâmetro, valor) e agrupados de uma vez, sem laço por linha:
+#   1. faixa plausível do parâmetro (limite físico / do instrumento);
+#   2. outlier robusto no grupo (rio, parâmetro, período do ano): z robusto
+#      pela mediana/MAD e, junto, fora das cercas de IQR; grupo pequeno usa o
+#      grupo (parâmetro, período) de todos os rios;
+#   3. pico na série da estação (teste de spike: o valor destoa da média dos
+#      vizinhos no tempo mais do que os vizinhos destoam entre si).
+# A marca de cada valor vai para qc_<parâmetro> (bits FLAG_*, 0 = passou).
+# As medições não mudam: um valor marcado continua na coluna (pode ser uma
+# violação real do CONAMA), e quem usa a base decide o que fazer com as
+# marcas. Vazio continua NaN, nunca 0.
+FAIXAS_PLAUSIVEIS = {
+    "ph": (2.0, 12.0),
+    "od": (0.0, 20.0),               # mg/L (supersaturação fica bem abaixo)
+    "turbidez": (0.0, 4000.0),       # NTU
+    "temperatura": (15.0, 40.0),     # °C
+    "condutividade": (0.0, 80000.0), # µS/cm (água do mar ~55000)
+    "std": (0.0, 60000.0),           # mg/L
+    "fosforo": (0.0, 50.0),          # mg/L de P
+    "nitrogenio": (0.0, 100.0),      # mg/L de N
+    "salinidade": (0.0, 45.0),       # ‰
+}
+
+# São Luís: chuvas de janeiro a junho, estiagem de julho a dezembro
+MESES_CHUVOSOS = [1, 2, 3, 4, 5, 6]
+
+# Parâmetros assimétricos (variam em ordens de grandeza): outlier e pico são
+# testados em log10(1 + valor), onde um erro de unidade/vírgula é um salto
+PARAMETROS_LOG = ["turbidez", "condutividade", "std", "fosforo", "nitrogenio", "salinidade"]
+
+MIN_AMOSTRAS_GRUPO = 8
+LIMIAR_Z_ROBUSTO = 3.5
+FATOR_IQR = 3.0
+LIMIAR_PICO = 6.0          # em desvios robustos da série da estação
+MIN_HISTORICO_PICO = 5
+
+FLAG_FAIXA, FLAG_OUTLIER, FLAG_PICO = 1, 2, 4
+ROTULOS_FLAGS = {FLAG_FAIXA: "fora_faixa", FLAG_OUTLIER: "outlier", FLAG_PICO: "pico"}
+
+
+def _por_grupo(codigos, valores):
+    """Contagem, quartis e desvio robusto (MAD; sem MAD, desvio médio) de cada grupo, já por valor."""
+    grupos = pd.Series(valores).groupby(codigos)
+    n = grupos.size().to_numpy()[codigos]
+    # Os três quantis numa chamada só (uma ordenação por grupo)
+    q1, mediana, q3 = grupos.quantile([0.25, 0.5, 0.75]).to_numpy().reshape(-1, 3)[codigos].T
+    desvios = pd.Series(np.abs(valores - mediana)).groupby(codigos)
+    # Constantes que tornam as duas escalas comparáveis ao desvio padrão
+    escala = 1.4826 * desvios.median().to_numpy()[codigos]
+    escala = np.where(escala > 0, escala, 1.2533 * desvios.mean().to_numpy()[codigos])
+    return n, q1, mediana, q3, escala
+
+
+def _outliers(valores, parametro, rio, periodo):
+    """Outlier robusto no grupo (rio, parâmetro, período), ou no grupo geral se o do rio for pequeno."""
+    n_params = len(COLUNAS_MEDIDAS)
+    _, por_rio = np.unique((rio * n_params + parametro) * 2 + periodo, return_inverse=True)
+    _, geral = np.unique(parametro * 2 + periodo, return_inverse=True)
+    estat_rio, estat_geral = _por_grupo(por_rio, valores), _por_grupo(geral, valores)
+    usa_rio = estat_rio[0] >= MIN_AMOSTRAS_GRUPO
+    n, q1, mediana, q3, escala = (np.where(usa_rio, r, g) for r, g in zip(estat_rio, estat_geral))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.abs(valores - mediana) / escala
+    iqr = q3 - q1
+    fora_cercas = (valores < q1 - FATOR_IQR * iqr) | (valores > q3 + FATOR_IQR * iqr)
+    return (n >= MIN_AMOSTRAS_GRUPO) & (escala > 0) & (z > LIMIAR_Z_ROBUSTO) & fora_cercas
+
+
+def _picos(valores, parametro, estacao, datas):
+    """Teste de spike em cada série (estação, parâmetro) ordenada pela data."""
+    # Empate de data desempata pelo valor: a ordem das linhas não muda o resultado
+    ordem = np.lexsort((valores, datas, parametro, estacao))
+    v = valores[ordem]
+    serie = estacao[ordem].astype('int64') * len(COLUNAS_MEDIDAS) + parametro[ordem]
+    _, codigos = np.unique(serie, return_inverse=True)
+    n, _, _, _, escala = _por_grupo(codigos, v)
+
+    anterior, seguinte = np.full(len(v), np.nan), np.full(len(v), np.nan)
+    mesma_serie = serie[1:] == serie[:-1]
+    anterior[1:] = np.where(mesma_serie, v[:-1], np.nan)
+    seguinte[:-1] = np.where(mesma_serie, v[1:], np.nan)
+    with np.errstate(invalid='ignore'):
+        desvio = np.abs(v - (anterior + seguinte) / 2) - np.abs(seguinte - anterior) / 2
+        pico = (n >= MIN_HISTORICO_PICO) & (escala > 0) & (desvio > LIMIAR_PICO * escala)
+
+    resultado = np.zeros(len(v), dtype=bool)
+    resultado[ordem] = pico
+    return resultado
+
+
+def marcar_qualidade(df):
+    """
+    H2. Marca as medições suspeitas de df em qc_<parâmetro>. Os grupos e as
+    séries das estações são as de df, então df precisa ser a base inteira
+    (no modo incremental, o histórico junto das linhas novas).
+    Retorna (df, {rótulo da marca: valores marcados}).
+    """
+    parametros = [c for c in COLUNAS_MEDIDAS if c in df.columns]
+    base = df[parametros + [c for c in ('rio', 'data', 'id_estacao') if c in df.columns]]
+
+    valores = base[parametros].to_numpy(dtype='float64', na_value=np.nan)
+    linha, coluna = np.nonzero(~np.isnan(valores))
+    v = valores[linha, coluna]
+    parametro = np.array([COLUNAS_MEDIDAS.index(p) for p in parametros])[coluna]
+    marcas = np.zeros(len(v), dtype='int8')
+
+    minimos = np.array([FAIXAS_PLAUSIVEIS.get(p, (-np.inf, np.inf))[0] for p in parametros])
+    maximos = np.array([FAIXAS_PLAUSIVEIS.get(p, (-np.inf, np.inf))[1] for p in parametros])
+    fora_faixa = (v < minimos[coluna]) | (v > maximos[coluna])
+    marcas[fora_faixa] |= FLAG_FAIXA
+
+    # Grupos e séries só com os valores dentro da faixa
+    ok = ~fora_faixa
+    em_log = np.isin(np.array(parametros, dtype=object), PARAMETROS_LOG)[coluna] & ok
+    teste = v.copy()
+    teste[em_log] = np.log10(1 + v[em_log])
+    rio = pd.factorize(base['rio'].astype(object), use_na_sentinel=True)[0][linha]
+    periodo = base['data'].dt.month.isin(MESES_CHUVOSOS).to_numpy()[linha].astype('int64')
+    indices_ok = np.flatnonzero(ok)
+    outlier = _outliers(teste[ok], parametro[ok], rio[ok], periodo[ok])
+    marcas[indices_ok[outlier]] |= FLAG_OUTLIER
+    if 'id_estacao' in base.columns:
+        estacao = base['id_estacao'].to_numpy()[linha]
+        datas = base['data'].to_numpy().view('int64')[linha]
+        pico = _picos(teste[ok], parametro[ok], estacao[ok], datas[ok])
+        marcas[indices_ok[pico]] |= FLAG_PICO
+
+    matriz = np.zeros(valores.shape, dtype='int8')
+    matriz[linha, coluna] = marcas
+    for j, p in enumerate(parametros):
+        df[PREFIXO_QUALIDADE + p] = matriz[:, j]
+
+    contagem = {rotulo: int(((matriz & flag) != 0).sum()) for flag, rotulo in ROTULOS_FLAGS.items()}
+    return df, contagem
@@ -0,0 +1,383 @@
+import argparse
+import email.utils
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import agregados
+import armazenamento
+import esquema
+import indice_filtros
+import manifesto
+
+# ==============================================================================
+# SERVIÇO DE CONSULTAS (HTTP, SEM INTERFACE)
+# ==============================================================================
+# Carrega a base tratada uma vez (com o índice de filtros e o cubo) e responde
+# em JSON. Cada resposta tem ETag e Last-Modified ligados à versão dos dados
+# (manifesto.py):
+# clientes que repetem a consulta recebem 304, e consultas repetidas por
+# clientes diferentes saem do cache de respostas em memória.
+#
+#   GET /amostras?anos=2023,2024&rios=RIO ANIL&bbox=lon_min,lat_min,lon_max,lat_max
+#   GET /indicadores?anos=...&rios=...
+#   GET /serie?parametro=od&anos=...&rios=...
+#   GET /geojson?anos=...&rios=...&bbox=...
+#   GET /versao
+CAMINHO_DADOS = "data/processed/dados_tratados_tcc.csv"
+PORTA_PADRAO = 8502
+LIMITE_CACHE_MB = 32
+LIMITE_AMOSTRAS = 10000
+
+COLUNAS_STATUS = ['status_ph', 'status_od', 'status_turbidez']
+PROPRIEDADES_MAPA = ['rio', 'data', 'id_estacao', 'indice_problemas', 'lista_problemas', 'resultado_final']
+
+_trava = threading.Lock()
+_base = None
+_carregando = None
+_respostas = OrderedDict()
+_total_bytes = 0
+
+
+class ErroConsulta(ValueError):
+    """Parâmetro inválido na consulta (vira HTTP 400)."""
+
+
+# ------------------------------------------------------------------------------
+# Dados e versão
+# ------------------------------------------------------------------------------
+
+def versao_dados():
+    """(versão, última modificação) do manifesto gravado pelo ETL (hash do conteúdo)."""
+    versoes = manifesto.versoes()
+    return versoes['versao'], versoes['gerado_em']
+
+
+def _ler_amostras():
+    particoes = armazenamento.listar_particoes()
+    if particoes is not None and not particoes.empty:
+        df = armazenamento.ler_particoes(particoes['ano'].unique(), particoes['rio'].dropna().unique())
+        return esquema.aplicar_esquema(df)
+    if os.path.exists(CAMINHO_DADOS):
+        return esquema.aplicar_esquema(esquema.zeros_legados_como_vazio(pd.read_csv(CAMINHO_DADOS)))
+    return None
+
+
+def _carregar_base(versao, modificado):
+    df = _ler_amostras()
+    if df is None:
+        return None
+    df = df.reset_index(drop=True)
+    cubo = agregados.carregar_cubo()
+    return {
+        'versao': versao,
+        'modificado': modificado,
+        'amostras': df,
+        'indice': indice_filtros.construir_indice({'ano': df['data'].dt.year, 'rio': df['rio']}),
+        'cubo': cubo if cubo is not None else agregados.construir_cubo(df),
+    }
+
+
+def _trocar_base(versao, modificado):
+    """Carrega a versão nova fora da trava e troca a base (e o cache de respostas) de uma vez."""
+    global _base, _carregando
+    try:
+        nova = _carregar_base(versao, modificado)
+        with _trava:
+            _base = nova
+            _limpar_respostas()
+    finally:
+        with _trava:
+            _carregando = None
+
+
+def obter_base():
+    """
+    Base em memória (amostras, índice, cubo). Quando a versão dos dados muda,
+    a nova é carregada numa thread e, até ficar pronta, as consultas seguem
+    respondidas com a anterior (sem pausa de carga fria).
+    """
+    global _carregando
+    versao, modificado = versao_dados()
+    with _trava:
+        base, carregando = _base, _carregando
+        if base is not None and base['versao'] != versao and carregando is None:
+            _carregando = versao
+            threading.Thread(target=_trocar_base, args=(versao, modificado), daemon=True).start()
+    if base is not None:
+        return base
+    # Primeira carga (ou base ainda ausente): não há o que servir antes
+    _trocar_base(versao, modificado)
+    with _trava:
+        return _base
+
+
+# ------------------------------------------------------------------------------
+# Cache de respostas (LRU limitado por tamanho)
+# ------------------------------------------------------------------------------
+
+def _limpar_respostas():
+    global _total_bytes
+    _respostas.clear()
+    _total_bytes = 0
+
+
+def _guardar_resposta(chave, resposta):
+    global _total_bytes
+    limite = LIMITE_CACHE_MB * 1024 * 1024
+    with _trava:
+        if chave not in _respostas:
+            _respostas[chave] = resposta
+            _total_bytes += len(resposta['corpo'])
+        while _total_bytes > limite and len(_respostas) > 1:
+            _, antiga = _respostas.popitem(last=False)
+            _total_bytes -= len(antiga['corpo'])
+
+
+def _resposta_em_cache(chave):
+    with _trava:
+        if chave in _respostas:
+            _respostas.move_to_end(chave)
+            return _respostas[chave]
+    return None
+
+
+# ------------------------------------------------------------------------------
+# Parâmetros e consultas
+# ------------------------------------------------------------------------------
+
+def _lista(parametros, nome):
+    """Aceita ?rios=A&rios=B e ?rios=A,B. None quando o parâmetro não veio."""
+    if nome not in parametros:
+        return None
+    return [v.strip() for valor in parametros[nome] for v in valor.split(',') if v.strip()]
+
+
+def _selecao(base, parametros):
+    anos = _lista(parametros, 'anos')
+    rios = _lista(parametros, 'rios')
+    try:
+        anos = [int(a) for a in anos] if anos is not None else indice_filtros.valores_disponiveis(base['indice'], 'ano')
+    except ValueError:
+        raise ErroConsulta("anos deve ser uma lista de inteiros, ex.: anos=2023,2024")
+    if rios is None:
+        rios = indice_filtros.valores_disponiveis(base['indice'], 'rio')
+    return anos, rios
+
+
+def _bbox(parametros):
+    valores = _lista(parametros, 'bbox')
+    if valores is None:
+        return None
+    try:
+        lon_min, lat_min, lon_max, lat_max = (float(v) for v in valores)
+    except ValueError:
+        raise ErroConsulta("bbox deve ser lon_min,lat_min,lon_max,lat_max")
+    return lon_min, lat_min, lon_max, lat_max
+
+
+def _filtrar_amostras(base, parametros):
+    anos, rios = _selecao(base, parametros)
+    df = base['amostras'].iloc[indice_filtros.filtrar_posicoes(base['indice'], ano=anos, rio=rios)]
+    bbox = _bbox(parametros)
+    if bbox is not None:
+        lon_min, lat_min, lon_max, lat_max = bbox
+        df = df[df['longitude'].between(lon_min, lon_max) & df['latitude'].between(lat_min, lat_max)]
+    return df
+
+
+def _inteiro(parametros, nome, padrao):
+    # Negativo fatiaria a partir do fim (limite=-1 devolveria a base quase toda)
+    try:
+        valor = int(parametros.get(nome, [padrao])[0])
+    except ValueError:
+        raise ErroConsulta(f"{nome} deve ser inteiro")
+    if valor < 0:
+        raise ErroConsulta(f"{nome} não pode ser negativo")
+    return valor
+
+
+def consultar_amostras(base, parametros):
+    df = _filtrar_amostras(base, parametros)
+    limite = min(_inteiro(parametros, 'limite', LIMITE_AMOSTRAS), LIMITE_AMOSTRAS)
+    deslocamento = _inteiro(parametros, 'deslocamento', 0)
+    pagina = esquema.para_exibicao(df.iloc[deslocamento:deslocamento + limite])
+    return {
+        'total': len(df),
+        'deslocamento': deslocamento,
+        'amostras': json.loads(pagina.to_json(orient='records', date_format='iso')),
+    }
+
+
+def consultar_indicadores(base, parametros):
+    anos, rios = _selecao(base, parametros)
+    cubo_sel = agregados.filtrar_cubo(base['cubo'], anos, rios)
+    kpis = agregados.indicadores(cubo_sel)
+    status = {}
+    for coluna in COLUNAS_STATUS:
+        contagem = agregados.contagem_status(cubo_sel, coluna)
+        status[coluna] = {} if contagem is None else {k: int(v) for k, v in contagem.items()}
+    return {
+        'total': kpis['total'],
+        'percentual_aprovados': float(kpis['percentual_aprovados']),
+        'rio_critico': kpis['rio_critico'],
+        'status': status,
+    }
+
+
+def consultar_serie(base, parametros):
+    parametro = parametros.get('parametro', [None])[0]
+    if parametro not in agregados.PARAMETROS_CUBO:
+        raise ErroConsulta(f"parametro deve ser um de: {', '.join(agregados.PARAMETROS_CUBO)}")
+    anos, rios = _selecao(base, parametros)
+    serie = agregados.serie_mensal(agregados.filtrar_cubo(base['cubo'], anos, rios), parametro)
+    return {
+        'parametro': parametro,
+        'serie': [{'data': d.date().isoformat(), 'media': None if np.isnan(v) else float(v)}
+                  for d, v in zip(serie['data'], serie[parametro])],
+    }
+
+
+def consultar_geojson(base, parametros):
+    df = _filtrar_amostras(base, parametros)
+    colunas = [c for c in PROPRIEDADES_MAPA + COLUNAS_STATUS if c in df.columns]
+    propriedades = json.loads(esquema.para_exibicao(df[colunas]).to_json(orient='records', date_format='iso'))
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature',
+             'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+             'properties': props}
+            for lon, lat, props in zip(df['longitude'], df['latitude'], propriedades)
+        ],
+    }
+
+
+def consultar_versao(base, parametros):
+    return {'versao': base['versao'], 'amostras': len(base['amostras'])}
+
+
+ROTAS = {
+    '/amostras': (consultar_amostras, 'application/json'),
+    '/indicadores': (consultar_indicadores, 'application/json'),
+    '/serie': (consultar_serie, 'application/json'),
+    '/geojson': (consultar_geojson, 'application/geo+json'),
+    '/versao': (consultar_versao, 'application/json'),
+}
+
+
+def responder(caminho, parametros):
+    """
+    Resposta (dict com status, corpo, ETag...) de uma consulta, do cache quando
+    possível. Separada do servidor HTTP para poder ser chamada direto.
+    """
+    if caminho not in ROTAS:
+        return _erro(404, f"rota desconhecida: {caminho}")
+    base = obter_base()
+    if base is None:
+        return _erro(503, "base tratada não encontrada; rode o processamento_dados.py")
+
+    # Mesma consulta com parâmetros em outra ordem = mesma entrada do cache
+    chave = (base['versao'], caminho, tuple(sorted((k, tuple(v)) for k, v in parametros.items())))
+    resposta = _resposta_em_cache(chave)
+    if resposta is not None:
+        return resposta
+
+    funcao, tipo = ROTAS[caminho]
+    try:
+        conteudo = funcao(base, parametros)
+    except ErroConsulta as erro:
+        return _erro(400, str(erro))
+    corpo = json.dumps(conteudo, ensure_ascii=False).encode('utf-8')
+    resposta = {
+        'status': 200,
+        'corpo': corpo,
+        'tipo': tipo,
+        'etag': '"' + hashlib.sha1(repr(chave).encode()).hexdigest()[:20] + '"',
+        'modificado': base['modificado'],
+    }
+    _guardar_resposta(chave, resposta)
+    return resposta
+
+
+def _erro(status, mensagem):
+    return {'status': status, 'corpo': json.dumps({'erro': mensagem}, ensure_ascii=False).encode('utf-8'),
+            'tipo': 'application/json', 'etag': None, 'modificado': None}
+
+
+def _nao_modificado(cabecalhos, resposta):
+    """Validação condicional: If-None-Match tem prioridade sobre If-Modified-Since."""
+    if resposta['etag'] is None:
+        return False
+    if_none_match = cabecalhos.get('If-None-Match')
+    if if_none_match is not None:
+        etags = [e.strip() for e in if_none_match.split(',')]
+        return '*' in etags or resposta['etag'] in etags or ('W/' + resposta['etag']) in etags
+    if_modified_since = cabecalhos.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            desde = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified tem resolução de segundos
+        return int(resposta['modificado']) <= desde
+    return False
+
+
+class ManipuladorConsultas(BaseHTTPRequestHandler):
+    server_version = "MonitoramentoRios/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        caminho = url.path.rstrip('/') or '/'
+        resposta = responder(caminho, parse_qs(url.query))
+
+        if resposta['status'] == 200 and _nao_modificado(self.headers, resposta):
+            self.send_response(304)
+            self._cabecalhos_cache(resposta)
+            self.end_headers()
+            return
+
+        self.send_response(resposta['status'])
+        self.send_header('Content-Type', f"{resposta['tipo']}; charset=utf-8")
+        self.send_header('Content-Length', str(len(resposta['corpo'])))
+        if resposta['status'] == 200:
+            self._cabecalhos_cache(resposta)
+        self.end_headers()
+        self.wfile.write(resposta['corpo'])
+
+    def _cabecalhos_cache(self, resposta):
+        self.send_header('ETag', resposta['etag'])
+        self.send_header('Last-Modified', email.utils.formatdate(resposta['modificado'], usegmt=True))
+        # O cliente pode guardar, mas revalida (barato: 304) antes de reusar
+        self.send_header('Cache-Control', 'no-cache')
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def iniciar(host="127.0.0.1", porta=PORTA_PADRAO):
+    servidor = ThreadingHTTPServer((host, porta), ManipuladorConsultas)
+    obter_base()
+    print(f"✅ Serviço de consultas em http://{host}:{porta} (rotas: {', '.join(ROTAS)})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serviço HTTP de consultas sobre a base tratada")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=PORTA_PADRAO)
+    args = parser.parse_args()
+    iniciar(args.host, args.porta)
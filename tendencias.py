@@ -0,0 +1,308 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.special import erfc
+
+import armazenamento
+from agregados import PARAMETROS_CUBO
+
+# ==============================================================================
+# TENDÊNCIAS E ANOMALIAS POR SÉRIE (rio ou estação, parâmetro)
+# ==============================================================================
+# Cada série é a média mensal de um parâmetro num rio (ou numa estação). Todas
+# as séries são montadas juntas numa matriz (série x mês) e os testes rodam em
+# blocos de séries, sem laço por série:
+#   - Mann-Kendall (com correção de empates) e inclinação de Sen, sobre os
+#     meses com dado;
+#   - anomalia: desvio robusto (mediana/MAD) de cada mês em relação aos
+#     JANELA_ANOMALIA meses com dado anteriores.
+# Saem duas tabelas: uma linha por série (tendências) e uma por série e mês.
+CAMINHO_TENDENCIAS = "data/processed/tendencias.parquet"
+CAMINHO_SERIES = "data/processed/series_mensais.parquet"
+# Modo por município: estado inteiro
+CAMINHO_TENDENCIAS_MUNICIPIOS = "data/processed/tendencias_municipios.parquet"
+CAMINHO_SERIES_MUNICIPIOS = "data/processed/series_mensais_municipios.parquet"
+
+# Nível -> colunas que identificam a série (as ausentes na base são ignoradas)
+NIVEIS = {
+    "rio": ["rio"],
+    "estacao": ["municipio", "rio", "id_estacao"],
+}
+
+MIN_MESES_TENDENCIA = 10
+NIVEL_SIGNIFICANCIA = 0.05
+
+JANELA_ANOMALIA = 12
+MIN_JANELA_ANOMALIA = 6
+# |z robusto| acima disso é anomalia (Iglewicz e Hoaglin)
+LIMIAR_ANOMALIA = 3.5
+
+# Teto de valores intermediários por bloco de séries (pares de meses ou janelas)
+LIMITE_VALORES_BLOCO = 4_000_000
+
+ROTULOS_TENDENCIA = {1: "Aumento", -1: "Queda", 0: "Sem tendência"}
+ROTULO_INSUFICIENTE = "Dados insuficientes"
+
+
+def _matriz_mensal(df, chaves, parametros):
+    """
+    Médias mensais de cada (chave, parâmetro) numa matriz (série x mês).
+    As colunas são só os meses que aparecem na base (datas perdidas em anos
+    absurdos não esticam a matriz). Devolve (chaves das séries, médias,
+    amostras por mês, número de cada mês: ano * 12 + mês - 1).
+    """
+    base = df.dropna(subset=['data'] + chaves)
+    grupos = base.groupby(chaves, observed=True, sort=True)
+    codigos = grupos.ngroup().to_numpy()
+    tabela_chaves = grupos.size().index.to_frame(index=False)
+
+    numeros, coluna = np.unique((base['data'].dt.year * 12 + base['data'].dt.month - 1).to_numpy(),
+                                return_inverse=True)
+    n_meses = len(numeros)
+    posicao = codigos * n_meses + coluna
+
+    valores = base[parametros].to_numpy(dtype='float64', na_value=np.nan)
+    validos = ~np.isnan(valores)
+    tamanho = len(tabela_chaves) * n_meses
+    somas, contagens = [], []
+    for j in range(len(parametros)):
+        somas.append(np.bincount(posicao, weights=np.where(validos[:, j], valores[:, j], 0.0), minlength=tamanho))
+        contagens.append(np.bincount(posicao, weights=validos[:, j], minlength=tamanho))
+
+    # (chave, parâmetro, mês) -> linhas = série, na ordem chave x parâmetro
+    forma = (len(tabela_chaves), n_meses)
+    soma = np.stack([s.reshape(forma) for s in somas], axis=1).reshape(-1, n_meses)
+    contagem = np.stack([c.reshape(forma) for c in contagens], axis=1).reshape(-1, n_meses)
+    with np.errstate(all='ignore'):
+        media = np.where(contagem > 0, soma / contagem, np.nan)
+    return tabela_chaves, media, contagem.astype('int64'), numeros
+
+
+def _compactar(media):
+    """Meses com dado de cada série encostados à esquerda (e a coluna de cada um)."""
+    ordem = np.argsort(np.isnan(media), axis=1, kind='stable')
+    valores = np.take_along_axis(media, ordem, axis=1)
+    largura = int((~np.isnan(media)).sum(axis=1).max()) if media.size else 0
+    return valores[:, :largura], ordem[:, :largura]
+
+
+def _empates(valores):
+    """Σ t(t-1)(2t+5) dos grupos de valores iguais de cada série (variância do MK)."""
+    ordenado = np.sort(valores, axis=1)
+    linhas, largura = ordenado.shape
+    inicio = np.ones_like(ordenado, dtype=bool)
+    # NaN nunca é igual a nada: cada vazio fica num grupo de tamanho 1
+    inicio[:, 1:] = ordenado[:, 1:] != ordenado[:, :-1]
+    grupo = np.cumsum(inicio.ravel()) - 1
+    t = np.bincount(grupo).astype('float64')
+    linha_do_grupo = np.repeat(np.arange(linhas), largura)[inicio.ravel()]
+    return np.bincount(linha_do_grupo, weights=t * (t - 1) * (2 * t + 5), minlength=linhas)
+
+
+def _mediana(valores):
+    """
+    Mediana no último eixo ignorando NaN. Ordenar e pegar o meio de cada linha
+    sai bem mais rápido que o np.nanmedian, que trata linha a linha.
+    """
+    ordenado = np.sort(valores, axis=-1)
+    n = (~np.isnan(valores)).sum(axis=-1)
+    baixo = np.take_along_axis(ordenado, np.maximum((n - 1) // 2, 0)[..., None], axis=-1)[..., 0]
+    alto = np.take_along_axis(ordenado, np.minimum(n // 2, valores.shape[-1] - 1)[..., None], axis=-1)[..., 0]
+    return np.where(n > 0, (baixo + alto) / 2, np.nan)
+
+
+def _tendencia_bloco(valores, meses):
+    """Estatística S do Mann-Kendall e inclinação de Sen (por mês) de um bloco."""
+    linhas, largura = valores.shape
+    if largura < 2:
+        return np.zeros(linhas), np.full(linhas, np.nan)
+    # Todos os pares (i < j) de meses com dado, defasagem por defasagem
+    inclinacoes = np.empty((linhas, largura * (largura - 1) // 2))
+    inicio = 0
+    with np.errstate(all='ignore'):
+        for k in range(1, largura):
+            fim = inicio + largura - k
+            np.divide(valores[:, k:] - valores[:, :-k], meses[:, k:] - meses[:, :-k], out=inclinacoes[:, inicio:fim])
+            inicio = fim
+    s = np.nansum(np.sign(inclinacoes), axis=1)
+    return s, _mediana(inclinacoes)
+
+
+def _anomalias_bloco(valores, janela=JANELA_ANOMALIA):
+    """z robusto de cada mês contra os `janela` meses com dado anteriores."""
+    preenchido = np.concatenate([np.full((len(valores), janela), np.nan), valores], axis=1)
+    janelas = sliding_window_view(preenchido, janela, axis=1)[:, :valores.shape[1], :]
+    mediana = _mediana(janelas)
+    mad = _mediana(np.abs(janelas - mediana[:, :, None]))
+    with np.errstate(all='ignore'):
+        z = 0.6745 * (valores - mediana) / mad
+    suficiente = (~np.isnan(janelas)).sum(axis=2) >= MIN_JANELA_ANOMALIA
+    return np.where(suficiente & (mad > 0), z, np.nan), mediana
+
+
+def _analisar(media, numeros):
+    """Testes de todas as séries, em blocos que cabem em LIMITE_VALORES_BLOCO."""
+    valores, colunas = _compactar(media)
+    meses = numeros[colunas] if len(numeros) else colunas
+    n_series, largura = valores.shape
+    s, sen, empates = np.zeros(n_series), np.full(n_series, np.nan), np.zeros(n_series)
+    z_robusto, mediana = np.full(valores.shape, np.nan), np.full(valores.shape, np.nan)
+
+    por_serie = max(largura * (largura - 1) // 2, largura * JANELA_ANOMALIA, 1)
+    bloco = max(1, LIMITE_VALORES_BLOCO // por_serie)
+    for inicio in range(0, n_series, bloco):
+        fatia = slice(inicio, inicio + bloco)
+        s[fatia], sen[fatia] = _tendencia_bloco(valores[fatia], meses[fatia])
+        empates[fatia] = _empates(valores[fatia])
+        z_robusto[fatia], mediana[fatia] = _anomalias_bloco(valores[fatia])
+    return valores, colunas, s, sen, empates, z_robusto, mediana
+
+
+def _rotulos(chaves, nivel, parametros):
+    """Uma linha por série: colunas da chave repetidas para cada parâmetro."""
+    rotulos = chaves.loc[chaves.index.repeat(len(parametros))].reset_index(drop=True)
+    rotulos.insert(0, 'nivel', nivel)
+    rotulos['parametro'] = np.tile(parametros, len(chaves))
+    return rotulos
+
+
+def _analisar_nivel(df, nivel, chaves, parametros):
+    tabela_chaves, media, contagem, numeros = _matriz_mensal(df, chaves, parametros)
+    rotulos = _rotulos(tabela_chaves, nivel, parametros)
+    valores, colunas, s, sen, empates, z_robusto, mediana = _analisar(media, numeros)
+
+    n = (~np.isnan(valores)).sum(axis=1)
+    var_s = (n * (n - 1) * (2 * n + 5) - empates) / 18.0
+    with np.errstate(all='ignore'):
+        z = np.where(s > 0, (s - 1) / np.sqrt(var_s), np.where(s < 0, (s + 1) / np.sqrt(var_s), 0.0))
+    z = np.where(var_s > 0, z, np.nan)
+    p = erfc(np.abs(z) / np.sqrt(2))  # bicaudal; NaN segue NaN
+    suficiente = n >= MIN_MESES_TENDENCIA
+    anomalia = np.abs(z_robusto) > LIMIAR_ANOMALIA
+
+    sentido = np.where(p < NIVEL_SIGNIFICANCIA, np.sign(s), 0).astype(int)
+    tendencia = np.where(suficiente, [ROTULOS_TENDENCIA[v] for v in sentido], ROTULO_INSUFICIENTE)
+    tem_dado = n > 0
+    primeira = colunas[:, 0] if colunas.shape[1] else np.zeros(len(n), dtype=int)
+    ultima = np.take_along_axis(colunas, np.maximum(n - 1, 0)[:, None], axis=1)[:, 0] if colunas.shape[1] else primeira
+    tendencias = rotulos.assign(
+        n_meses=n.astype('int32'),
+        inicio=_data_mes(numeros, primeira, tem_dado),
+        fim=_data_mes(numeros, ultima, tem_dado),
+        s=s, var_s=var_s,
+        z=np.where(suficiente, z, np.nan),
+        p_valor=np.where(suficiente, p, np.nan),
+        # Sen por mês -> por ano, na unidade do parâmetro
+        sen_por_ano=np.where(suficiente, sen * 12, np.nan),
+        tendencia=tendencia,
+        n_anomalias=anomalia.sum(axis=1).astype('int32'),
+    )
+
+    linha, posicao = np.nonzero(~np.isnan(valores))
+    coluna = colunas[linha, posicao]
+    series = rotulos.iloc[linha].reset_index(drop=True).assign(
+        mes=_data_mes(numeros, coluna),
+        media=valores[linha, posicao],
+        n_amostras=contagem[linha, coluna].astype('int32'),
+        mediana_movel=mediana[linha, posicao],
+        z_robusto=z_robusto[linha, posicao],
+        anomalia=anomalia[linha, posicao],
+    )
+    return tendencias, series
+
+
+def _data_mes(numeros, colunas, validos=None):
+    """Primeiro dia do mês de cada coluna da matriz (vazio onde validos=False)."""
+    if len(numeros) == 0:
+        return pd.Series(pd.NaT, index=range(len(colunas)), dtype='datetime64[us]')
+    datas = (numeros[colunas] - 1970 * 12).astype('datetime64[M]').astype('datetime64[us]')
+    if validos is not None:
+        datas = np.where(validos, datas, np.datetime64('NaT'))
+    return pd.Series(datas)
+
+
+def _tipos(df):
+    """Colunas da chave primeiro; texto categórico e id_estacao inteiro com vazio."""
+    chaves = ['nivel', 'municipio', 'rio', 'id_estacao', 'parametro']
+    df = df.reindex(columns=[c for c in chaves if c in df.columns] + [c for c in df.columns if c not in chaves])
+    for col in ['nivel', 'municipio', 'rio', 'parametro', 'tendencia']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    if 'id_estacao' in df.columns:
+        df['id_estacao'] = df['id_estacao'].astype('Int32')
+    return df
+
+
+def construir_tendencias(df, parametros=None, niveis=None):
+    """
+    (tendências, séries mensais) de todas as séries de todos os níveis.
+    Um nível sem alguma das colunas de chave na base fica de fora (ex.: sem
+    id_estacao, só o nível rio).
+    """
+    parametros = [p for p in (parametros or PARAMETROS_CUBO) if p in df.columns]
+    niveis = NIVEIS if niveis is None else niveis
+    partes_tendencias, partes_series = [], []
+    for nivel, chaves in niveis.items():
+        chaves = [c for c in chaves if c in df.columns]
+        if 'id_estacao' in niveis[nivel] and 'id_estacao' not in chaves:
+            continue
+        tendencias, series = _analisar_nivel(df, nivel, chaves, parametros)
+        partes_tendencias.append(tendencias)
+        partes_series.append(series)
+    return (_tipos(pd.concat(partes_tendencias, ignore_index=True)),
+            _tipos(pd.concat(partes_series, ignore_index=True)))
+
+
+def salvar_tendencias(df, caminho=CAMINHO_TENDENCIAS, caminho_series=CAMINHO_SERIES):
+    tendencias, series = construir_tendencias(df)
+    for tabela, destino in ((tendencias, caminho), (series, caminho_series)):
+        tmp = destino + ".tmp"
+        tabela.to_parquet(tmp, index=False)
+        os.replace(tmp, destino)
+    return tendencias, series
+
+
+def carregar_tendencias(caminho=CAMINHO_TENDENCIAS):
+    if not os.path.exists(caminho):
+        return None
+    return pd.read_parquet(caminho)
+
+
+def carregar_series(caminho=CAMINHO_SERIES):
+    if not os.path.exists(caminho):
+        return None
+    return pd.read_parquet(caminho)
+
+
+def ranking(tendencias, parametro, nivel='rio', rios=None):
+    """
+    Séries de um parâmetro ordenadas pela força da tendência (|z| maior
+    primeiro); as sem dados suficientes vão para o fim.
+    """
+    sel = tendencias[(tendencias['nivel'] == nivel) & (tendencias['parametro'] == parametro)]
+    if rios is not None:
+        sel = sel[sel['rio'].isin([str(r) for r in rios])]
+    return sel.assign(forca=sel['z'].abs()).sort_values('forca', ascending=False, na_position='last').drop(columns='forca')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tendências (Mann-Kendall/Sen) e anomalias por série")
+    parser.add_argument("--municipios", action="store_true",
+                        help="usa a base por município (estado inteiro) em vez da base de São Luís")
+    args = parser.parse_args()
+    if args.municipios:
+        base = armazenamento.ler_municipios()
+        destinos = (CAMINHO_TENDENCIAS_MUNICIPIOS, CAMINHO_SERIES_MUNICIPIOS)
+    else:
+        particoes = armazenamento.listar_particoes()
+        base = None if particoes is None or particoes.empty else armazenamento.ler_particoes(
+            particoes['ano'].unique(), particoes['rio'].dropna().unique())
+        destinos = (CAMINHO_TENDENCIAS, CAMINHO_SERIES)
+    if base is None or base.empty:
+        print("🚨 ERRO: Base tratada não encontrada. Rode o processamento_dados.py antes.")
+    else:
+        tendencias, series = salvar_tendencias(base, *destinos)
+        print(f"✅ {len(tendencias)} séries e {int(series['anomalia'].sum())} meses anômalos em: {destinos[0]}")